@@ -0,0 +1,422 @@
+"""
+Нагрузочный бенчмарк сервера хранилища.
+
+Поднимает App в отдельном процессе (против локальной MongoDB или, с
+--mongo mock, in-memory mongomock) и гоняет по нему смесь операций
+register / upload / download / list / delete из --concurrency потоков.
+Результат - JSON с пропускной способностью, задержками p50/p95/p99 по
+каждой операции и пиковым RSS процесса сервера, который можно сравнить
+с предыдущим прогоном через --compare.
+
+    python -m benchmarks.bench_server --mongo mock --duration 30 --output run.json
+    python -m benchmarks.bench_server --url http://127.0.0.1:8000 --compare run.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import socket
+import argparse
+import platform
+import threading
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+DEFAULT_MIX = "upload=4,download=4,list=2,delete=1,register=0.2"
+DEFAULT_SIZES = "1K=50,64K=30,1M=15,16M=5"
+SIZE_UNITS = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
+
+
+def parse_weights(value):
+    weights = {}
+
+    for item in value.split(","):
+        key, _, weight = item.partition("=")
+        weights[key.strip()] = float(weight or 1)
+
+    return weights
+
+
+def parse_size(value):
+    value = value.strip().upper()
+
+    if value[-1] in SIZE_UNITS:
+        return int(float(value[:-1]) * SIZE_UNITS[value[-1]])
+
+    return int(value)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+
+    values = sorted(values)
+    index = min(int(round(q / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def peak_rss_mb(pid):
+    # Пиковый RSS процесса сервера, доступен только на Linux
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    return None
+
+
+def serve(port, mongo):
+    """Режим процесса сервера: поднимает App на 127.0.0.1:port"""
+    from werkzeug.serving import make_server
+
+    from src import server
+
+    config = {"MONGODB_NAME": "benchmark_db"}
+
+    if mongo == "mock":
+        import mongomock
+
+        server.MongoClient = mongomock.MongoClient
+        config["MONGODB_CREATE_INDEXES"] = False
+
+    # Конфиг нужен уже в App.__init__, поэтому задается через default_config
+    app_class = type("BenchmarkApp", (server.App,), {
+        "default_config": {**server.App.default_config, **config}
+    })
+    app = app_class(__name__)
+    app.mongo_client.drop_database(config["MONGODB_NAME"])
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    make_server("127.0.0.1", port, app, threaded=True).serve_forever()
+
+
+def start_server(mongo):
+    port = free_port()
+    process = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.bench_server",
+        "--serve", str(port), "--mongo", mongo
+    ])
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Benchmark server exited during startup")
+
+        try:
+            requests.get(url + "/cache/stats/", timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+
+    process.kill()
+    raise RuntimeError("Benchmark server did not start")
+
+
+class Workload:
+    """
+    Состояние нагрузки: зарегистрированные пользователи и их файлы.
+    Каждая операция возвращает число переданных байт.
+    """
+
+    def __init__(self, url, sizes, seed):
+        self.url = url
+        self.sizes = sizes
+        self.lock = threading.Lock()
+        self.users = []
+        self.files = {}
+        self.counter = 0
+        rng = random.Random(seed)
+        self.payloads = {
+            size: bytes(rng.getrandbits(8) for _ in range(min(size, 1024))) * (size // 1024 + 1)
+            for size in sizes
+        }
+        self.local = threading.local()
+
+    @property
+    def session(self):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+
+        return self.local.session
+
+    def auth(self, login, password):
+        return {"authorization": f"{login} {password}"}
+
+    def register(self, rng):
+        with self.lock:
+            self.counter += 1
+            login = f"bench_{os.getpid()}_{self.counter}"
+
+        password = "password"
+        response = self.session.post(self.url + "/register/", json={
+            "credentials": {"login": login, "password": password}
+        })
+        response.raise_for_status()
+
+        with self.lock:
+            self.users.append((login, password))
+            self.files[login] = []
+
+        return 0
+
+    def pick_user(self, rng):
+        with self.lock:
+            return rng.choice(self.users)
+
+    def upload(self, rng):
+        login, password = self.pick_user(rng)
+        size = rng.choices(list(self.sizes), list(self.sizes.values()))[0]
+        response = self.session.post(
+            self.url + "/file_storage/",
+            params={"filename": f"bench_{size}.csv"},
+            data=self.payloads[size][:size],
+            headers=self.auth(login, password)
+        )
+        response.raise_for_status()
+
+        with self.lock:
+            self.files[login].append(response.json()["file_guid"])
+
+        return size
+
+    def download(self, rng):
+        login, password = self.pick_user(rng)
+
+        with self.lock:
+            if not self.files[login]:
+                return None
+
+            file_guid = rng.choice(self.files[login])
+
+        response = self.session.get(
+            self.url + "/file_storage/",
+            params={"file_guid": file_guid},
+            headers={"accept-encoding": "identity"}
+        )
+
+        # Файл могли удалить параллельно
+        if response.status_code == 400:
+            return None
+
+        response.raise_for_status()
+        return len(response.content)
+
+    def list(self, rng):
+        login, password = self.pick_user(rng)
+        response = self.session.get(
+            self.url + "/file_storage/all/",
+            params={"limit": 100},
+            headers=self.auth(login, password)
+        )
+        response.raise_for_status()
+        return len(response.content)
+
+    def delete(self, rng):
+        login, password = self.pick_user(rng)
+
+        with self.lock:
+            files = self.files[login]
+            batch, self.files[login] = files[:10], files[10:]
+
+        if not batch:
+            return None
+
+        response = self.session.delete(
+            self.url + "/file_storage/",
+            json={"files": batch},
+            headers=self.auth(login, password)
+        )
+        response.raise_for_status()
+        return 0
+
+
+def run_benchmark(url, mix, sizes, concurrency, duration, operations, users, seed):
+    workload = Workload(url, sizes, seed)
+    setup_rng = random.Random(seed)
+
+    for _ in range(users):
+        workload.register(setup_rng)
+
+    results = {name: {"latencies": [], "bytes": 0, "errors": 0, "skipped": 0} for name in mix}
+    results_lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    remaining = [operations]
+
+    def take_operation():
+        with results_lock:
+            if operations:
+                if remaining[0] <= 0:
+                    return False
+
+                remaining[0] -= 1
+                return True
+
+        return time.monotonic() < deadline
+
+    def worker(index):
+        rng = random.Random(seed + index + 1)
+        names, weights = list(mix), list(mix.values())
+
+        while take_operation():
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+
+            try:
+                transferred = getattr(workload, name)(rng)
+                error = False
+            except Exception:
+                transferred, error = 0, True
+
+            latency = time.perf_counter() - started
+
+            with results_lock:
+                result = results[name]
+
+                if error:
+                    result["errors"] += 1
+                elif transferred is None:
+                    result["skipped"] += 1
+                else:
+                    result["latencies"].append(latency)
+                    result["bytes"] += transferred
+
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+
+    elapsed = time.monotonic() - started
+    report = {}
+
+    for name, result in results.items():
+        latencies = result["latencies"]
+        report[name] = {
+            "count": len(latencies),
+            "errors": result["errors"],
+            "skipped": result["skipped"],
+            "ops_per_sec": len(latencies) / elapsed,
+            "mb_per_sec": result["bytes"] / elapsed / (1024 * 1024),
+            "latency_ms": {
+                "mean": sum(latencies) / len(latencies) * 1000 if latencies else None,
+                "p50": percentile(latencies, 50) * 1000 if latencies else None,
+                "p95": percentile(latencies, 95) * 1000 if latencies else None,
+                "p99": percentile(latencies, 99) * 1000 if latencies else None,
+                "max": max(latencies) * 1000 if latencies else None
+            }
+        }
+
+    total = sum(item["count"] for item in report.values())
+    total_bytes = sum(result["bytes"] for result in results.values())
+
+    return {
+        "elapsed_sec": elapsed,
+        "ops_per_sec": total / elapsed,
+        "mb_per_sec": total_bytes / elapsed / (1024 * 1024),
+        "errors": sum(item["errors"] for item in report.values()),
+        "operations": report
+    }
+
+
+def compare(current, baseline):
+    """Печатает изменение пропускной способности и p95 относительно baseline"""
+    for name, item in current["operations"].items():
+        base = baseline["operations"].get(name)
+
+        if base is None or not base["count"] or not item["count"]:
+            continue
+
+        throughput = (item["ops_per_sec"] / base["ops_per_sec"] - 1) * 100
+        p95 = (item["latency_ms"]["p95"] / base["latency_ms"]["p95"] - 1) * 100
+        print(f"{name:10} ops/s {throughput:+7.1f}%   p95 {p95:+7.1f}%", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="File storage server benchmark")
+    parser.add_argument("--url", help="Адрес уже запущенного сервера (по умолчанию сервер поднимается сам)")
+    parser.add_argument("--mongo", choices=["local", "mock"], default="local")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Веса операций, например upload=4,list=1")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Распределение размеров загрузок, например 1K=50,1M=5")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30, help="Длительность в секундах")
+    parser.add_argument("--operations", type=int, default=0, help="Число операций вместо длительности")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Файл для JSON отчета (по умолчанию stdout)")
+    parser.add_argument("--compare", help="JSON отчет предыдущего прогона")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.mongo)
+        return
+
+    mix = parse_weights(args.mix)
+    unknown = set(mix) - {"register", "upload", "download", "list", "delete"}
+
+    if unknown:
+        parser.error(f"Unknown operations: {', '.join(sorted(unknown))}")
+
+    sizes = {parse_size(size): weight for size, weight in parse_weights(args.sizes).items()}
+    process = None
+    url = args.url
+
+    if url is None:
+        process, url = start_server(args.mongo)
+
+    try:
+        result = run_benchmark(
+            url.rstrip("/"), mix, sizes, args.concurrency,
+            args.duration, args.operations, args.users, args.seed
+        )
+        result["peak_rss_mb"] = peak_rss_mb(process.pid) if process else None
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "params": {
+            "url": args.url,
+            "mongo": args.mongo if args.url is None else None,
+            "mix": mix,
+            "sizes": sizes,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "operations": args.operations,
+            "users": args.users,
+            "seed": args.seed
+        },
+        **result
+    }
+    output = json.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
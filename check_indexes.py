@@ -0,0 +1,13 @@
+import sys
+
+from src.server import App
+from src.utils.indexes import ensure_indexes, audit_query_plans
+
+app = App(__name__)
+ensure_indexes(app.db)
+problems = audit_query_plans(app.db)
+
+for stage, (collection_name, query_filter, projection, sort, limit) in problems:
+    print(f"{stage}: {collection_name}.find({query_filter}, {projection}, sort={sort}, limit={limit})")
+
+sys.exit(1 if problems else 0)
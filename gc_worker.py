@@ -0,0 +1,30 @@
+import sys
+import json
+import logging
+
+from src.server import App
+from src.utils.garbage_collection import GarbageCollector
+
+logging.basicConfig(level=logging.INFO)
+
+app = App(__name__)
+collector = GarbageCollector(
+    app.db, app.blob_storage,
+    grace_period=app.config.get("GC_GRACE_PERIOD", 2 * 24 * 60 * 60),
+    batch_size=app.config.get("GC_BATCH_SIZE", 100),
+    duty_cycle=app.config.get("GC_DUTY_CYCLE", 0.1),
+    idle_interval=app.config.get("GC_IDLE_INTERVAL", 30),
+    changes_retention=app.config.get("CHANGES_RETENTION", 30 * 24 * 60 * 60)
+)
+
+# python3 gc_worker.py --once [--compact] - один полный проход и отчет в JSON
+if "--once" in sys.argv:
+    while collector.run_once():
+        pass
+
+    if "--compact" in sys.argv:
+        app.db.command("compact", "chunks")
+
+    print(json.dumps(dict(collector.stats)))
+else:
+    collector.run()
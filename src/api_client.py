@@ -1,20 +1,606 @@
 import os
+import json
+import mmap
+import shutil
+import time
+import hashlib
+import threading
 import requests
 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+from .utils import constants
+
+
+def etag_sha256(etag):
+    # ETag файла - sha256 его содержимого, только пока сервер не посчитал
+    # хеш, ETag строится по GUID файла, и сверять с ним содержимое нельзя
+    if etag is not None and len(etag) == 64 and not etag.strip("0123456789abcdef"):
+        return etag
+
+    return None
+
 
 class ApiClient:
+    """
+    Клиент API сервера поверх одной requests.Session: соединения
+    переиспользуются (keep-alive, пул на pool_size соединений), запросы
+    по таймауту timeout, идемпотентные запросы повторяются retries раз
+    с экспоненциальной задержкой при сетевых ошибках и ответах 502-504.
+    Если передан cache (LocalCache), страницы списка файлов и скачанное
+    содержимое берутся из него, пока сервер подтверждает их актуальность.
+    """
 
-    def __init__(self, login, password):
+    def __init__(self, login, password, pool_size=constants.HTTP_POOL_SIZE,
+                 retries=constants.HTTP_RETRIES, backoff=constants.HTTP_BACKOFF,
+                 timeout=constants.HTTP_TIMEOUT, compression=True, cache=None):
         self.login = login
         self.password = password
+        self.cache = cache
+        self.token = None
+        self.timeout = timeout
+        self.chunk_size = constants.UPLOAD_CHUNK_SIZE
         self.base_url = f"http://{os.environ.get('server_address', '127.0.0.1:8000')}/"
 
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=backoff,
+                status_forcelist=(502, 503, 504),
+                raise_on_status=False
+            )
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["authorization"] = f"{self.login} {self.password}"
+        self.session.headers["accept-encoding"] = "gzip, deflate" if compression else "identity"
+
     def req(self, http_method, api_method, **kwargs):
-        headers = kwargs.pop("headers", {})
-        headers["authorization"] = f"{self.login} {self.password}"
+        kwargs.setdefault("timeout", self.timeout)
 
-        return requests.request(
+        # Все маршруты сервера заканчиваются на "/", без него Flask
+        # отвечает редиректом, и каждый запрос стоил бы два
+        path, _, query = api_method.partition("?")
+
+        if not path.endswith("/"):
+            path += "/"
+
+        response = self.session.request(
             http_method,
-            self.base_url + api_method,
-            headers=headers, **kwargs
+            self.base_url + path + ("?" + query if query else ""),
+            **kwargs
         )
+
+        # Токен сессии выдается сервером на register/check
+        token = response.headers.get("x-auth-token")
+
+        if token is not None:
+            self.token = token
+            self.session.headers["x-auth-token"] = token
+
+        return response
+
+    def close(self):
+        self.session.close()
+
+    def list_files(self, cursor=None, limit=constants.FILES_PAGE_SIZE):
+        """
+        Страница списка файлов: (файлы, next_cursor). Сохраненная в кеше
+        страница перепроверяется по ETag, и при ответе 304 тело не передается.
+        """
+        request_params = {"limit": limit}
+
+        if cursor is not None:
+            request_params["cursor"] = cursor
+
+        etag, body = (None, None) if self.cache is None else self.cache.get_listing(self.login, request_params)
+        headers = {"if-none-match": f'"{etag}"'} if etag is not None else {}
+        response = self.req("GET", "file_storage/all", params=request_params, headers=headers)
+
+        if response.status_code != 304 or body is None:
+            response.raise_for_status()
+            body = response.json()
+            etag = response.headers.get("etag", "").strip('"')
+
+            if self.cache is not None and etag:
+                self.cache.set_listing(self.login, request_params, etag, body)
+
+        return body["files"], body.get("next_cursor")
+
+    def hash_file_chunks(self, file_path, chunk_size):
+        # Хеши чанков и всего содержимого за одно чтение файла
+        chunk_hashes = []
+        content_hash = hashlib.sha256()
+
+        with open(file_path, "rb") as f:
+            while True:
+                data = f.read(chunk_size)
+
+                if not data:
+                    break
+
+                chunk_hashes.append(hashlib.sha256(data).hexdigest())
+                content_hash.update(data)
+
+        return chunk_hashes, content_hash.hexdigest()
+
+    def upload_file(self, file_path, progress=None):
+        """
+        Загрузка файла с дедупликацией: сервер получает хеши чанков файла,
+        отвечает, каких чанков у него нет, и передаются только они.
+        progress(done, total) вызывается после каждого чанка.
+        Возвращает GUID созданного файла.
+        """
+        file_path = Path(file_path)
+        chunk_hashes, sha256 = self.hash_file_chunks(file_path, self.chunk_size)
+        response = self.req("POST", "file_storage/negotiate", json={"chunks": chunk_hashes})
+        response.raise_for_status()
+        negotiation = response.json()
+
+        # Файл нужно резать тем же размером чанка, что и сервер
+        if negotiation["chunk_size"] != self.chunk_size:
+            self.chunk_size = negotiation["chunk_size"]
+            return self.upload_file(file_path, progress)
+
+        missing = set(negotiation["missing"])
+        file_size = file_path.stat().st_size
+
+        with open(file_path, "rb") as f:
+            for i, chunk_hash in enumerate(chunk_hashes):
+                if chunk_hash not in missing:
+                    continue
+
+                missing.discard(chunk_hash)
+                f.seek(i * self.chunk_size)
+                response = self.req(
+                    "PUT", "file_storage/chunks",
+                    params={"hash": chunk_hash},
+                    data=f.read(self.chunk_size)
+                )
+                response.raise_for_status()
+
+                if progress is not None:
+                    progress(min((i + 1) * self.chunk_size, file_size), file_size)
+
+        response = self.req("POST", "file_storage/commit", json={
+            "filename": file_path.name,
+            "chunks": chunk_hashes,
+            "sha256": sha256
+        })
+
+        # Сборщик мусора удалил чанки до commit: negotiate вернет их как недостающие
+        if response.status_code == 409:
+            return self.upload_file(file_path, progress)
+
+        response.raise_for_status()
+        return response.json()["file_guid"]
+
+    def load_upload_state(self, state_path):
+        try:
+            return json.loads(Path(state_path).read_text())
+        except (OSError, ValueError, TypeError):
+            return {}
+
+    def save_upload_state(self, state_path, state):
+        if state_path is not None:
+            Path(state_path).write_text(json.dumps(state))
+
+    def upload_part(self, session_id, index, data):
+        for attempt in range(constants.UPLOAD_PART_RETRIES):
+            try:
+                response = self.req("PUT", f"upload_sessions/{session_id}/parts/{index}/", data=data)
+                response.raise_for_status()
+                return
+            except requests.RequestException:
+                if attempt == constants.UPLOAD_PART_RETRIES - 1:
+                    raise
+
+                time.sleep(2 ** attempt)
+
+    def upload_parts(self, upload_part, indexes, workers, check_cancelled=None):
+        """
+        Отправляет части в workers потоков. Новая часть ставится в очередь,
+        только когда освободился поток, поэтому после отмены или ошибки
+        дожидаются только уже начатые части.
+        """
+        with ThreadPoolExecutor(workers) as executor:
+            pending = set()
+
+            try:
+                for index in indexes:
+                    if check_cancelled is not None:
+                        check_cancelled()
+
+                    if len(pending) >= workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                        for future in done:
+                            future.result()
+
+                    pending.add(executor.submit(upload_part, index))
+
+                for future in pending:
+                    future.result()
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+
+                raise
+
+    @staticmethod
+    def is_cancelled(check_cancelled):
+        if check_cancelled is None:
+            return False
+
+        try:
+            check_cancelled()
+        except Exception:
+            return True
+
+        return False
+
+    def abort_upload(self, session_id):
+        try:
+            self.req("DELETE", f"upload_sessions/{session_id}/")
+        except requests.RequestException:
+            pass
+
+    def upload_multipart(self, file_path, workers=constants.UPLOAD_WORKERS, state_path=None,
+                         progress=None, check_cancelled=None):
+        """
+        Загрузка большого файла по частям в несколько потоков.
+        Файл отображается в память, части отправляются параллельно с повторами.
+        Если передан state_path, id сессии сохраняется в нем, и прерванная
+        загрузка того же файла продолжится с недостающих частей.
+        progress(done, total) вызывается после каждой отправленной части.
+        check_cancelled() вызывается перед отправкой каждой части и бросает
+        исключение, если загрузку отменили: тогда неначатые части не
+        отправляются, а сессия загрузки удаляется на сервере.
+        Возвращает GUID созданного файла.
+        """
+        file_path = Path(file_path).resolve()
+        file_stat = file_path.stat()
+
+        if file_stat.st_size == 0:
+            return self.upload_file(file_path, progress)
+
+        state = self.load_upload_state(state_path)
+        state_key = f"{file_path}:{file_stat.st_size}:{file_stat.st_mtime_ns}"
+        session = None
+
+        if state_key in state:
+            response = self.req("GET", f"upload_sessions/{state[state_key]}/")
+
+            if response.ok:
+                session = response.json()
+
+        if session is None:
+            response = self.req("POST", "upload_sessions/", json={
+                "filename": file_path.name,
+                "size": file_stat.st_size,
+                "part_size": constants.UPLOAD_PART_SIZE
+            })
+            response.raise_for_status()
+            session = response.json()
+            session["received"] = []
+            state[state_key] = session["session_id"]
+            self.save_upload_state(state_path, state)
+
+        session_id = session["session_id"]
+        part_size = session["part_size"]
+        received = set(session["received"])
+        done = [len(received) * part_size]
+        done_lock = threading.Lock()
+
+        # Хеш всего файла сервер сверит с тем, что посчитает сам
+        sha256 = self.file_sha256(file_path)
+
+        while True:
+            with open(file_path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    def upload_part(index):
+                        data = mm[index * part_size:(index + 1) * part_size]
+                        self.upload_part(session_id, index, data)
+
+                        if progress is not None:
+                            with done_lock:
+                                done[0] += len(data)
+                                progress(min(done[0], file_stat.st_size), file_stat.st_size)
+
+                    try:
+                        self.upload_parts(upload_part, [
+                            index for index in range(session["parts_count"])
+                            if index not in received
+                        ], workers, check_cancelled)
+                    except BaseException:
+                        # Отмененную загрузку не продолжить, ее части на сервере не нужны
+                        if self.is_cancelled(check_cancelled):
+                            self.abort_upload(session_id)
+                            state.pop(state_key, None)
+                            self.save_upload_state(state_path, state)
+
+                        raise
+
+            received = set(range(session["parts_count"]))
+            response = self.req("POST", f"upload_sessions/{session_id}/complete/", json={"sha256": sha256})
+
+            if response.status_code != 409:
+                break
+
+            # Сборщик мусора удалил чанки частей до сборки файла: сервер
+            # убрал эти части из сессии, и они отправляются заново
+            received -= set(response.json()["parts"])
+
+        response.raise_for_status()
+        state.pop(state_key, None)
+        self.save_upload_state(state_path, state)
+        return response.json()["file_guid"]
+
+    def load_download_state(self, state_path, etag, size):
+        try:
+            state = json.loads(state_path.read_text())
+
+            if state["etag"] == etag and state["size"] == size:
+                return state
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        return {"etag": etag, "size": size, "done": []}
+
+    def file_sha256(self, file_path):
+        content_hash = hashlib.sha256()
+
+        with open(file_path, "rb") as f:
+            for data in iter(lambda: f.read(constants.DOWNLOAD_READ_SIZE), b""):
+                content_hash.update(data)
+
+        return content_hash.hexdigest()
+
+    def download_range(self, file_guid, part_path, etag, start, end, on_data):
+        headers = {
+            "range": f"bytes={start}-{end - 1}",
+            "if-range": f'"{etag}"',
+            "accept-encoding": "identity"
+        }
+        request_params = {"file_guid": file_guid}
+
+        with self.req("GET", "file_storage", params=request_params, headers=headers, stream=True) as response:
+            response.raise_for_status()
+
+            # Файл изменился или сервер проигнорировал Range
+            if response.status_code != 206:
+                raise ValueError("Range request was not honoured")
+
+            with open(part_path, "r+b") as f:
+                f.seek(start)
+
+                for data in response.iter_content(constants.DOWNLOAD_READ_SIZE):
+                    f.write(data)
+                    on_data(len(data))
+
+    def download_file(self, file_guid, file_path, progress=None, workers=constants.DOWNLOAD_WORKERS):
+        """
+        Скачивает файл во временный файл <имя>.part и атомарно переименовывает
+        его после проверки sha256 из ETag сервера (если ETag - хеш). Если
+        сервер поддерживает Range, файл качается частями в несколько потоков,
+        а номера скачанных частей пишутся в <имя>.part.json, так что
+        прерванное скачивание продолжится с недостающих частей. Память
+        клиента не зависит от размера файла.
+        progress(done, total) вызывается по мере записи данных.
+        """
+        file_path = Path(file_path)
+        part_path = file_path.with_name(file_path.name + ".part")
+        state_path = file_path.with_name(file_path.name + ".part.json")
+        request_params = {"file_guid": file_guid}
+
+        response = self.req(
+            "HEAD", "file_storage",
+            params=request_params,
+            headers={"accept-encoding": "identity"}
+        )
+        response.raise_for_status()
+        size = int(response.headers.get("content-length", 0))
+        etag = response.headers.get("etag", "").strip('"') or None
+        ranges_supported = response.headers.get("accept-ranges") == "bytes" and etag is not None
+
+        sha256 = etag_sha256(etag)
+
+        if sha256 is not None and self.copy_cached(sha256, size, file_path, part_path):
+            if progress is not None:
+                progress(size, size)
+
+            return
+
+        if ranges_supported and size >= constants.DOWNLOAD_PARALLEL_THRESHOLD:
+            state = self.load_download_state(state_path, etag, size)
+
+            if not part_path.exists() or not state["done"]:
+                state["done"] = []
+
+                with open(part_path, "wb") as f:
+                    f.truncate(size)
+
+            part_size = constants.DOWNLOAD_PART_SIZE
+            done_parts = set(state["done"])
+            done = [sum(min(part_size, size - index * part_size) for index in done_parts)]
+            state_lock = threading.Lock()
+
+            def on_data(length):
+                with state_lock:
+                    done[0] += length
+                    current = done[0]
+
+                if progress is not None:
+                    progress(current, size)
+
+            def download_part(index):
+                start = index * part_size
+                self.download_range(
+                    file_guid, part_path, etag,
+                    start, min(start + part_size, size), on_data
+                )
+
+                with state_lock:
+                    state["done"].append(index)
+                    state_path.write_text(json.dumps(state))
+
+            with ThreadPoolExecutor(workers) as executor:
+                list(executor.map(download_part, [
+                    index for index in range(-(-size // part_size))
+                    if index not in done_parts
+                ]))
+        else:
+            done = 0
+
+            with self.req("GET", "file_storage", params=request_params, stream=True) as response:
+                response.raise_for_status()
+                size = int(response.headers.get("content-length", 0))
+                # При сжатой отдаче к хешу в ETag добавлен суффикс кодирования
+                etag = response.headers.get("etag", "").strip('"').partition("-")[0] or None
+
+                with open(part_path, "wb") as f:
+                    for data in response.iter_content(constants.DOWNLOAD_READ_SIZE):
+                        f.write(data)
+                        done += len(data)
+
+                        if progress is not None:
+                            progress(done, size)
+
+        sha256 = etag_sha256(etag)
+
+        if sha256 is not None and self.file_sha256(part_path) != sha256:
+            part_path.unlink()
+
+            if state_path.exists():
+                state_path.unlink()
+
+            raise ValueError("Downloaded file checksum mismatch")
+
+        os.replace(part_path, file_path)
+
+        if state_path.exists():
+            state_path.unlink()
+
+        if self.cache is not None and sha256 is not None:
+            self.cache.put_blob(sha256, file_path)
+
+    def copy_cached(self, sha256, size, file_path, part_path):
+        """
+        Без передачи по сети получает файл с содержимым sha256: он уже лежит
+        по file_path или его копия есть в кеше. Возвращает True, если вышло.
+        """
+        if file_path.exists() and file_path.stat().st_size == size and self.file_sha256(file_path) == sha256:
+            return True
+
+        blob_path = None if self.cache is None else self.cache.get_blob(sha256)
+
+        if blob_path is None:
+            return False
+
+        shutil.copyfile(blob_path, part_path)
+        os.replace(part_path, file_path)
+        return True
+
+    def delete_files(self, file_guids):
+        response = self.req("DELETE", "file_storage", json={"files": list(file_guids)})
+        response.raise_for_status()
+
+    def upload_batch(self, file_paths):
+        """
+        Загружает несколько небольших файлов одним multipart запросом,
+        возвращает список GUID в порядке file_paths
+        """
+        file_objects = [open(file_path, "rb") for file_path in file_paths]
+
+        try:
+            response = self.req("POST", "file_storage/batch", files=[
+                ("file", (Path(file_path).name, f))
+                for file_path, f in zip(file_paths, file_objects)
+            ])
+            response.raise_for_status()
+        finally:
+            for f in file_objects:
+                f.close()
+
+        return [file["file_guid"] for file in response.json()["files"]]
+
+    def upload_files(self, file_paths, workers=constants.UPLOAD_WORKERS):
+        """
+        Загружает несколько файлов: небольшие уходят пачками через
+        file_storage/batch (не больше BATCH_UPLOAD_MAX_FILES файлов и
+        BATCH_UPLOAD_MAX_BYTES байт на запрос), крупные - по одному
+        с дедупликацией. Запросы идут параллельно по общему пулу соединений.
+        Возвращает список GUID в порядке file_paths.
+        """
+        file_paths = [Path(file_path) for file_path in file_paths]
+        uploads = []
+        batch, batch_bytes = [], 0
+
+        for index, file_path in enumerate(file_paths):
+            size = file_path.stat().st_size
+
+            if size >= constants.BATCH_UPLOAD_MAX_BYTES:
+                uploads.append((False, [index]))
+                continue
+
+            if len(batch) == constants.BATCH_UPLOAD_MAX_FILES or batch_bytes + size > constants.BATCH_UPLOAD_MAX_BYTES:
+                uploads.append((True, batch))
+                batch, batch_bytes = [], 0
+
+            batch.append(index)
+            batch_bytes += size
+
+        if batch:
+            uploads.append((True, batch))
+
+        def upload(item):
+            is_batch, indexes = item
+
+            if is_batch:
+                return self.upload_batch([file_paths[index] for index in indexes])
+
+            return [self.upload_file(file_paths[indexes[0]])]
+
+        file_guids = [None] * len(file_paths)
+
+        with ThreadPoolExecutor(workers) as executor:
+            for (_, indexes), guids in zip(uploads, executor.map(upload, uploads)):
+                for index, file_guid in zip(indexes, guids):
+                    file_guids[index] = file_guid
+
+        return file_guids
+
+    def files_metadata(self, file_guids):
+        response = self.req("POST", "file_storage/metadata", json={"files": list(file_guids)})
+        response.raise_for_status()
+        return response.json()["files"]
+
+    def download_archive(self, file_guids, file_path, progress=None):
+        """
+        Скачивает zip архив с файлами file_guids потоком во временный файл
+        и переименовывает его по окончании. Размер архива заранее неизвестен,
+        поэтому progress(done, 0) получает только число скачанных байт.
+        """
+        file_path = Path(file_path)
+        part_path = file_path.with_name(file_path.name + ".part")
+        done = 0
+
+        with self.req("POST", "file_storage/archive", json={"files": list(file_guids)}, stream=True) as response:
+            response.raise_for_status()
+
+            with open(part_path, "wb") as f:
+                for data in response.iter_content(constants.DOWNLOAD_READ_SIZE):
+                    f.write(data)
+                    done += len(data)
+
+                    if progress is not None:
+                        progress(done, 0)
+
+        os.replace(part_path, file_path)
@@ -0,0 +1,862 @@
+import io
+import os
+import sys
+import json
+import math
+import asyncio
+import logging
+import hashlib
+import functools
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+from werkzeug import exceptions as http_exceptions
+from werkzeug.datastructures import Headers, MultiDict
+from werkzeug.http import (
+    parse_etags, parse_range_header, parse_if_range_header, parse_accept_header, quote_etag
+)
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from .server import App
+from .utils.authorization import (
+    AuthorizationContext, password_hash_fingerprint, parse_registration,
+    parse_authorization_header
+)
+from .utils.indexes import ensure_indexes
+from .utils.migrations import (
+    backfill_created_at, backfill_chunk_refs, backfill_chunk_grants, backfill_used_bytes
+)
+from .utils.limits import QuotaExceeded, reserve_bytes, release_bytes, has_quota
+from .utils.garbage_collection import MissingChunks, add_chunk_refs, soft_delete_files
+from .utils.changes import (
+    CursorExpired, record_changes, read_changes, current_seq, change_doc_to_json,
+    PAGE_SIZE as CHANGES_PAGE_SIZE, MAX_WAIT as CHANGES_MAX_WAIT,
+    POLL_INTERVAL as CHANGES_POLL_INTERVAL
+)
+from .utils.listing import ListingQuery, LISTING_PROJECTION, SERVE_PROJECTION, file_doc_to_json
+from .utils.blob_storage import create_blob_storage, stored_content_encoding
+from .utils.http import content_disposition, guess_mimetype
+from .utils.files import new_file_document, content_key
+from .utils.mongo import mongo_client_options
+
+
+class Request:
+
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self.receive = receive
+        self.method = scope["method"]
+        self.path = scope["path"] if scope["path"].endswith("/") else scope["path"] + "/"
+        self.args = MultiDict(parse_qsl(scope.get("query_string", b"").decode(), keep_blank_values=True))
+        self.headers = Headers([
+            (key.decode("latin-1"), value.decode("latin-1"))
+            for key, value in scope["headers"]
+        ])
+
+    @property
+    def mimetype(self):
+        return self.headers.get("content-type", "").split(";")[0].strip().lower()
+
+    async def iter_body(self):
+        more_body = True
+
+        while more_body:
+            message = await self.receive()
+
+            if message["type"] == "http.disconnect":
+                raise ConnectionError("Client disconnected")
+
+            more_body = message.get("more_body", False)
+            yield message.get("body", b"")
+
+    async def get_json(self):
+        return json.loads(b"".join([piece async for piece in self.iter_body()]) or b"null")
+
+
+class Response:
+
+    def __init__(self, body=b"", status=200, headers=None, mimetype="text/html"):
+        self.body = body.encode() if isinstance(body, str) else body
+        self.status = status
+        self.headers = Headers(headers or {})
+        self.headers.setdefault("Content-Type", mimetype)
+
+        if isinstance(self.body, bytes):
+            self.headers["Content-Length"] = str(len(self.body))
+
+    async def send(self, request, send):
+        await send({
+            "type": "http.response.start",
+            "status": self.status,
+            "headers": [
+                (key.lower().encode("latin-1"), value.encode("latin-1"))
+                for key, value in self.headers.items()
+            ]
+        })
+
+        if request.method == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+        elif isinstance(self.body, bytes):
+            await send({"type": "http.response.body", "body": self.body})
+        else:
+            async for piece in self.body:
+                await send({"type": "http.response.body", "body": piece, "more_body": True})
+
+            await send({"type": "http.response.body", "body": b""})
+
+
+class WsgiInput(io.RawIOBase):
+    """
+    wsgi.input для Flask App, который выполняется в пуле потоков:
+    сообщения тела запроса забираются из receive через event loop
+    """
+
+    def __init__(self, request, loop):
+        self.pieces = request.iter_body()
+        self.loop = loop
+        self.buffer = b""
+        self.finished = False
+
+    def readable(self):
+        return True
+
+    async def next_piece(self):
+        return await self.pieces.__anext__()
+
+    def readinto(self, b):
+        while not self.buffer and not self.finished:
+            try:
+                self.buffer = asyncio.run_coroutine_threadsafe(self.next_piece(), self.loop).result()
+            except StopAsyncIteration:
+                self.finished = True
+
+        size = min(len(b), len(self.buffer))
+        b[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+
+def wsgi_environ(request, loop):
+    scope = request.scope
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": request.method,
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": str(client[0]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BufferedReader(WsgiInput(request, loop)),
+        # Конец тела определяется потоком, а не Content-Length (chunked загрузки)
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+
+    for key, value in request.headers.items():
+        key = key.upper().replace("-", "_")
+
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = "HTTP_" + key
+
+        environ[key] = environ[key] + "," + value if key in environ else value
+
+    return environ
+
+
+def json_response(data, status=200):
+    return Response(json.dumps(data), status, mimetype="application/json")
+
+
+def is_authorized(authorize_methods):
+    """
+    Асинхронный аналог server.is_authorized с той же семантикой:
+    токен из x-auth-token, иначе заголовок authorization ("логин пароль")
+    """
+
+    def is_authorized_wrapper(f):
+
+        @functools.wraps(f)
+        async def wrapper(self, request):
+            method = "GET" if request.method == "HEAD" else request.method
+
+            if method not in authorize_methods:
+                return await f(self, request, None)
+
+            token = request.headers.get("x-auth-token")
+
+            if token is not None:
+                ctx = await self.authorize_token(request, token)
+
+                if ctx is not None:
+                    return await self.handle_authorized(f, request, ctx)
+
+            try:
+                login, password = parse_authorization_header(request.headers["authorization"])
+                password_hash = await self.get_password_hash(login)
+            except (KeyError, ValueError, TypeError):
+                return self.error_response(http_exceptions.Unauthorized)
+            except Exception as e:
+                logging.error(f"Client authorization error\n{str(e)}")
+                return self.error_response(http_exceptions.InternalServerError)
+
+            verified = await asyncio.wrap_future(
+                self.password_verifier.verify_future(login, password_hash, password)
+            )
+
+            if verified:
+                if self.password_verifier.needs_rehash(password_hash):
+                    password_hash = await self.rehash_password(login, password_hash, password)
+
+                ctx = AuthorizationContext(request, login, password_hash)
+                return await self.handle_authorized(f, request, ctx)
+
+            return self.error_response(http_exceptions.Unauthorized)
+
+        return wrapper
+
+    return is_authorized_wrapper
+
+
+class AsyncApp:
+    """
+    ASGI версия сервера с теми же маршрутами, авторизацией и форматом ошибок,
+    что и App. Основные маршруты (self.routes) обслуживаются нативно: запросы
+    к users и files идут через Motor, тела запросов и ответов передаются
+    потоком. Чанки читаются и пишутся тем же BlobStorage, что и у App, в пуле
+    потоков, чтобы формат хранилища был общим. Загрузка файла поддерживается
+    в режиме "сырого" тела с параметром filename.
+    Кеши списков, метаданных и тел файлов, ETag и 304, выбор кодека на файл
+    и отдача сжатых чанков с Content-Encoding такие же, как у App.
+    Остальные маршруты App (чанки, сессии загрузки, batch, архивы, ссылки,
+    метрики и т.д.) выполняются самим App через WSGI в пуле потоков.
+    """
+
+    def __init__(self, config=None):
+        self.config = dict(config or {})
+        self.executor = ThreadPoolExecutor(self.config.get("ASYNC_BLOCKING_WORKERS", 32))
+        self.sync_db = MongoClient(
+            self.config.get("MONGODB_HOST", "localhost"),
+            self.config.get("MONGODB_PORT", 27017),
+            **mongo_client_options(self.config)
+        )[self.config.get("MONGODB_NAME", "flask_app_db")]
+        self.blob_storage = create_blob_storage(self.config, self.sync_db)
+        # Маршруты, которых нет в self.routes, обслуживает Flask App через
+        # WSGI в пуле потоков. Кеши, лимиты и подпись токенов у них общие,
+        # чтобы токен и сброс кеша одного движка действовали и в другом.
+        # Индексы и миграции выполняет startup, а не конструктор App.
+        self.wsgi_app = App(__name__, config={
+            **self.config,
+            "MONGODB_CREATE_INDEXES": False,
+            "SECRET_KEY": self.config.get("SECRET_KEY") or os.urandom(32)
+        })
+        self.credentials_resolver = self.wsgi_app.credentials_resolver
+        self.password_verifier = self.wsgi_app.password_verifier
+        self.shared_store = self.wsgi_app.shared_store
+        self.credentials_cache = self.wsgi_app.credentials_cache
+        self.metadata_cache = self.wsgi_app.metadata_cache
+        self.single_flight = self.wsgi_app.single_flight
+        self.rate_limiter = self.wsgi_app.rate_limiter
+        self.transfer_slots = self.wsgi_app.transfer_slots
+        self.user_quota = self.wsgi_app.user_quota
+        self.auth_tokens = self.wsgi_app.auth_tokens
+        # События для long-poll запросов изменений, по владельцу. Изменения,
+        # записанные через self.wsgi_app, ждущие замечают при проверке базы
+        # раз в CHANGES_POLL_INTERVAL
+        self.change_events = {}
+        self.file_lookups = {}
+        self.routes = {
+            "/file_storage/": (self._file_storage_handler, ["GET", "POST", "DELETE"]),
+            "/file_storage/all/": (self._file_storage_all_handler, ["GET"]),
+            "/file_storage/changes/": (self._file_storage_changes_handler, ["GET"]),
+            "/register/": (self._register_handler, ["POST"]),
+            "/register/check/": (self._register_check_handler, ["GET"]),
+        }
+        self._db = None
+
+    @property
+    def db(self):
+        # Motor привязывается к event loop, поэтому клиент создается при первом запросе
+        if self._db is None:
+            mongo_client = AsyncIOMotorClient(
+                self.config.get("MONGODB_HOST", "localhost"),
+                self.config.get("MONGODB_PORT", 27017),
+                **mongo_client_options(self.config)
+            )
+            self._db = mongo_client[self.config.get("MONGODB_NAME", "flask_app_db")]
+
+        return self._db
+
+    async def run_blocking(self, f, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, f, *args)
+
+    async def startup(self):
+        if self.config.get("MONGODB_CREATE_INDEXES", True):
+            await self.run_blocking(ensure_indexes, self.sync_db)
+            await self.run_blocking(backfill_created_at, self.sync_db)
+            await self.run_blocking(backfill_chunk_refs, self.sync_db)
+            await self.run_blocking(backfill_chunk_grants, self.sync_db)
+            await self.run_blocking(backfill_used_bytes, self.sync_db)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+
+                if message["type"] == "lifespan.startup":
+                    try:
+                        await self.startup()
+                    except Exception as e:
+                        logging.error(f"Startup error\n{str(e)}")
+                        await send({"type": "lifespan.startup.failed", "message": str(e)})
+                        return
+
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        if scope["type"] != "http":
+            return
+
+        request = Request(scope, receive)
+        route = self.routes.get(request.path)
+
+        if route is None:
+            try:
+                response = await self.call_wsgi_app(request)
+            except Exception as e:
+                logging.error(f"Request handling error\n{str(e)}")
+                response = self.error_response(http_exceptions.InternalServerError)
+        else:
+            handler, methods = route
+            method = "GET" if request.method == "HEAD" else request.method
+
+            if method not in methods:
+                response = self.error_response(http_exceptions.MethodNotAllowed)
+            else:
+                try:
+                    response = await handler(request)
+                except Exception as e:
+                    logging.error(f"Request handling error\n{str(e)}")
+                    response = self.error_response(http_exceptions.InternalServerError)
+
+        await response.send(request, send)
+
+    async def call_wsgi_app(self, request):
+        """
+        Выполняет запрос в Flask App в пуле потоков. Тело запроса читается
+        из receive по мере того, как его читает обработчик, а тело ответа
+        отдается потоком, так что загрузки и скачивания не буферизуются.
+        """
+        loop = asyncio.get_running_loop()
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = headers
+
+        app_iter = await self.run_blocking(
+            self.wsgi_app, wsgi_environ(request, loop), start_response
+        )
+        pieces = iter(app_iter)
+        first_piece = await self.run_blocking(next, pieces, None)
+
+        async def close():
+            if hasattr(app_iter, "close"):
+                await self.run_blocking(app_iter.close)
+
+        async def iter_body():
+            try:
+                piece = first_piece
+
+                while piece is not None:
+                    if piece:
+                        yield piece
+
+                    piece = await self.run_blocking(next, pieces, None)
+            finally:
+                await close()
+
+        if first_piece is None or request.method == "HEAD":
+            await close()
+            body = b""
+        else:
+            body = iter_body()
+
+        response = Response(body, started["status"])
+        # Заголовки целиком от Flask, в том числе Content-Length ответа на HEAD
+        response.headers = Headers(started["headers"])
+        return response
+
+    def error_response(self, error_cls):
+        return json_response(
+            {"error": error_cls.description, "code": error_cls.code},
+            getattr(error_cls, "http_error_code", error_cls.code)
+        )
+
+    def too_many_requests(self, retry_after):
+        response = self.error_response(http_exceptions.TooManyRequests)
+        response.headers["Retry-After"] = str(max(math.ceil(retry_after), 1))
+        return response
+
+    async def handle_authorized(self, handler, request, ctx):
+        # Те же лимиты пользователя, что и в App.handle_authorized
+        endpoint = request.path.strip("/")
+        retry_after = await self.run_blocking(self.rate_limiter.acquire, ctx.login, endpoint)
+
+        if retry_after:
+            return self.too_many_requests(retry_after)
+
+        if endpoint != "file_storage" or request.method != "POST":
+            return await handler(self, request, ctx)
+
+        content_length = int(request.headers.get("content-length", 0))
+        quota_ok = await self.run_blocking(
+            has_quota, self.sync_db, ctx.login, content_length, self.user_quota
+        )
+
+        if not quota_ok:
+            return self.error_response(http_exceptions.RequestEntityTooLarge)
+
+        if self.transfer_slots is None:
+            return await handler(self, request, ctx)
+
+        slot_id = await self.run_blocking(self.transfer_slots.acquire, ctx.login)
+
+        if slot_id is None:
+            return self.too_many_requests(1)
+
+        try:
+            return await handler(self, request, ctx)
+        finally:
+            await self.run_blocking(self.transfer_slots.release, ctx.login, slot_id)
+
+    async def get_password_hash(self, login):
+        password_hash = self.credentials_cache.get(login)
+
+        if password_hash is None:
+            user_doc = await self.db.users.find_one({"login": login}, {"password": 1})
+            password_hash = user_doc["password"]
+            self.credentials_cache.set(login, password_hash)
+
+        return password_hash
+
+    async def encode_password(self, password):
+        return await asyncio.wrap_future(
+            self.password_verifier.executor.submit(self.credentials_resolver.encode, password)
+        )
+
+    async def rehash_password(self, login, password_hash, password):
+        new_password_hash = await self.encode_password(password)
+        result = await self.db.users.update_one(
+            {"login": login, "password": password_hash},
+            {"$set": {"password": new_password_hash}}
+        )
+
+        if not result.modified_count:
+            self.credentials_cache.invalidate(login)
+            return password_hash
+
+        self.credentials_cache.set(login, new_password_hash)
+        return new_password_hash
+
+    async def authorize_token(self, request, token):
+        token_data = self.auth_tokens.loads(token)
+
+        if token_data is None:
+            return None
+
+        login, fingerprint = token_data
+
+        # Как в App.authorize_token: при промахе кеша хеш читается из базы
+        try:
+            password_hash = await self.get_password_hash(login)
+        except (KeyError, TypeError):
+            return None
+
+        if password_hash_fingerprint(password_hash) != fingerprint:
+            return None
+
+        return AuthorizationContext(request, login, password_hash)
+
+    async def get_file_from_storage(self, file_guid, public=True):
+        # Документ берется из общего с App кеша, а при промахе одновременные
+        # запросы одного GUID ждут одно чтение из базы
+        file_doc = await self.run_blocking(self.metadata_cache.get_file, file_guid)
+
+        if file_doc is None:
+            lookup = self.file_lookups.get(file_guid)
+
+            if lookup is None:
+                lookup = self.file_lookups[file_guid] = asyncio.ensure_future(self.load_file_document(file_guid))
+                lookup.add_done_callback(lambda _: self.file_lookups.pop(file_guid, None))
+
+            file_doc = await asyncio.shield(lookup)
+
+        if file_doc is None or file_doc.get("public") != public:
+            return None
+
+        return file_doc
+
+    async def load_file_document(self, file_guid):
+        file_doc = await self.db.files.find_one({"_id": file_guid}, SERVE_PROJECTION)
+
+        # Старые документы с file_bytes читаются целиком, как в App.load_file_document
+        if file_doc is not None and "chunks" not in file_doc:
+            return await self.db.files.find_one({"_id": file_guid})
+
+        if file_doc is not None:
+            await self.run_blocking(self.metadata_cache.set_file, file_doc)
+
+        return file_doc
+
+    def load_file_body(self, file_doc):
+        body = self.metadata_cache.get_body(file_doc)
+
+        if body is None:
+            body = b"".join(self.blob_storage.iter_chunks(file_doc["chunks"]))
+            self.metadata_cache.set_body(file_doc, body)
+
+        return body
+
+    async def iter_file_content(self, file_doc, start=0, end=None):
+        if "file_bytes" in file_doc:
+            yield file_doc["file_bytes"][start:end]
+            return
+
+        body = self.metadata_cache.get_body(file_doc)
+
+        if body is None and self.metadata_cache.should_cache_body(file_doc):
+            body = await self.run_blocking(
+                self.single_flight.do, "body:" + content_key(file_doc), self.load_file_body, file_doc
+            )
+
+        if body is not None:
+            yield body[start:end]
+            return
+
+        async for piece in self.iter_blocking(self.blob_storage.iter_range(file_doc["chunks"], start, end)):
+            yield piece
+
+    async def iter_blocking(self, pieces):
+        # Синхронный итератор хранилища, каждый кусок читается в пуле потоков
+        while True:
+            piece = await self.run_blocking(next, pieces, None)
+
+            if piece is None:
+                break
+
+            yield piece
+
+    def get_passthrough_encoding(self, request, file_doc):
+        # Как App.get_passthrough_encoding: только ответ целиком, если клиент принимает кодирование
+        if "file_bytes" in file_doc or parse_range_header(request.headers.get("range")) is not None:
+            return None
+
+        encoding = stored_content_encoding(file_doc["chunks"])
+
+        if encoding is None or not parse_accept_header(request.headers.get("accept-encoding"))[encoding]:
+            return None
+
+        return encoding
+
+    async def send_file_from_storage(self, request, file_doc):
+        if "file_bytes" in file_doc:
+            size = len(file_doc["file_bytes"])
+            etag = hashlib.sha256(file_doc["file_bytes"]).hexdigest()
+        else:
+            size = file_doc["size"]
+            etag = content_key(file_doc)
+
+        encoding = self.get_passthrough_encoding(request, file_doc)
+        representation_etag = etag if encoding is None else f"{etag}-{encoding}"
+        headers = {
+            "ETag": quote_etag(representation_etag),
+            "Accept-Ranges": "bytes",
+            "Content-Disposition": content_disposition(file_doc["filename"])
+        }
+        mimetype = file_doc.get("mimetype") or guess_mimetype(file_doc["filename"])
+
+        if "chunks" in file_doc:
+            headers["Vary"] = "Accept-Encoding"
+
+        if parse_etags(request.headers.get("if-none-match")).contains(representation_etag):
+            return Response(status=304, headers=headers, mimetype=mimetype)
+
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(sum(
+                chunk_ref["stored_size"] for chunk_ref in file_doc["chunks"]
+            ))
+            return Response(
+                self.iter_blocking(self.blob_storage.iter_stored(file_doc["chunks"])),
+                200, headers, mimetype
+            )
+
+        start, end, status = 0, size, 200
+        byte_range = parse_range_header(request.headers.get("range"))
+        if_range = parse_if_range_header(request.headers.get("if-range"))
+
+        if byte_range is not None and if_range.etag in (None, etag) and len(byte_range.ranges) == 1:
+            content_range = byte_range.range_for_length(size)
+
+            if content_range is None:
+                response = self.error_response(http_exceptions.RequestedRangeNotSatisfiable)
+                response.headers["Content-Range"] = f"bytes */{size}"
+                return response
+
+            start, end = content_range
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+
+        headers["Content-Length"] = str(end - start)
+
+        return Response(
+            self.iter_file_content(file_doc, start, end),
+            status, headers, mimetype
+        )
+
+    async def save_file_into_storage(self, owner_login, filename, request):
+        chunk_size = self.blob_storage.chunk_size
+        content_hash = hashlib.sha256()
+        chunk_refs = []
+        size = 0
+        buffer = bytearray()
+        codec = None
+
+        async def put_chunk(data):
+            nonlocal codec, size
+
+            # Как BlobStorage.write: кодек выбирается один раз на файл
+            if codec is None:
+                codec = self.blob_storage.choose_file_codec(data)
+
+            chunk_refs.append(await self.run_blocking(self.blob_storage.put_chunk, data, codec))
+            size += len(data)
+
+        async for piece in request.iter_body():
+            content_hash.update(piece)
+            buffer += piece
+
+            while len(buffer) >= chunk_size:
+                data = bytes(buffer[:chunk_size])
+                del buffer[:chunk_size]
+                await put_chunk(data)
+
+        if buffer:
+            await put_chunk(bytes(buffer))
+
+        file_doc = new_file_document(owner_login, filename, {
+            "chunks": chunk_refs,
+            "size": size,
+            "sha256": content_hash.hexdigest()
+        })
+        await self.run_blocking(reserve_bytes, self.sync_db, owner_login, size, self.user_quota)
+
+        try:
+            await self.run_blocking(add_chunk_refs, self.sync_db, [file_doc])
+        except MissingChunks:
+            await self.run_blocking(release_bytes, self.sync_db, owner_login, size)
+            raise
+
+        await self.db.files.insert_one(file_doc)
+        await self.run_blocking(
+            self.blob_storage.grant_chunks, owner_login,
+            [chunk_ref["hash"] for chunk_ref in chunk_refs]
+        )
+        await self.run_blocking(record_changes, self.sync_db, owner_login, "created", [file_doc])
+        await self.files_changed(owner_login)
+        return file_doc["_id"]
+
+    async def files_changed(self, owner_login):
+        await self.run_blocking(self.metadata_cache.bump, owner_login)
+        event = self.change_events.pop(owner_login, None)
+
+        if event is not None:
+            event.set()
+
+    async def _register_handler(self, request):
+        try:
+            login, password = parse_registration(await request.get_json())
+        except Exception:
+            return self.error_response(http_exceptions.BadRequest)
+
+        login_doc = await self.db.users.find_one({"login": login})
+
+        if login_doc is not None:
+            return self.error_response(http_exceptions.BadRequest)
+
+        try:
+            await self.db.users.insert_one({
+                "login": login,
+                "password": await self.encode_password(password),
+                "used_bytes": 0
+            })
+        except DuplicateKeyError:
+            return self.error_response(http_exceptions.BadRequest)
+
+        self.credentials_cache.invalidate(login)
+
+        return Response("Success")
+
+    @is_authorized(["POST", "DELETE"])
+    async def _file_storage_handler(self, request, ctx):
+        if request.method in ("GET", "HEAD"):
+            file_guid = request.args.get("file_guid")
+
+            if file_guid is None:
+                return self.error_response(http_exceptions.BadRequest)
+
+            file_doc = await self.get_file_from_storage(file_guid)
+
+            if file_doc is None:
+                return self.error_response(http_exceptions.BadRequest)
+
+            return await self.send_file_from_storage(request, file_doc)
+        elif request.method == "POST":
+            filename = request.args.get("filename")
+
+            if not filename or request.mimetype == "multipart/form-data":
+                return self.error_response(http_exceptions.BadRequest)
+
+            try:
+                file_guid = await self.save_file_into_storage(ctx.login, filename, request)
+            except QuotaExceeded:
+                return self.error_response(http_exceptions.RequestEntityTooLarge)
+
+            return json_response({"file_guid": file_guid})
+        elif request.method == "DELETE":
+            try:
+                files = (await request.get_json())["files"]
+
+                if not files or not isinstance(files, list):
+                    raise ValueError()
+            except Exception:
+                return self.error_response(http_exceptions.BadRequest)
+
+            await self.run_blocking(
+                soft_delete_files, self.sync_db, ctx.login,
+                [str(file_guid) for file_guid in files]
+            )
+            await self.files_changed(ctx.login)
+
+            return Response("Success")
+
+        return self.error_response(http_exceptions.InternalServerError)
+
+    @is_authorized(["GET"])
+    async def _file_storage_all_handler(self, request, ctx):
+        try:
+            query = ListingQuery(
+                ctx.login, request.args,
+                self.config.get("FILES_PAGE_SIZE", 1000),
+                self.config.get("FILES_MAX_PAGE_SIZE", 10000)
+            )
+        except (KeyError, ValueError, TypeError):
+            return self.error_response(http_exceptions.BadRequest)
+
+        if request.args.get("format") == "ndjson":
+            file_docs = self.db.files.find(
+                query.filter(), LISTING_PROJECTION,
+                sort=query.sort_spec(), batch_size=query.limit
+            )
+
+            async def iter_lines():
+                async for doc in file_docs:
+                    yield (json.dumps(file_doc_to_json(doc)) + "\n").encode()
+
+            return Response(iter_lines(), mimetype="application/x-ndjson")
+
+        # ETag и кеш страницы те же, что у App._file_storage_all_handler
+        change_seq = await self.run_blocking(current_seq, self.sync_db, ctx.login)
+        etag = self.metadata_cache.listing_etag(ctx.login, request.args, change_seq)
+        headers = {"ETag": quote_etag(etag)}
+
+        if parse_etags(request.headers.get("if-none-match")).contains(etag):
+            return Response(status=304, headers=headers)
+
+        body = self.metadata_cache.get_listing(etag)
+
+        if body is None:
+            file_docs = await self.db.files.find(
+                query.filter(), LISTING_PROJECTION,
+                sort=query.sort_spec(), limit=query.limit + 1
+            ).to_list(None)
+            next_cursor = None
+
+            if len(file_docs) > query.limit:
+                file_docs = file_docs[:query.limit]
+                next_cursor = query.next_cursor(file_docs[-1])
+
+            body = json.dumps({
+                "files": [file_doc_to_json(doc) for doc in file_docs],
+                "next_cursor": next_cursor
+            }).encode()
+            self.metadata_cache.set_listing(etag, body)
+
+        return Response(body, headers=headers, mimetype="application/json")
+
+    @is_authorized(["GET"])
+    async def _file_storage_changes_handler(self, request, ctx):
+        # Та же лента изменений, что и App._file_storage_changes_handler
+        args = request.args
+
+        if "since" not in args:
+            return json_response({
+                "changes": [],
+                "cursor": await self.run_blocking(current_seq, self.sync_db, ctx.login)
+            })
+
+        try:
+            since = int(args["since"])
+            limit = min(int(args.get("limit", CHANGES_PAGE_SIZE)), CHANGES_PAGE_SIZE)
+            wait = min(float(args.get("wait", 0)), self.config.get("CHANGES_MAX_WAIT", CHANGES_MAX_WAIT))
+
+            if since < 0 or limit <= 0:
+                raise ValueError()
+        except (ValueError, TypeError):
+            return self.error_response(http_exceptions.BadRequest)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        poll_interval = self.config.get("CHANGES_POLL_INTERVAL", CHANGES_POLL_INTERVAL)
+
+        try:
+            while True:
+                event = self.change_events.setdefault(ctx.login, asyncio.Event())
+                change_docs = await self.run_blocking(read_changes, self.sync_db, ctx.login, since, limit)
+                remaining = deadline - loop.time()
+
+                if change_docs or remaining <= 0:
+                    break
+
+                try:
+                    await asyncio.wait_for(event.wait(), min(remaining, poll_interval))
+                except asyncio.TimeoutError:
+                    pass
+        except CursorExpired:
+            return self.error_response(http_exceptions.Gone)
+
+        return json_response({
+            "changes": [change_doc_to_json(doc) for doc in change_docs],
+            "cursor": change_docs[-1]["seq"] if change_docs else since,
+            "has_more": len(change_docs) == limit
+        })
+
+    @is_authorized(["GET"])
+    async def _register_check_handler(self, request, ctx):
+        password_hash = ctx.password_hash or await self.get_password_hash(ctx.login)
+
+        return Response("Success", headers={
+            "X-Auth-Token": self.auth_tokens.dumps(ctx.login, password_hash)
+        })
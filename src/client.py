@@ -1,4 +1,5 @@
 import sys
+import time
 import clipboard
 
 from PyQt5 import uic
@@ -7,7 +8,7 @@ from PyQt5.QtWidgets import (
     QMainWindow, QDialog,
     QLineEdit, QPushButton,
     QLabel, QAbstractItemView,
-    QTableWidgetItem, QFileDialog
+    QFileDialog
 )
 
 from PyQt5.QtGui import QRegExpValidator
@@ -17,6 +18,9 @@ from pathlib import Path
 from .utils.paths import get_dir
 from .utils import constants
 from .api_client import ApiClient
+from .local_cache import LocalCache
+from .file_table import FileTableModel
+from .transfers import TransferManager, TaskCancelled
 
 
 def offset_y(widget1, *, offset=constants.LOGIN_WIDGET_Y_OFFSET, down=True):
@@ -33,6 +37,55 @@ def offset_x(widget1, *, offset=constants.LOGIN_WIDGET_X_OFFSET, down=True):
         return widget1.pos().x() - widget1.width() - offset
 
 
+# Функции фоновых задач TransferManager, выполняются в потоках пула
+
+def check_credentials(task, api_client):
+    if not api_client.req("GET", "register/check").ok:
+        raise ValueError(constants.INCORRECT_CREDS)
+
+
+def register(task, api_client, login, password):
+    request_json = {
+        "credentials": {
+            "login": login,
+            "password": password
+        }
+    }
+
+    if not api_client.req("POST", "register", json=request_json).ok:
+        raise ValueError(constants.ALREADY_REGISTERED)
+
+
+def load_files_page(task, api_client, cursor):
+    return api_client.list_files(cursor)
+
+
+def download_file(task, api_client, file_guid, file_path):
+    api_client.download_file(file_guid, file_path, progress=task.progress)
+
+
+def upload_file(task, api_client, file_path, state_path):
+    if file_path.stat().st_size >= constants.UPLOAD_MULTIPART_THRESHOLD:
+        return api_client.upload_multipart(
+            file_path, state_path=state_path, progress=task.progress,
+            check_cancelled=task.check_cancelled
+        )
+
+    return api_client.upload_file(file_path, progress=task.progress)
+
+
+def download_archive(task, api_client, file_guids, file_path):
+    api_client.download_archive(file_guids, file_path, progress=task.progress)
+
+
+def upload_files(task, api_client, file_paths):
+    return api_client.upload_files(file_paths)
+
+
+def delete_files(task, api_client, file_guids):
+    api_client.delete_files(file_guids)
+
+
 class LoginDialog(QDialog):
 
     def __init__(self, *args, **kwargs):
@@ -104,6 +157,7 @@ class LoginDialog(QDialog):
         self.register_button.clicked.connect(self.register_clicked)
 
         self.api_client = None
+        self.transfers = TransferManager(parent=self)
 
     def exec(self, *args, **kwargs):
         super().exec(*args, **kwargs)
@@ -118,7 +172,7 @@ class LoginDialog(QDialog):
     def get_creds(self):
         login = self.login_edit.text()
         password = self.password_edit.text()
-        self.api_client = ApiClient(login, password)
+        self.api_client = ApiClient(login, password, cache=LocalCache(get_dir(__file__) / "../cache"))
         return login, password
 
     def check_creds(self, login, password):
@@ -133,21 +187,28 @@ class LoginDialog(QDialog):
         self.status_label.setText(message)
         self.status_label.resize(self.status_label.sizeHint())
 
+    def set_buttons_enabled(self, enabled):
+        self.login_button.setEnabled(enabled)
+        self.register_button.setEnabled(enabled)
+
+    def request_failed(self, error):
+        self.set_buttons_enabled(True)
+        self.label_error(str(error) if isinstance(error, ValueError) else constants.SERVER_ERROR)
+
+    def request_finished(self, _):
+        self.set_buttons_enabled(True)
+        self.accept()
+
     def login_clicked(self):
         if not self.check_creds(*self.get_creds()):
             return
 
-        try:
-            if not self.api_client.req("GET", "register/check").ok:
-                raise ValueError(constants.INCORRECT_CREDS)
-        except ValueError as e:
-            self.label_error(str(e))
-            return
-        except Exception as e:
-            self.label_error(constants.SERVER_ERROR)
-            return
-
-        self.accept()
+        self.set_buttons_enabled(False)
+        self.transfers.submit(
+            check_credentials, self.api_client,
+            on_finished=self.request_finished,
+            on_failed=self.request_failed
+        )
 
     def register_clicked(self):
         login, password = self.get_creds()
@@ -155,24 +216,12 @@ class LoginDialog(QDialog):
         if not self.check_creds(login, password):
             return
 
-        request_json = {
-            "credentials": {
-                "login": login,
-                "password": password
-            }
-        }
-
-        try:
-            if not self.api_client.req("POST", "register", json=request_json).ok:
-                raise ValueError(constants.ALREADY_REGISTERED)
-        except ValueError as e:
-            self.label_error(str(e))
-            return
-        except Exception:
-            self.label_error(constants.SERVER_ERROR)
-            return
-
-        self.accept()
+        self.set_buttons_enabled(False)
+        self.transfers.submit(
+            register, self.api_client, login, password,
+            on_finished=self.request_finished,
+            on_failed=self.request_failed
+        )
 
 
 class MainWindow(QMainWindow):
@@ -182,33 +231,68 @@ class MainWindow(QMainWindow):
         uic.loadUi(str(get_dir(__file__) / "ui/main_window.ui"), self)
         self.setWindowTitle(constants.MAIN_WINDOW_TITLE)
         self.api_client = None
-        self.table_widget.setColumnCount(2)
-        self.table_widget.setHorizontalHeaderLabels([constants.FILE_NAME, constants.FILE_GUID])
-        self.table_widget.horizontalHeaderItem(0).setTextAlignment(Qt.AlignCenter)
-        self.table_widget.horizontalHeaderItem(1).setTextAlignment(Qt.AlignCenter)
-        self.table_widget.horizontalHeader().setStretchLastSection(True)
-        self.table_widget.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.file_model = FileTableModel(self.load_files_page, parent=self)
+        self.table_view.setModel(self.file_model)
+        self.table_view.horizontalHeader().setStretchLastSection(True)
+        self.table_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table_view.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        # Пока пользователь не выбрал колонку, файлы идут в порядке сервера
+        self.table_view.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.table_view.setSortingEnabled(True)
+        self.filter_edit.setPlaceholderText(constants.FILTER_PLACEHOLDER)
+        self.filter_edit.textChanged.connect(self.file_model.set_filter)
 
         self.download_button.clicked.connect(self.download_clicked)
         self.copy_link_button.clicked.connect(self.copy_link_clicked)
         self.upload_button.clicked.connect(self.upload_clicked)
         self.delete_button.clicked.connect(self.delete_clicked)
+        self.cancel_button.clicked.connect(self.cancel_clicked)
+        self.transfers = TransferManager(parent=self)
+
+    def add_file_rows(self, files):
+        self.file_model.add_files(files)
+
+    def find_file_row(self, file_guid):
+        return self.file_model.find_file_row(file_guid)
+
+    def show_progress(self, filename, done, total, speed):
+        if not total:
+            self.statusBar.showMessage(constants.TRANSFER_PROGRESS_BYTES.format(
+                filename, done / (1024 * 1024), speed / (1024 * 1024), self.transfers.active_count
+            ))
+            return
+
+        self.statusBar.showMessage(constants.TRANSFER_PROGRESS.format(
+            filename, min(done * 100 // total, 100), speed / (1024 * 1024), self.transfers.active_count
+        ))
 
     def load_files(self):
-        all_files_json = self.api_client.req("GET", "file_storage/all").json()
+        # Первая страница, остальные модель запросит сама при прокрутке
+        self.file_model.reload()
+
+    def load_files_page(self, cursor, generation):
+        self.transfers.submit(
+            load_files_page, self.api_client, cursor,
+            on_finished=lambda page: self.file_model.add_page(*page, generation),
+            on_failed=lambda error: self.load_files_failed(error, generation)
+        )
 
-        for i, file in enumerate(all_files_json["files"]):
-            self.table_widget.insertRow(i)
-            self.table_widget.setItem(i, 0, QTableWidgetItem(file["filename"]))
-            self.table_widget.setItem(i, 1, QTableWidgetItem(file["file_guid"]))
+    def load_files_failed(self, error, generation):
+        self.file_model.page_failed(generation)
+        self.statusBar.showMessage(constants.SERVER_ERROR)
 
     def get_selected_row(self):
-        selected_items = self.table_widget.selectedItems()
+        selected_rows = self.table_view.selectionModel().selectedRows()
 
-        if not selected_items:
+        if not selected_rows:
             return
 
-        return self.table_widget.row(selected_items[0])
+        return selected_rows[0].row()
+
+    def get_selected_files(self):
+        selected_rows = sorted(index.row() for index in self.table_view.selectionModel().selectedRows())
+        return [self.file_model.file_at(row) for row in selected_rows]
 
     def get_selected_file(self):
         file_row = self.get_selected_row()
@@ -216,40 +300,46 @@ class MainWindow(QMainWindow):
         if file_row is None:
             return None, None
 
-        filename_item = self.table_widget.item(file_row, 0)
-        file_guid_item = self.table_widget.item(file_row, 1)
-        filename = filename_item.text()
-        file_guid = file_guid_item.text()
+        return self.file_model.file_at(file_row)
 
-        return filename, file_guid
+    def transfer_failed(self, error, message):
+        if isinstance(error, TaskCancelled):
+            self.statusBar.showMessage(constants.TRANSFER_CANCELLED)
+        else:
+            self.statusBar.showMessage(message)
 
     def download_clicked(self):
-        filename, file_guid = self.get_selected_file()
+        selected_files = self.get_selected_files()
 
-        if not (filename and file_guid):
+        if not selected_files:
             self.statusBar.showMessage(constants.SELECT_FILE)
             return
 
         downloads_path = get_dir(__file__) / "../downloads"
-        file_path = downloads_path / filename
-        request_params = {"file_guid": file_guid}
 
-        try:
-            response = self.api_client.req("GET", "file_storage", params=request_params)
-
-            if not downloads_path.exists():
-                downloads_path.mkdir()
-
-            with open(file_path.resolve(), "wb") as f:
-                f.write(response.content)
-        except Exception:
-            self.statusBar.showMessage(constants.DOWNLOAD_ERROR)
-            return
-
-        self.statusBar.showMessage(constants.DOWNLOAD_SUCCESS.format(
-            file_path.name,
-            str(file_path.parent.resolve())
-        ))
+        if not downloads_path.exists():
+            downloads_path.mkdir()
+
+        if len(selected_files) == 1:
+            filename, file_guid = selected_files[0]
+            file_path = downloads_path / filename
+            task_fn, task_args = download_file, (file_guid, file_path.resolve())
+        else:
+            file_path = downloads_path / constants.ARCHIVE_NAME.format(
+                time.strftime("%Y%m%d_%H%M%S")
+            )
+            file_guids = [file_guid for _, file_guid in selected_files]
+            task_fn, task_args = download_archive, (file_guids, file_path.resolve())
+
+        self.transfers.submit(
+            task_fn, self.api_client, *task_args,
+            on_progress=lambda *args: self.show_progress(file_path.name, *args),
+            on_finished=lambda _: self.statusBar.showMessage(constants.DOWNLOAD_SUCCESS.format(
+                file_path.name,
+                str(file_path.parent.resolve())
+            )),
+            on_failed=lambda e: self.transfer_failed(e, constants.DOWNLOAD_ERROR)
+        )
 
     def copy_link_clicked(self):
         _, file_guid = self.get_selected_file()
@@ -258,60 +348,72 @@ class MainWindow(QMainWindow):
             self.statusBar.showMessage(constants.SELECT_FILE)
             return
 
-        clipboard.copy(self.api_client.base_url + "file_storage" + "?file_guid={}".format(
+        clipboard.copy(self.api_client.base_url + "file_storage/" + "?file_guid={}".format(
             file_guid
         ))
 
         self.statusBar.showMessage(constants.LINK_SAVED)
 
+    def upload_finished(self, file_paths, file_guids):
+        self.add_file_rows([
+            {"filename": file_path.name, "file_guid": file_guid}
+            for file_path, file_guid in zip(file_paths, file_guids)
+        ])
+
+        if len(file_paths) == 1:
+            self.statusBar.showMessage(constants.UPLOAD_SUCCESS.format(file_paths[0].name))
+        else:
+            self.statusBar.showMessage(constants.UPLOAD_MANY_SUCCESS.format(len(file_paths)))
+
     def upload_clicked(self):
-        filepath, _ = QFileDialog.getOpenFileName(
+        filepaths, _ = QFileDialog.getOpenFileNames(
             self,
             constants.UPLOAD_FILE,
             filter=f"{constants.ALL_FILES} (*.*)"
         )
 
-        if not filepath:
+        if not filepaths:
             self.statusBar.showMessage(constants.SELECT_FILE)
             return
 
-        file_path = Path(filepath)
+        file_paths = [Path(filepath) for filepath in filepaths]
 
-        try:
-            file_content = file_path.read_bytes()
-            request_files = {"file": (file_path.name, file_content)}
-            response = self.api_client.req("POST", "file_storage", files=request_files)
+        if len(file_paths) == 1:
+            self.transfers.submit(
+                upload_file, self.api_client, file_paths[0],
+                get_dir(__file__) / "../uploads.json",
+                on_progress=lambda *args: self.show_progress(file_paths[0].name, *args),
+                on_finished=lambda file_guid: self.upload_finished(file_paths, [file_guid]),
+                on_failed=lambda e: self.transfer_failed(e, constants.UPLOAD_ERROR)
+            )
+            return
 
-            if not response.ok:
-                raise ValueError()
+        self.transfers.submit(
+            upload_files, self.api_client, file_paths,
+            on_finished=lambda file_guids: self.upload_finished(file_paths, file_guids),
+            on_failed=lambda e: self.transfer_failed(e, constants.UPLOAD_ERROR)
+        )
 
-            file_guid = response.json()["file_guid"]
-        except Exception:
-            self.statusBar.showMessage(constants.UPLOAD_ERROR)
-            return
+    def delete_finished(self, selected_files):
+        self.file_model.remove_files([file_guid for _, file_guid in selected_files])
 
-        row_count = self.table_widget.rowCount()
-        self.table_widget.insertRow(row_count)
-        self.table_widget.setItem(row_count, 0, QTableWidgetItem(file_path.name))
-        self.table_widget.setItem(row_count, 1, QTableWidgetItem(file_guid))
-        self.statusBar.showMessage(constants.UPLOAD_SUCCESS.format(file_path.name))
+        if len(selected_files) == 1:
+            self.statusBar.showMessage(constants.DELETE_SUCCESS.format(selected_files[0][0]))
+        else:
+            self.statusBar.showMessage(constants.DELETE_MANY_SUCCESS.format(len(selected_files)))
 
     def delete_clicked(self):
-        filename, file_guid = self.get_selected_file()
+        selected_files = self.get_selected_files()
 
-        if not file_guid:
+        if not selected_files:
             self.statusBar.showMessage(constants.SELECT_FILE)
             return
 
-        request_json = {"files": [file_guid]}
-
-        try:
-            if not self.api_client.req("DELETE", "file_storage", json=request_json).ok:
-                raise ValueError()
-        except Exception:
-            self.statusBar.showMessage(constants.DELETE_ERROR)
-            return
+        self.transfers.submit(
+            delete_files, self.api_client, [file_guid for _, file_guid in selected_files],
+            on_finished=lambda _: self.delete_finished(selected_files),
+            on_failed=lambda e: self.statusBar.showMessage(constants.DELETE_ERROR)
+        )
 
-        selected_row = self.get_selected_row()
-        self.table_widget.removeRow(selected_row)
-        self.statusBar.showMessage(constants.DELETE_SUCCESS.format(filename))
+    def cancel_clicked(self):
+        self.transfers.cancel_all()
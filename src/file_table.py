@@ -0,0 +1,251 @@
+from array import array
+
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
+
+from .utils import constants
+
+
+class FileTableModel(QAbstractTableModel):
+    """
+    Модель таблицы файлов для QTableView. Данные хранятся по колонкам
+    (списки имен и GUID), а строки таблицы - массив номеров файлов в
+    порядке показа, поэтому память и время не зависят от числа
+    виджетов, а только от числа файлов.
+
+    Страницы списка подгружаются лениво: представление вызывает
+    fetchMore, когда пользователь докручивает до конца, и модель
+    запрашивает следующую страницу через fetch_page(cursor, generation).
+    Результат передается обратно в add_page с тем же generation: ответы
+    на запросы, отправленные до reload, отбрасываются. Сортировка и
+    фильтр применяются к уже загруженным файлам, а файлы из следующих
+    страниц фильтруются и встают на свои места по мере загрузки.
+    """
+
+    COLUMNS = (constants.FILE_NAME, constants.FILE_GUID)
+
+    def __init__(self, fetch_page, parent=None):
+        super().__init__(parent)
+        self.fetch_page = fetch_page
+        self.filenames = []
+        self.file_guids = []
+        # Номер файла в колонках по GUID
+        self.items = {}
+        # Номера файлов в колонках, видимые в таблице в текущем порядке
+        self.rows = array("L")
+        # Сколько файлов из колонок уже разобрано в rows
+        self.shown = 0
+        self.filter_text = ""
+        self.sort_column = None
+        self.sort_order = Qt.AscendingOrder
+        self.next_cursor = None
+        # Номер загрузки списка, увеличивается при каждом reload
+        self.generation = 0
+        # До reload модели нечего загружать (клиент еще не вошел)
+        self.complete = True
+        self.loading = False
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+
+        item = self.rows[index.row()]
+        return self.filenames[item] if index.column() == 0 else self.file_guids[item]
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation != Qt.Horizontal:
+            return super().headerData(section, orientation, role)
+
+        if role == Qt.DisplayRole:
+            return self.COLUMNS[section]
+
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignCenter
+
+        return None
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable if index.isValid() else Qt.NoItemFlags
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.loading:
+            return False
+
+        return not self.complete
+
+    def fetchMore(self, parent=QModelIndex()):
+        if self.canFetchMore(parent):
+            self.loading = True
+            self.fetch_page(self.next_cursor, self.generation)
+
+    def reload(self):
+        self.beginResetModel()
+        self.filenames, self.file_guids = [], []
+        self.items = {}
+        self.rows = array("L")
+        self.shown = 0
+        self.next_cursor = None
+        self.generation += 1
+        self.complete = False
+        self.loading = False
+        self.endResetModel()
+        self.fetchMore()
+
+    def add_page(self, files, next_cursor, generation):
+        # Страница прошлой загрузки списка перезаписала бы курсор новой
+        if generation != self.generation:
+            return
+
+        self.loading = False
+        self.next_cursor = next_cursor
+        self.complete = next_cursor is None
+        self.add_files(files)
+
+    def page_failed(self, generation):
+        # Следующий fetchMore повторит запрос той же страницы
+        if generation == self.generation:
+            self.loading = False
+
+    def add_files(self, files):
+        # Загруженный файл добавляется сразу, а потом приходит еще раз
+        # в одной из недогруженных страниц - второй раз он пропускается
+        for file in files:
+            if file["file_guid"] in self.items:
+                continue
+
+            self.items[file["file_guid"]] = len(self.filenames)
+            self.filenames.append(file["filename"])
+            self.file_guids.append(file["file_guid"])
+
+        self.show_new()
+
+    def show_new(self):
+        items = [item for item in range(self.shown, len(self.filenames)) if self.matches(item)]
+        self.shown = len(self.filenames)
+
+        if not items:
+            return
+
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(items) - 1)
+        self.rows.extend(items)
+        self.endInsertRows()
+
+        if self.sort_column is not None:
+            self.apply_sort()
+
+    def remove_files(self, file_guids):
+        removed = {self.items[file_guid] for file_guid in set(file_guids) if file_guid in self.items}
+
+        if not removed:
+            return
+
+        # Строки удаляются диапазонами подряд идущих строк, с конца, чтобы
+        # номера еще не удаленных строк не сдвигались
+        removed_rows = [row for row, item in enumerate(self.rows) if item in removed]
+        end = len(removed_rows)
+
+        while end:
+            start = end - 1
+
+            while start and removed_rows[start - 1] == removed_rows[start] - 1:
+                start -= 1
+
+            first, last = removed_rows[start], removed_rows[end - 1]
+            self.beginRemoveRows(QModelIndex(), first, last)
+            del self.rows[first:last + 1]
+            self.endRemoveRows()
+            end = start
+
+        # Колонки сжимаются, а номера файлов в rows и items пересчитываются -
+        # видимые строки при этом не меняются
+        new_items = array("L", [0]) * len(self.filenames)
+        filenames, file_guids = [], []
+
+        for item, (filename, file_guid) in enumerate(zip(self.filenames, self.file_guids)):
+            if item not in removed:
+                new_items[item] = len(filenames)
+                filenames.append(filename)
+                file_guids.append(file_guid)
+
+        self.shown -= sum(1 for item in removed if item < self.shown)
+        self.filenames, self.file_guids = filenames, file_guids
+        self.items = {file_guid: item for item, file_guid in enumerate(file_guids)}
+        self.rows = array("L", (new_items[item] for item in self.rows))
+
+    def file_at(self, row):
+        item = self.rows[row]
+        return self.filenames[item], self.file_guids[item]
+
+    def find_file_row(self, file_guid):
+        item = self.items.get(file_guid)
+
+        if item is None:
+            return None
+
+        for row, row_item in enumerate(self.rows):
+            if row_item == item:
+                return row
+
+    def matches(self, item):
+        return self.filter_text in self.filenames[item].casefold()
+
+    def sort_key(self):
+        if self.sort_column == 0:
+            filenames = self.filenames
+            return lambda item: filenames[item].casefold()
+
+        return self.file_guids.__getitem__
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        if column < 0:
+            self.sort_column = None
+            return
+
+        self.sort_column, self.sort_order = column, order
+        self.apply_sort()
+
+    def apply_sort(self):
+        """
+        Переупорядочивает строки, сохраняя выделение: постоянные индексы
+        представления переносятся на новые позиции тех же файлов
+        """
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        persistent_items = [self.rows[index.row()] for index in persistent]
+
+        self.rows = array("L", sorted(
+            self.rows, key=self.sort_key(), reverse=self.sort_order == Qt.DescendingOrder
+        ))
+
+        wanted = set(persistent_items)
+        positions = {item: row for row, item in enumerate(self.rows) if item in wanted}
+        self.changePersistentIndexList(persistent, [
+            self.index(positions[item], index.column())
+            for index, item in zip(persistent, persistent_items)
+        ])
+        self.layoutChanged.emit()
+
+    def set_filter(self, text):
+        text = text.casefold()
+
+        if text == self.filter_text:
+            return
+
+        # Если строка фильтра только дописана, подходящие файлы есть среди
+        # уже отфильтрованных, и весь список перебирать не нужно
+        candidates = self.rows if text.startswith(self.filter_text) else range(self.shown)
+        self.filter_text = text
+
+        self.beginResetModel()
+        rows = [item for item in candidates if self.matches(item)]
+
+        if self.sort_column is not None and candidates is not self.rows:
+            rows.sort(key=self.sort_key(), reverse=self.sort_order == Qt.DescendingOrder)
+
+        self.rows = array("L", rows)
+        self.endResetModel()
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import threading
+
+from pathlib import Path
+
+from .utils import constants
+
+
+class LocalCache:
+    """
+    Постоянный кеш клиента в директории path:
+        cache.sqlite - страницы списка файлов с их ETag и индекс содержимого
+        blobs/<sha256> - копии скачанных файлов по хешу содержимого
+    Страницы списка перепроверяются на сервере через If-None-Match, так что
+    неизменившийся список после перезапуска стоит только ответов 304.
+    Содержимое адресуется по sha256 и не устаревает, при превышении
+    max_bytes вытесняются давно не использованные файлы.
+    Соединение с SQLite создается отдельно для каждого потока, поэтому
+    кеш можно использовать из задач TransferManager.
+    """
+
+    def __init__(self, path, max_bytes=constants.CLIENT_CACHE_MAX_BYTES):
+        self.path = Path(path)
+        self.blobs_path = self.path / "blobs"
+        self.blobs_path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None:
+            connection = sqlite3.connect(str(self.path / "cache.sqlite"), timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS listing "
+                "(owner TEXT NOT NULL, request TEXT NOT NULL, etag TEXT NOT NULL, body TEXT NOT NULL, "
+                "PRIMARY KEY (owner, request))"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS blobs "
+                "(sha256 TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+                "used_at REAL NOT NULL)"
+            )
+            self._local.connection = connection
+
+        return connection
+
+    @staticmethod
+    def request_key(params):
+        return json.dumps(params, sort_keys=True)
+
+    def get_listing(self, owner, params):
+        """Возвращает (etag, тело страницы) или (None, None)"""
+        row = self.connection.execute(
+            "SELECT etag, body FROM listing WHERE owner = ? AND request = ?",
+            (owner, self.request_key(params))
+        ).fetchone()
+
+        if row is None:
+            return None, None
+
+        return row[0], json.loads(row[1])
+
+    def set_listing(self, owner, params, etag, body):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO listing (owner, request, etag, body) VALUES (?, ?, ?, ?)",
+            (owner, self.request_key(params), etag, json.dumps(body))
+        )
+
+    def blob_path(self, sha256):
+        return self.blobs_path / sha256
+
+    def get_blob(self, sha256):
+        """
+        Путь к сохраненной копии содержимого или None. Копия, которую
+        изменили или удалили на диске, выбрасывается из индекса.
+        """
+        row = self.connection.execute(
+            "SELECT size, mtime_ns FROM blobs WHERE sha256 = ?", (sha256,)
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        blob_path = self.blob_path(sha256)
+
+        try:
+            stat = blob_path.stat()
+        except OSError:
+            stat = None
+
+        if stat is None or (stat.st_size, stat.st_mtime_ns) != tuple(row):
+            self.remove_blob(sha256)
+            return None
+
+        self.connection.execute("UPDATE blobs SET used_at = ? WHERE sha256 = ?", (time.time(), sha256))
+        return blob_path
+
+    def put_blob(self, sha256, file_path):
+        """Сохраняет копию файла, содержимое которого уже проверено по sha256"""
+        blob_path = self.blob_path(sha256)
+        part_path = blob_path.with_name(sha256 + ".part")
+        shutil.copyfile(file_path, part_path)
+        os.replace(part_path, blob_path)
+        stat = blob_path.stat()
+        self.connection.execute(
+            "INSERT OR REPLACE INTO blobs (sha256, size, mtime_ns, used_at) VALUES (?, ?, ?, ?)",
+            (sha256, stat.st_size, stat.st_mtime_ns, time.time())
+        )
+        self.evict()
+
+    def remove_blob(self, sha256):
+        self.connection.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+
+        try:
+            self.blob_path(sha256).unlink()
+        except OSError:
+            pass
+
+    def evict(self):
+        with self._lock:
+            total, = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()
+
+            if total <= self.max_bytes:
+                return
+
+            for sha256, size in self.connection.execute(
+                "SELECT sha256, size FROM blobs ORDER BY used_at"
+            ).fetchall():
+                self.remove_blob(sha256)
+                total -= size
+
+                if total <= self.max_bytes:
+                    break
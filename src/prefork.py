@@ -0,0 +1,208 @@
+import os
+import sys
+import time
+import signal
+import socket
+import secrets
+import logging
+import threading
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+WORKER_FD_ENV = "app_worker_fd"
+WORKER_THREADS_ENV = "app_worker_threads"
+SECRET_KEY_ENV = "app_secret_key"
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    WSGI сервер werkzeug, обрабатывающий соединения в пуле из threads потоков
+    (ThreadingMixIn создает поток на каждое соединение без ограничений).
+    """
+
+    def __init__(self, host, port, app, threads, fd=None):
+        super().__init__(host, port, app, WSGIRequestHandler, fd=fd)
+        self.executor = ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+def run_worker(app, host, port, fd, threads):
+    """
+    Запускает воркер на унаследованном от мастера слушающем сокете.
+    По SIGTERM воркер перестает принимать соединения, дожидается
+    обработки уже принятых запросов и завершается.
+    """
+    server = PooledWSGIServer(host, port, app, threads, fd=fd)
+
+    def graceful_stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, graceful_stop)
+    signal.signal(signal.SIGINT, graceful_stop)
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+class Arbiter:
+    """
+    Мастер процесс: открывает слушающий сокет и держит workers процессов-воркеров,
+    которые принимают соединения с этого сокета. Воркер запускается как новый
+    интерпретатор (command) с номером унаследованного дескриптора в окружении,
+    поэтому MongoClient и остальное состояние создаются в каждом воркере заново.
+    Сигналы:
+        SIGHUP - плавный перезапуск: поднимаются новые воркеры (с новым кодом),
+            после чего старые доделывают текущие запросы и завершаются
+        SIGTERM, SIGINT - плавная остановка
+    Упавшие воркеры перезапускаются.
+    """
+
+    def __init__(self, command, host, port, workers=None, threads=8, backlog=2048,
+                 graceful_timeout=30, ready_timeout=5):
+        self.command = command
+        self.host = host
+        self.port = port
+        self.workers_count = workers or os.cpu_count() or 1
+        self.threads = threads
+        self.backlog = backlog
+        self.graceful_timeout = graceful_timeout
+        self.ready_timeout = ready_timeout
+        self.workers = []
+        self.retiring = []
+        self.reload_requested = False
+        self.stop_requested = False
+
+    def listen(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(self.backlog)
+        self.socket.set_inheritable(True)
+
+    def spawn_worker(self):
+        env = dict(os.environ)
+        env[WORKER_FD_ENV] = str(self.socket.fileno())
+        env[WORKER_THREADS_ENV] = str(self.threads)
+
+        return subprocess.Popen(self.command, env=env, pass_fds=(self.socket.fileno(),))
+
+    def stop_workers(self, workers):
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+
+    def reload(self):
+        new_workers = [self.spawn_worker() for _ in range(self.workers_count)]
+        deadline = time.monotonic() + self.ready_timeout
+
+        while time.monotonic() < deadline:
+            if any(worker.poll() is not None for worker in new_workers):
+                break
+
+            time.sleep(0.1)
+
+        # Если новые воркеры не поднялись, продолжаем работать на старых
+        if any(worker.poll() is not None for worker in new_workers):
+            logging.error("Reload failed: new workers exited during startup")
+            self.stop_workers(new_workers)
+            self.retiring.extend(new_workers)
+            return
+
+        self.stop_workers(self.workers)
+        self.retiring.extend(self.workers)
+        self.workers = new_workers
+
+    def reap(self):
+        self.retiring = [worker for worker in self.retiring if worker.poll() is None]
+
+        for i, worker in enumerate(self.workers):
+            if worker.poll() is not None:
+                logging.error(f"Worker {worker.pid} exited with code {worker.returncode}, restarting")
+                self.workers[i] = self.spawn_worker()
+
+    def shutdown(self):
+        workers = self.workers + self.retiring
+        self.stop_workers(workers)
+        deadline = time.monotonic() + self.graceful_timeout
+
+        for worker in workers:
+            try:
+                worker.wait(max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                worker.kill()
+                worker.wait()
+
+        self.socket.close()
+
+    def run(self):
+        self.listen()
+        self.workers = [self.spawn_worker() for _ in range(self.workers_count)]
+
+        signal.signal(signal.SIGHUP, lambda signum, frame: setattr(self, "reload_requested", True))
+        signal.signal(signal.SIGTERM, lambda signum, frame: setattr(self, "stop_requested", True))
+        signal.signal(signal.SIGINT, lambda signum, frame: setattr(self, "stop_requested", True))
+
+        try:
+            while not self.stop_requested:
+                if self.reload_requested:
+                    self.reload_requested = False
+                    self.reload()
+
+                self.reap()
+                time.sleep(0.5)
+        finally:
+            self.shutdown()
+
+
+def is_worker():
+    return WORKER_FD_ENV in os.environ
+
+
+def run_from_env(app_factory, host, port, command=None):
+    """
+    Точка входа продакшн запуска: в мастере поднимает Arbiter,
+    в воркере (запущенном мастером) создает приложение и обслуживает запросы.
+    Настройки приложения воркеры получают через окружение мастера, в том
+    числе ключ подписи SECRET_KEY_ENV.
+    """
+    if is_worker():
+        run_worker(
+            app_factory(),
+            host, port,
+            int(os.environ[WORKER_FD_ENV]),
+            int(os.environ[WORKER_THREADS_ENV])
+        )
+        return
+
+    # Токен или ссылку, подписанные одним воркером, должны принимать все
+    # остальные, поэтому без заданного ключа мастер выдает воркерам общий
+    if not os.environ.get(SECRET_KEY_ENV):
+        logging.warning(f"{SECRET_KEY_ENV} is not set, tokens and links will not survive a restart")
+        os.environ[SECRET_KEY_ENV] = secrets.token_hex(32)
+
+    workers = os.environ.get("app_workers")
+    Arbiter(
+        command or [sys.executable] + sys.argv,
+        host, port,
+        workers=int(workers) if workers else None,
+        threads=int(os.environ.get("app_threads", 8)),
+        graceful_timeout=int(os.environ.get("app_graceful_timeout", 30))
+    ).run()
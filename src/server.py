@@ -1,16 +1,60 @@
+import os
+import math
+import time
+import uuid
 import flask
 import logging
-import uuid
+import datetime
+import hashlib
+import json
 import functools
-import string
 
 from werkzeug import exceptions as http_exceptions
 from pymongo import MongoClient
-from io import BytesIO
+from pymongo.errors import DuplicateKeyError
 
-from .utils.authorization import CredentialsResolver, AuthorizationContext
+from .utils.authorization import (
+    CredentialsResolver, PasswordVerifier, AuthorizationContext,
+    CredentialsCache, AuthTokenSigner,
+    password_hash_fingerprint, parse_registration,
+    parse_authorization_header
+)
+from .utils.shared_store import SharedStore
+from .utils.metadata_cache import MetadataCache
+from .utils.indexes import ensure_indexes
+from .utils.migrations import (
+    backfill_created_at, backfill_chunk_refs, backfill_chunk_grants, backfill_used_bytes
+)
+from .utils.garbage_collection import (
+    MissingChunks, add_chunk_refs, chunk_ref_counts, soft_delete_files
+)
+from .utils.listing import (
+    ListingQuery, LISTING_PROJECTION, METADATA_PROJECTION, SERVE_PROJECTION,
+    file_doc_to_json, file_doc_to_metadata
+)
+from .utils.archive import iter_zip
+from .utils.cache import SingleFlight
+from .utils.links import LinkSigner, DEFAULT_TTL as LINK_TTL, MAX_TTL as LINK_MAX_TTL
+from .utils.blob_storage import create_blob_storage, stored_content_encoding, parse_sha256
+from .utils.http import content_disposition, guess_mimetype
+from .utils.files import new_file_document, content_key
+from .utils.mongo import mongo_client_options
+from .utils.limits import (
+    LocalCounterStore, RateLimiter, TransferSlots, QuotaExceeded,
+    reserve_bytes, release_bytes, has_quota
+)
+from .utils.metrics import (
+    MetricsRegistry, MongoCommandMetrics, SlowRequestProfiler, COUNT_BUCKETS
+)
+from .utils.changes import (
+    ChangeNotifier, CursorExpired, record_changes, read_changes, current_seq,
+    change_doc_to_json, PAGE_SIZE as CHANGES_PAGE_SIZE, MAX_WAIT as CHANGES_MAX_WAIT,
+    POLL_INTERVAL as CHANGES_POLL_INTERVAL
+)
 
-ALLOWED_LOGIN_CHARS = string.ascii_lowercase + string.digits + '_'
+UPLOAD_ENDPOINTS = {
+    "file_storage", "file_storage/batch", "file_storage/chunks", "upload_sessions/part"
+}
 
 
 def is_authorized(authorize_methods):
@@ -22,6 +66,9 @@ def is_authorized(authorize_methods):
         self - объект App
         ctx - AuthorizationContext
     Если метода нет в списке, декоратор пропустит его без проверки.
+    Если в заголовке x-auth-token передан валидный токен сессии,
+    запрос авторизуется без обращения к БД, иначе проверяется
+    заголовок authorization ("логин пароль").
     """
 
     def is_authorized_wrapper(f):
@@ -32,25 +79,29 @@ def is_authorized(authorize_methods):
                 return f(self, None, *args, **kwargs)
 
             headers = flask.request.headers
+            token = headers.get("x-auth-token")
 
-            try:
-                credentials = str(headers["authorization"])
-                login, password, *_ = credentials.lower().split()
+            if token is not None:
+                ctx = self.authorize_token(token)
 
-                if not login or not password:
-                    raise ValueError
+                if ctx is not None:
+                    return self.handle_authorized(f, ctx, *args, **kwargs)
 
-                user_doc = self.db.users.find_one({"login": login})
-                password_hash = user_doc["password"]
+            try:
+                login, password = parse_authorization_header(headers["authorization"])
+                password_hash = self.get_password_hash(login)
             except (KeyError, ValueError, TypeError) as e:
                 return self.error_response(http_exceptions.Unauthorized)
-            except Exception as e:
-                logging.error(f"Client registration error\n{str(e)}")
+            except Exception:
+                logging.exception(f"Authorization failed for {flask.request.path}")
                 return self.error_response(http_exceptions.InternalServerError)
 
-            if self.credentials_resolver.match(password_hash, password):
+            if self.password_verifier.verify(login, password_hash, password):
+                if self.password_verifier.needs_rehash(password_hash):
+                    password_hash = self.rehash_password(login, password_hash, password)
+
                 ctx = AuthorizationContext(flask.request, login, password_hash)
-                return f(self, ctx, *args, **kwargs)
+                return self.handle_authorized(f, ctx, *args, **kwargs)
 
             return self.error_response(http_exceptions.Unauthorized)
 
@@ -61,14 +112,54 @@ def is_authorized(authorize_methods):
 
 class App(flask.Flask):
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, config=None, **kwargs):
         super().__init__(*args, **kwargs)
-        self.mongo_client = MongoClient(
-            self.config.get("MONGODB_HOST", "localhost"),
-            self.config.get("MONGODB_PORT", 27017)
+        # Настройки поверх дефолтных, до того как App их прочитает
+        self.config.update(config or {})
+        self._connection_pid = None
+        self.setup_metrics()
+
+        if self.config.get("MONGODB_CREATE_INDEXES", True):
+            ensure_indexes(self.db)
+            backfill_created_at(self.db)
+            backfill_chunk_refs(self.db)
+            backfill_chunk_grants(self.db)
+            backfill_used_bytes(self.db)
+
+        self.credentials_resolver = CredentialsResolver(
+            self.config.get("PASSWORD_HASH_SCHEME", "pbkdf2_sha256"),
+            self.config.get("PASSWORD_HASH_ITERATIONS", 260000)
+        )
+        self.password_verifier = PasswordVerifier(
+            self.credentials_resolver,
+            self.config.get("AUTH_CACHE_SIZE", 1024),
+            self.config.get("AUTH_CACHE_TTL", 300),
+            self.config.get("AUTH_KDF_WORKERS", 4)
+        )
+        auth_cache_path = self.config.get("AUTH_CACHE_PATH")
+        self.shared_store = SharedStore(auth_cache_path) if auth_cache_path else None
+        self.credentials_cache = CredentialsCache(
+            self.config.get("AUTH_CACHE_SIZE", 1024),
+            self.config.get("AUTH_CACHE_TTL", 300),
+            self.shared_store
+        )
+        self.metadata_cache = MetadataCache(
+            self.config.get("METADATA_CACHE_SIZE", 10000),
+            self.config.get("METADATA_CACHE_TTL", 60),
+            self.config.get("METADATA_CACHE_MAX_BYTES", 64 * 1024 * 1024),
+            self.config.get("BODY_CACHE_MAX_BYTES", 64 * 1024 * 1024),
+            self.config.get("BODY_CACHE_MAX_FILE_SIZE", 256 * 1024),
+            self.shared_store,
+            self.config.get("HOT_BODY_MAX_FILE_SIZE", 8 * 1024 * 1024),
+            self.config.get("HOT_BODY_MIN_HITS", 3)
         )
-        self.db = self.mongo_client[self.config.get("MONGODB_NAME", "flask_app_db")]
-        self.credentials_resolver = CredentialsResolver()
+        # Одновременные промахи кеша по одному файлу дают одно чтение
+        self.single_flight = SingleFlight()
+        secret_key = self.config.get("SECRET_KEY") or os.urandom(32)
+        self.auth_tokens = AuthTokenSigner(secret_key, self.config.get("AUTH_TOKEN_TTL", 3600))
+        self.link_signer = LinkSigner(secret_key)
+        self.change_notifier = ChangeNotifier()
+        self.setup_limits()
         self.add_url_rule(
             "/file_storage/", "file_storage",
             self._file_storage_handler,
@@ -79,6 +170,81 @@ class App(flask.Flask):
             self._file_storage_all_handler,
             methods=["GET"]
         )
+        self.add_url_rule(
+            "/file_storage/changes/", "file_storage/changes",
+            self._file_storage_changes_handler,
+            methods=["GET"]
+        )
+        self.add_url_rule(
+            "/file_storage/links/", "file_storage/links",
+            self._file_storage_links_handler,
+            methods=["POST"]
+        )
+        self.add_url_rule(
+            "/l/<token>/", "l",
+            self._link_handler,
+            methods=["GET"]
+        )
+        self.add_url_rule(
+            "/file_storage/batch/", "file_storage/batch",
+            self._file_storage_batch_handler,
+            methods=["POST"]
+        )
+        self.add_url_rule(
+            "/file_storage/archive/", "file_storage/archive",
+            self._file_storage_archive_handler,
+            methods=["POST"]
+        )
+        self.add_url_rule(
+            "/file_storage/metadata/", "file_storage/metadata",
+            self._file_storage_metadata_handler,
+            methods=["POST"]
+        )
+        self.add_url_rule(
+            "/file_storage/negotiate/", "file_storage/negotiate",
+            self._negotiate_handler,
+            methods=["POST"]
+        )
+        self.add_url_rule(
+            "/file_storage/chunks/", "file_storage/chunks",
+            self._chunks_handler,
+            methods=["PUT"]
+        )
+        self.add_url_rule(
+            "/file_storage/commit/", "file_storage/commit",
+            self._commit_handler,
+            methods=["POST"]
+        )
+        self.add_url_rule(
+            "/upload_sessions/", "upload_sessions",
+            self._upload_sessions_handler,
+            methods=["POST"]
+        )
+        self.add_url_rule(
+            "/upload_sessions/<session_id>/", "upload_sessions/session",
+            self._upload_session_handler,
+            methods=["GET", "DELETE"]
+        )
+        self.add_url_rule(
+            "/upload_sessions/<session_id>/parts/<int:index>/", "upload_sessions/part",
+            self._upload_session_part_handler,
+            methods=["PUT"]
+        )
+        self.add_url_rule(
+            "/upload_sessions/<session_id>/complete/", "upload_sessions/complete",
+            self._upload_session_complete_handler,
+            methods=["POST"]
+        )
+        self.add_url_rule(
+            "/cache/stats/", "cache/stats",
+            self._cache_stats_handler,
+            methods=["GET"]
+        )
+        self.add_url_rule(
+            "/metrics", "metrics",
+            self._metrics_handler,
+            methods=["GET"]
+        )
         self.add_url_rule(
             "/register/", "register",
             self._register_handler,
@@ -90,44 +256,484 @@ class App(flask.Flask):
             methods=["GET"]
         )
 
-    def error_response(self, error_cls):
+    def setup_limits(self):
+        """
+        Лимиты пользователей:
+            RATE_LIMITS - {endpoint или "*": (запросов в секунду, емкость)}
+            MAX_USER_TRANSFERS - одновременных загрузок на пользователя
+            USER_QUOTA_BYTES - суммарный размер файлов пользователя
+        Счетчики лимитов хранятся в процессе, а с RATE_LIMIT_SHARED = True -
+        в общем для воркеров файле AUTH_CACHE_PATH.
+        """
+        if self.shared_store is not None and self.config.get("RATE_LIMIT_SHARED", False):
+            store = self.shared_store
+        else:
+            store = LocalCounterStore()
+
+        self.rate_limiter = RateLimiter(self.config.get("RATE_LIMITS", {}), store)
+        max_transfers = self.config.get("MAX_USER_TRANSFERS")
+        self.transfer_slots = TransferSlots(max_transfers, store) if max_transfers else None
+        self.user_quota = self.config.get("USER_QUOTA_BYTES")
+        self.register_error_handler(
+            QuotaExceeded,
+            lambda e: self.error_response(http_exceptions.RequestEntityTooLarge)
+        )
+
+    def too_many_requests(self, retry_after):
+        response = self.error_response(http_exceptions.TooManyRequests)
+        response.headers["Retry-After"] = str(max(math.ceil(retry_after), 1))
+        return response
+
+    def handle_authorized(self, handler, ctx, *args, **kwargs):
+        """
+        Вызывает обработчик авторизованного запроса с учетом лимитов
+        пользователя ctx.login
+        """
+        request = flask.request
+        retry_after = self.rate_limiter.acquire(ctx.login, request.endpoint)
+
+        if retry_after:
+            return self.too_many_requests(retry_after)
+
+        if request.endpoint not in UPLOAD_ENDPOINTS or request.method not in ("POST", "PUT"):
+            return handler(self, ctx, *args, **kwargs)
+
+        if not has_quota(self.db, ctx.login, request.content_length, self.user_quota):
+            return self.error_response(http_exceptions.RequestEntityTooLarge)
+
+        if self.transfer_slots is None:
+            return handler(self, ctx, *args, **kwargs)
+
+        slot_id = self.transfer_slots.acquire(ctx.login)
+
+        if slot_id is None:
+            return self.too_many_requests(1)
+
+        try:
+            return handler(self, ctx, *args, **kwargs)
+        finally:
+            self.transfer_slots.release(ctx.login, slot_id)
+
+    def setup_metrics(self):
+        """
+        Метрики процесса для GET /metrics (формат Prometheus) и
+        профилирование медленных запросов, если задан PROFILE_SLOW_REQUEST_MS:
+        профили сохраняются в PROFILE_DIR, профилируется доля запросов
+        PROFILE_SAMPLE_RATE.
+        """
+        self.metrics = MetricsRegistry()
+        self.mongo_metrics = MongoCommandMetrics(self.metrics)
+        self.request_duration = self.metrics.histogram(
+            "http_request_duration_seconds", "Request handling time without streaming the body"
+        )
+        self.request_bytes = self.metrics.counter(
+            "http_request_bytes_total", "Request body bytes"
+        )
+        self.response_bytes = self.metrics.counter(
+            "http_response_bytes_total", "Response body bytes"
+        )
+        self.requests_in_flight = self.metrics.gauge(
+            "http_requests_in_flight", "Requests being handled"
+        )
+        self.uploads_in_flight = self.metrics.gauge(
+            "uploads_in_flight", "Uploads being received"
+        )
+        self.request_mongo_queries = self.metrics.histogram(
+            "mongodb_queries_per_request", "MongoDB commands per request", COUNT_BUCKETS
+        )
+        self.request_mongo_time = self.metrics.histogram(
+            "mongodb_time_per_request_seconds", "MongoDB time per request"
+        )
+        cache_gauges = {
+            field: self.metrics.gauge(f"cache_{field}", f"Cache {field}")
+            for field in ("hits", "misses", "evictions", "entries", "bytes")
+        }
+
+        def collect_cache_stats():
+            caches = {
+                "credentials": self.credentials_cache.local.stats(),
+                "verified_passwords": self.password_verifier.verified.stats()
+            }
+            caches.update(self.metadata_cache.stats())
+
+            for cache, stats in caches.items():
+                for field, gauge in cache_gauges.items():
+                    gauge.set(stats[field], cache=cache)
+
+        self.metrics.collectors.append(collect_cache_stats)
+
+        slow_request_ms = self.config.get("PROFILE_SLOW_REQUEST_MS")
+        self.profiler = SlowRequestProfiler(
+            slow_request_ms / 1000,
+            self.config.get("PROFILE_DIR", "profiles"),
+            self.config.get("PROFILE_SAMPLE_RATE", 1.0)
+        ) if slow_request_ms else None
+
+        self.before_request(self.start_request_metrics)
+        self.after_request(self.record_request_metrics)
+        self.teardown_request(self.finish_request_metrics)
+
+    def start_request_metrics(self):
+        g = flask.g
+        g.request_started_at = time.perf_counter()
+        g.upload = (
+            flask.request.endpoint in UPLOAD_ENDPOINTS
+            and flask.request.method in ("POST", "PUT")
+        )
+        self.requests_in_flight.inc()
+
+        if g.upload:
+            self.uploads_in_flight.inc()
+
+        self.mongo_metrics.reset()
+        g.profile = self.profiler.start() if self.profiler is not None else None
+
+    def record_request_metrics(self, response):
+        duration = time.perf_counter() - flask.g.request_started_at
+        endpoint = flask.request.endpoint or "unknown"
+        queries, mongo_time = self.mongo_metrics.finish()
+
+        self.request_duration.observe(
+            duration, endpoint=endpoint,
+            method=flask.request.method, status=response.status_code
+        )
+        self.request_mongo_queries.observe(queries, endpoint=endpoint)
+        self.request_mongo_time.observe(mongo_time, endpoint=endpoint)
+        self.request_bytes.inc(flask.request.content_length or 0, endpoint=endpoint)
+
+        if response.is_streamed:
+            # Тело отдается после обработчика, байты считаются по мере отправки
+            response.response = self.count_response_bytes(response.response, endpoint)
+        else:
+            self.response_bytes.inc(response.calculate_content_length() or 0, endpoint=endpoint)
+
+        profile = flask.g.pop("profile", None)
+
+        if profile is not None:
+            path = self.profiler.stop(profile, duration, endpoint)
+
+            if path is not None:
+                logging.warning(f"Slow request {flask.request.path} ({duration:.3f}s), profile saved to {path}")
+
+        return response
+
+    def count_response_bytes(self, pieces, endpoint):
+        sent = 0
+
+        try:
+            for piece in pieces:
+                sent += len(piece)
+                yield piece
+        finally:
+            self.response_bytes.inc(sent, endpoint=endpoint)
+
+    def finish_request_metrics(self, exc):
+        g = flask.g
+
+        # Обработчик упал до after_request
+        profile = g.pop("profile", None)
+
+        if profile is not None:
+            self.profiler.stop(profile, 0, "")
+
+        if "request_started_at" not in g:
+            return
+
+        self.requests_in_flight.dec()
+
+        if g.upload:
+            self.uploads_in_flight.dec()
+
+    def connect(self):
+        """
+        Создает MongoClient и хранилище блобов для текущего процесса.
+        MongoClient нельзя использовать после fork, поэтому при обращении
+        к db из другого процесса (воркера) подключение создается заново.
+        """
+        self._connection_pid = os.getpid()
+        self._mongo_client = MongoClient(
+            self.config.get("MONGODB_HOST", "localhost"),
+            self.config.get("MONGODB_PORT", 27017),
+            event_listeners=[self.mongo_metrics],
+            **mongo_client_options(self.config)
+        )
+        self._db = self._mongo_client[self.config.get("MONGODB_NAME", "flask_app_db")]
+        self._blob_storage = create_blob_storage(self.config, self._db)
+
+    @property
+    def mongo_client(self):
+        if self._connection_pid != os.getpid():
+            self.connect()
+
+        return self._mongo_client
+
+    @property
+    def db(self):
+        if self._connection_pid != os.getpid():
+            self.connect()
+
+        return self._db
+
+    @property
+    def blob_storage(self):
+        if self._connection_pid != os.getpid():
+            self.connect()
+
+        return self._blob_storage
+
+    def error_response(self, error_cls, **details):
         return flask.make_response(
-            flask.jsonify({"error": error_cls.description, "code": error_cls.code}),
+            flask.jsonify({"error": error_cls.description, "code": error_cls.code, **details}),
             getattr(error_cls, "http_error_code", error_cls.code)
         )
 
+    def get_password_hash(self, login):
+        password_hash = self.credentials_cache.get(login)
+
+        if password_hash is None:
+            user_doc = self.db.users.find_one({"login": login}, {"password": 1})
+            password_hash = user_doc["password"]
+            self.credentials_cache.set(login, password_hash)
+
+        return password_hash
+
+    def rehash_password(self, login, password_hash, password):
+        """
+        Заменяет хеш старого формата или с устаревшими параметрами
+        новым после успешной проверки пароля
+        """
+        new_password_hash = self.password_verifier.encode(password)
+        result = self.db.users.update_one(
+            {"login": login, "password": password_hash},
+            {"$set": {"password": new_password_hash}}
+        )
+
+        if not result.modified_count:
+            self.credentials_cache.invalidate(login)
+            return password_hash
+
+        self.credentials_cache.set(login, new_password_hash)
+        return new_password_hash
+
+    def authorize_token(self, token):
+        token_data = self.auth_tokens.loads(token)
+
+        if token_data is None:
+            return None
+
+        login, fingerprint = token_data
+
+        # Отпечаток сверяется всегда: при промахе кеша хеш читается из базы,
+        # иначе токены после смены пароля жили бы до конца своего срока
+        try:
+            password_hash = self.get_password_hash(login)
+        except (KeyError, TypeError):
+            return None
+
+        if password_hash_fingerprint(password_hash) != fingerprint:
+            return None
+
+        return AuthorizationContext(flask.request, login, password_hash)
+
     def get_file_from_storage(self, file_guid, public=True):
-        return self.db.files.find_one({
-            "_id": file_guid,
-            "public": public
-        })
+        """
+        Документ файла для отдачи: с public=True только публичный файл,
+        с public=None любой (для подписанных ссылок). Документ берется из
+        кеша, а при промахе одновременные запросы одного GUID ждут одно
+        чтение из базы.
+        """
+        file_doc = self.metadata_cache.get_file(file_guid)
 
-    def save_file_into_storage(self, owner_login, filename, file_bytes):
-        file_guid = str(uuid.uuid1())
+        if file_doc is None:
+            file_doc = self.single_flight.do("file:" + file_guid, self.load_file_document, file_guid)
 
-        self.db.files.insert_one({
-            "_id": file_guid,
-            "owner_login": owner_login,
-            "filename": filename,
-            "file_bytes": file_bytes,
-            "public": True
+        if file_doc is None or (public is not None and file_doc.get("public") != public):
+            return None
+
+        return file_doc
+
+    def load_file_document(self, file_guid):
+        file_doc = self.db.files.find_one({"_id": file_guid}, SERVE_PROJECTION)
+
+        # Документы, сохраненные до перехода на чанки, хранят файл целиком
+        # в file_bytes, его приходится читать полностью
+        if file_doc is not None and "chunks" not in file_doc:
+            return self.db.files.find_one({"_id": file_guid})
+
+        if file_doc is not None:
+            self.metadata_cache.set_file(file_doc)
+
+        return file_doc
+
+    def load_file_body(self, file_doc):
+        body = self.metadata_cache.get_body(file_doc)
+
+        if body is None:
+            body = b"".join(self.blob_storage.iter_chunks(file_doc["chunks"]))
+            self.metadata_cache.set_body(file_doc, body)
+
+        return body
+
+    def iter_file_content(self, file_doc, start=0, end=None):
+        # Документы, сохраненные до перехода на чанки, хранят файл целиком
+        if "file_bytes" in file_doc:
+            yield file_doc["file_bytes"][start:end]
+            return
+
+        body = self.metadata_cache.get_body(file_doc)
+
+        if body is None and self.metadata_cache.should_cache_body(file_doc):
+            body = self.single_flight.do("body:" + content_key(file_doc), self.load_file_body, file_doc)
+
+        if body is not None:
+            yield body[start:end]
+            return
+
+        yield from self.blob_storage.iter_range(file_doc["chunks"], start, end)
+
+    def get_file_size(self, file_doc):
+        if "file_bytes" in file_doc:
+            return len(file_doc["file_bytes"])
+
+        return file_doc["size"]
+
+    def get_file_etag(self, file_doc):
+        if "file_bytes" in file_doc:
+            return hashlib.sha256(file_doc["file_bytes"]).hexdigest()
+
+        return content_key(file_doc)
+
+    def get_passthrough_encoding(self, file_doc):
+        """
+        Кодирование, в котором файл можно отдать прямо из хранилища без
+        распаковки: только для ответа целиком, если клиент его принимает.
+        """
+        request = flask.request
+
+        if "file_bytes" in file_doc or request.range is not None:
+            return None
+
+        encoding = stored_content_encoding(file_doc["chunks"])
+
+        if encoding is None or not request.accept_encodings[encoding]:
+            return None
+
+        return encoding
+
+    def send_file_from_storage(self, file_doc):
+        """
+        Отдает файл потоком по чанкам. Поддерживает один диапазон Range
+        (206 / 416), If-Range и If-None-Match по ETag из хеша содержимого.
+        Сжатые чанки без Range отдаются как есть с Content-Encoding,
+        если клиент его принимает; у такого представления ETag с суффиксом
+        кодирования.
+        """
+        request = flask.request
+        size = self.get_file_size(file_doc)
+        etag = self.get_file_etag(file_doc)
+        encoding = self.get_passthrough_encoding(file_doc)
+        response = flask.Response(
+            mimetype=file_doc.get("mimetype") or guess_mimetype(file_doc["filename"])
+        )
+        response.set_etag(etag if encoding is None else f"{etag}-{encoding}")
+        response.headers["Accept-Ranges"] = "bytes"
+        response.headers["Content-Disposition"] = content_disposition(file_doc["filename"])
+
+        if "chunks" in file_doc:
+            response.vary.add("Accept-Encoding")
+
+        if request.if_none_match.contains(response.get_etag()[0]):
+            response.status_code = 304
+            return response
+
+        if encoding is not None:
+            response.response = self.blob_storage.iter_stored(file_doc["chunks"])
+            response.headers["Content-Encoding"] = encoding
+            response.headers["Content-Length"] = str(sum(
+                chunk_ref["stored_size"] for chunk_ref in file_doc["chunks"]
+            ))
+            return response
+
+        start, end = 0, size
+        byte_range = request.range
+
+        if byte_range is not None and request.if_range.etag in (None, etag):
+            if len(byte_range.ranges) == 1:
+                content_range = byte_range.range_for_length(size)
+
+                if content_range is None:
+                    response = self.error_response(http_exceptions.RequestedRangeNotSatisfiable)
+                    response.headers["Content-Range"] = f"bytes */{size}"
+                    return response
+
+                start, end = content_range
+                response.status_code = 206
+                response.headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+
+        response.response = self.iter_file_content(file_doc, start, end)
+        response.headers["Content-Length"] = str(end - start)
+        return response
+
+    def create_file(self, owner_login, filename, content, reserved=0):
+        return self.create_files(owner_login, [(filename, content)], reserved)[0]
+
+    def create_files(self, owner_login, files, reserved=0):
+        """
+        Создает документы файлов одним insert_many,
+        files - список пар (имя файла, результат BlobStorage.write).
+        reserved - байты, уже учтенные в used_bytes при загрузке чанков
+        или частей: учитывается только остаток, а при ошибке место
+        освобождается целиком.
+        """
+        file_docs = [
+            new_file_document(owner_login, filename, content)
+            for filename, content in files
+        ]
+
+        if file_docs:
+            size = sum(file_doc["size"] for file_doc in file_docs)
+
+            try:
+                reserve_bytes(self.db, owner_login, max(size - reserved, 0), self.user_quota)
+            except QuotaExceeded:
+                release_bytes(self.db, owner_login, reserved)
+                raise
+
+            try:
+                add_chunk_refs(self.db, file_docs)
+            except MissingChunks:
+                release_bytes(self.db, owner_login, size)
+                raise
+
+            self.db.files.insert_many(file_docs)
+            self.blob_storage.grant_chunks(owner_login, chunk_ref_counts(file_docs))
+            record_changes(self.db, owner_login, "created", file_docs)
+            self.files_changed(owner_login)
+
+        return [file_doc["_id"] for file_doc in file_docs]
+
+    def files_changed(self, owner_login):
+        # Сбрасывает кеш списков владельца и будит его long-poll запросы изменений
+        self.metadata_cache.bump(owner_login)
+        self.change_notifier.notify(owner_login)
+
+    def save_file_into_storage(self, owner_login, filename, stream):
+        return self.create_file(owner_login, filename, self.blob_storage.write(stream))
+
+    def _cache_stats_handler(self):
+        return flask.jsonify({
+            **self.metadata_cache.stats(),
+            "single_flight": {"coalesced": self.single_flight.coalesced}
         })
 
-        return file_guid
+    def _metrics_handler(self):
+        return flask.Response(self.metrics.render(), mimetype="text/plain; version=0.0.4")
 
     def _register_handler(self):
         json = flask.request.get_json()
 
         try:
-            creds = json["credentials"]
-            login = str(creds["login"])
-            password = str(creds["password"])
-
-            if any(s not in ALLOWED_LOGIN_CHARS for s in login):
-                raise ValueError()
-
-            if any(s.isspace() for s in password):
-                raise ValueError()
+            login, password = parse_registration(json)
         except Exception:
             return self.error_response(http_exceptions.BadRequest)
 
@@ -136,16 +742,25 @@ class App(flask.Flask):
         if login_doc is not None:
             return self.error_response(http_exceptions.BadRequest)
 
-        self.db.users.insert_one({
-            "login": login,
-            "password": self.credentials_resolver.encode(password)
-        })
+        # Уникальный индекс по login закрывает гонку между проверкой выше и вставкой
+        try:
+            self.db.users.insert_one({
+                "login": login,
+                "password": self.password_verifier.encode(password),
+                "used_bytes": 0
+            })
+        except DuplicateKeyError:
+            return self.error_response(http_exceptions.BadRequest)
+
+        self.credentials_cache.invalidate(login)
 
         return "Success"
 
     @is_authorized(["POST", "DELETE"])
     def _file_storage_handler(self, ctx):
-        if flask.request.method == "GET":
+        # HEAD отдает те же заголовки без тела: по нему ApiClient.download_file
+        # узнает размер и ETag файла перед скачиванием по диапазонам
+        if flask.request.method in ("GET", "HEAD"):
             file_guid = flask.request.args.get("file_guid")
 
             if file_guid is None:
@@ -156,41 +771,37 @@ class App(flask.Flask):
             if file_doc is None:
                 return self.error_response(http_exceptions.BadRequest)
 
-            buffer = BytesIO()
-            buffer.write(file_doc["file_bytes"])
-            buffer.seek(0)
-
-            return flask.send_file(
-                buffer,
-                as_attachment=True,
-                attachment_filename=file_doc["filename"],
-                mimetype="text/csv"
-            )
+            return self.send_file_from_storage(file_doc)
         elif flask.request.method == "POST":
-            if "file" not in flask.request.files:
+            # multipart/form-data с полем file или "сырое" тело запроса с
+            # именем файла в параметре filename. Во втором случае тело читается
+            # из потока по кускам и не буферизуется целиком ни в памяти, ни на диске
+            if flask.request.mimetype == "multipart/form-data":
+                if "file" not in flask.request.files:
+                    return self.error_response(http_exceptions.BadRequest)
+
+                file = flask.request.files["file"]
+                filename = file.filename
+                stream = file.stream
+            else:
+                filename = flask.request.args.get("filename")
+                stream = flask.request.stream
+
+            if not filename:
                 return self.error_response(http_exceptions.BadRequest)
 
-            file = flask.request.files["file"]
-            buffer = BytesIO()
-            file.save(buffer)
-            buffer.seek(0)
             return flask.jsonify({
-                "file_guid": self.save_file_into_storage(ctx.login, file.filename, buffer.read())
+                "file_guid": self.save_file_into_storage(ctx.login, filename, stream)
             })
         elif flask.request.method == "DELETE":
             try:
-                request_json = flask.request.json
-                files = request_json["files"]
-
-                if not files or not isinstance(files, list):
-                    raise ValueError()
+                file_guids = self.get_request_file_guids()
             except Exception as e:
                 return self.error_response(http_exceptions.BadRequest)
 
-            self.db.files.delete_many({
-                "owner_login": ctx.login,
-                "_id": {"$in": [str(file_guid) for file_guid in files]}
-            })
+            # Чанки освобождает фоновый сборщик мусора (gc_worker.py)
+            soft_delete_files(self.db, ctx.login, file_guids)
+            self.files_changed(ctx.login)
 
             return "Success"
 
@@ -198,20 +809,536 @@ class App(flask.Flask):
 
     @is_authorized(["GET"])
     def _file_storage_all_handler(self, ctx):
+        """
+        Список файлов пользователя страницами (см. ListingQuery).
+        С параметром format=ndjson весь список с учетом фильтров отдается
+        потоком, по одному JSON объекту файла на строку.
+        """
+        try:
+            query = ListingQuery(
+                ctx.login, flask.request.args,
+                self.config.get("FILES_PAGE_SIZE", 1000),
+                self.config.get("FILES_MAX_PAGE_SIZE", 10000)
+            )
+        except (KeyError, ValueError, TypeError):
+            return self.error_response(http_exceptions.BadRequest)
+
+        if flask.request.args.get("format") == "ndjson":
+            file_docs = self.db.files.find(
+                query.filter(), LISTING_PROJECTION,
+                sort=query.sort_spec(), batch_size=query.limit
+            )
+
+            return flask.Response(
+                (json.dumps(file_doc_to_json(doc)) + "\n" for doc in file_docs),
+                mimetype="application/x-ndjson"
+            )
+
+        # ETag страницы зависит от номера последнего изменения файлов владельца
+        # в базе и параметров запроса, поэтому неизменившийся список отдается
+        # из кеша или ответом 304, а изменения через другие воркеры видны сразу
+        etag = self.metadata_cache.listing_etag(
+            ctx.login, flask.request.args, current_seq(self.db, ctx.login)
+        )
+
+        if flask.request.if_none_match.contains(etag):
+            response = flask.Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        body = self.metadata_cache.get_listing(etag)
+
+        if body is None:
+            file_docs = list(self.db.files.find(
+                query.filter(), LISTING_PROJECTION,
+                sort=query.sort_spec(), limit=query.limit + 1
+            ))
+            next_cursor = None
+
+            if len(file_docs) > query.limit:
+                file_docs = file_docs[:query.limit]
+                next_cursor = query.next_cursor(file_docs[-1])
+
+            body = json.dumps({
+                "files": [file_doc_to_json(doc) for doc in file_docs],
+                "next_cursor": next_cursor
+            }).encode()
+            self.metadata_cache.set_listing(etag, body)
+
+        response = flask.Response(body, mimetype="application/json")
+        response.set_etag(etag)
+        return response
+
+    @is_authorized(["GET"])
+    def _file_storage_changes_handler(self, ctx):
+        """
+        Лента изменений файлов пользователя. Параметры запроса:
+            since - курсор, номер последнего полученного изменения; без него
+                    отдается только текущий курсор, с которого начинать
+            limit - число изменений в ответе
+            wait - сколько секунд ждать (long-poll), если изменений нет
+        Курсор, изменения после которого уже удалены, дает 410 - клиенту
+        нужно заново получить список файлов.
+        """
+        args = flask.request.args
+
+        if "since" not in args:
+            return flask.jsonify({"changes": [], "cursor": current_seq(self.db, ctx.login)})
+
+        try:
+            since = int(args["since"])
+            limit = min(int(args.get("limit", CHANGES_PAGE_SIZE)), CHANGES_PAGE_SIZE)
+            wait = min(float(args.get("wait", 0)), self.config.get("CHANGES_MAX_WAIT", CHANGES_MAX_WAIT))
+
+            if since < 0 or limit <= 0:
+                raise ValueError()
+        except (ValueError, TypeError):
+            return self.error_response(http_exceptions.BadRequest)
+
+        deadline = time.monotonic() + wait
+        poll_interval = self.config.get("CHANGES_POLL_INTERVAL", CHANGES_POLL_INTERVAL)
+
+        try:
+            while True:
+                version = self.change_notifier.version(ctx.login)
+                change_docs = read_changes(self.db, ctx.login, since, limit)
+                remaining = deadline - time.monotonic()
+
+                if change_docs or remaining <= 0:
+                    break
+
+                self.change_notifier.wait(ctx.login, version, min(remaining, poll_interval))
+        except CursorExpired:
+            return self.error_response(http_exceptions.Gone)
+
+        return flask.jsonify({
+            "changes": [change_doc_to_json(doc) for doc in change_docs],
+            "cursor": change_docs[-1]["seq"] if change_docs else since,
+            "has_more": len(change_docs) == limit
+        })
+
+    @is_authorized(["POST"])
+    def _file_storage_links_handler(self, ctx):
+        """
+        Выдает короткую подписанную ссылку l/<token>/ на файл пользователя.
+        Тело запроса: {"file_guid": ..., "ttl": время жизни в секундах}.
+        """
+        try:
+            request_json = flask.request.get_json()
+            file_guid = str(request_json["file_guid"])
+            ttl = int(request_json.get("ttl", self.config.get("LINK_TTL", LINK_TTL)))
+
+            if not 0 < ttl <= self.config.get("LINK_MAX_TTL", LINK_MAX_TTL):
+                raise ValueError()
+
+            if self.db.files.find_one({"_id": file_guid, "owner_login": ctx.login}, {"_id": 1}) is None:
+                raise KeyError(file_guid)
+
+            token, expires_at = self.link_signer.sign(file_guid, ttl)
+        except (KeyError, ValueError, TypeError, AttributeError):
+            return self.error_response(http_exceptions.BadRequest)
+
+        return flask.jsonify({"link": f"l/{token}/", "expires_at": expires_at})
+
+    def _link_handler(self, token):
+        # Подпись проверяется без базы, так что перебор токенов ее не нагружает
+        link = self.link_signer.verify(token)
+
+        if link is None:
+            return self.error_response(http_exceptions.NotFound)
+
+        file_guid, expires_at = link
+        file_doc = self.get_file_from_storage(file_guid, public=None)
+
+        if file_doc is None:
+            return self.error_response(http_exceptions.NotFound)
+
+        response = self.send_file_from_storage(file_doc)
+        response.headers["Cache-Control"] = f"public, max-age={max(int(expires_at - time.time()), 0)}"
+        return response
+
+    def get_request_file_guids(self):
+        files = flask.request.json["files"]
+
+        if not files or not isinstance(files, list):
+            raise ValueError()
+
+        if len(files) > self.config.get("BATCH_MAX_FILES", 1000):
+            raise ValueError()
+
+        return [str(file_guid) for file_guid in files]
+
+    @is_authorized(["POST"])
+    def _file_storage_batch_handler(self, ctx):
+        """
+        Загрузка нескольких файлов одним multipart запросом
+        (все поля file), документы файлов создаются одним insert_many
+        """
+        files = flask.request.files.getlist("file")
+
+        if not files or len(files) > self.config.get("BATCH_MAX_FILES", 1000):
+            return self.error_response(http_exceptions.BadRequest)
+
+        if any(not file.filename for file in files):
+            return self.error_response(http_exceptions.BadRequest)
+
+        file_guids = self.create_files(ctx.login, [
+            (file.filename, self.blob_storage.write(file.stream))
+            for file in files
+        ])
+
+        return flask.jsonify({
+            "files": [{
+                "filename": file.filename,
+                "file_guid": file_guid
+            } for file, file_guid in zip(files, file_guids)]
+        })
+
+    def _file_storage_archive_handler(self):
+        """
+        Скачивание нескольких файлов {"files": [guid, ...]} zip архивом,
+        который собирается и отдается потоком по мере чтения чанков.
+        Как и GET /file_storage/, работает для публичных файлов без авторизации.
+        """
+        try:
+            file_guids = self.get_request_file_guids()
+        except Exception:
+            return self.error_response(http_exceptions.BadRequest)
+
+        file_docs = {
+            file_doc["_id"]: file_doc
+            for file_doc in self.db.files.find(
+                {"_id": {"$in": file_guids}, "public": True}, SERVE_PROJECTION
+            )
+        }
+
+        if not file_docs:
+            return self.error_response(http_exceptions.BadRequest)
+
+        def iter_entries():
+            for file_guid in file_guids:
+                file_doc = file_docs.get(file_guid)
+
+                if file_doc is None:
+                    continue
+
+                # Старый документ с file_bytes читается целиком, только когда
+                # до него дошла очередь в архиве
+                if "chunks" not in file_doc:
+                    file_doc = self.db.files.find_one({"_id": file_guid})
+
+                yield file_doc["filename"], self.iter_file_content(file_doc)
+
+        return flask.Response(
+            iter_zip(iter_entries()),
+            mimetype="application/zip",
+            headers={"Content-Disposition": content_disposition("files.zip")}
+        )
+
+    @is_authorized(["POST"])
+    def _file_storage_metadata_handler(self, ctx):
+        try:
+            file_guids = self.get_request_file_guids()
+        except Exception:
+            return self.error_response(http_exceptions.BadRequest)
+
         file_docs = self.db.files.find(
-            {"owner_login": ctx.login},
-            {"filename": 1, "_id": 1}
+            {"owner_login": ctx.login, "_id": {"$in": file_guids}},
+            METADATA_PROJECTION
         )
 
-        files = [{
-            "filename": doc["filename"],
-            "file_guid": doc["_id"]
-        } for doc in file_docs]
+        return flask.jsonify({
+            "files": [file_doc_to_metadata(doc) for doc in file_docs]
+        })
+
+    @is_authorized(["POST"])
+    def _negotiate_handler(self, ctx):
+        """
+        Первая фаза загрузки с дедупликацией: клиент присылает хеши чанков
+        файла {"chunks": [hash, ...]}, сервер отвечает, каких из них у него нет,
+        и размером чанка, которым нужно резать файл.
+        """
+        try:
+            chunk_hashes = [str(chunk_hash) for chunk_hash in flask.request.json["chunks"]]
+        except Exception:
+            return self.error_response(http_exceptions.BadRequest)
+
+        return flask.jsonify({
+            "missing": self.blob_storage.missing_chunks(chunk_hashes, ctx.login),
+            "chunk_size": self.blob_storage.chunk_size
+        })
+
+    @is_authorized(["PUT"])
+    def _chunks_handler(self, ctx):
+        """
+        Загрузка одного недостающего чанка телом запроса, хеш передается
+        параметром hash и сверяется с содержимым. Размер чанка сразу
+        учитывается в квоте владельца и переходит в размер файла при commit
+        (если файл так и не собран, место освобождает сборщик мусора).
+        """
+        expected_hash = flask.request.args.get("hash")
+        data_hash = hashlib.sha256()
+        data = self.blob_storage.read_chunk_from(flask.request.stream, data_hash)
+
+        if flask.request.stream.read(1):
+            return self.error_response(http_exceptions.RequestEntityTooLarge)
+
+        if not data or data_hash.hexdigest() != expected_hash:
+            return self.error_response(http_exceptions.BadRequest)
+
+        reserve_bytes(self.db, ctx.login, len(data), self.user_quota)
+
+        try:
+            chunk_ref = self.blob_storage.put_chunk(data)
+            reserved = self.blob_storage.reserve_chunk(ctx.login, chunk_ref["hash"], len(data))
+        except Exception:
+            release_bytes(self.db, ctx.login, len(data))
+            raise
+
+        # Повторная загрузка того же чанка до commit уже учтена
+        if not reserved:
+            release_bytes(self.db, ctx.login, len(data))
+
+        return flask.jsonify(chunk_ref)
+
+    @is_authorized(["POST"])
+    def _commit_handler(self, ctx):
+        """
+        Вторая фаза загрузки с дедупликацией: создает документ файла
+        {"filename": ..., "chunks": [hash, ...], "sha256": ...} по ссылкам
+        на уже сохраненные чанки (см. assembled_content про sha256).
+        Если чанки успел удалить сборщик мусора, ответ 409 со списком
+        missing: их нужно загрузить заново и повторить commit.
+        """
+        try:
+            request_json = flask.request.json
+            filename = str(request_json["filename"])
+            chunk_hashes = [str(chunk_hash) for chunk_hash in request_json["chunks"]]
+            claimed_sha256 = parse_sha256(request_json.get("sha256"))
+
+            if not filename:
+                raise ValueError()
+
+            chunk_refs = self.blob_storage.resolve_chunks(chunk_hashes, ctx.login)
+        except Exception:
+            return self.error_response(http_exceptions.BadRequest)
+
+        content = self.assembled_content(
+            chunk_refs, sum(chunk_ref["size"] for chunk_ref in chunk_refs), claimed_sha256
+        )
+        reserved = self.blob_storage.take_reserved(ctx.login, chunk_hashes)
+
+        try:
+            file_guid = self.create_file(ctx.login, filename, content, reserved)
+        except MissingChunks as e:
+            return self.error_response(http_exceptions.Conflict, missing=e.chunk_hashes)
+
+        return flask.jsonify({"file_guid": file_guid})
+
+    def assembled_content(self, chunk_refs, size, claimed_sha256):
+        """
+        Поля содержимого файла, собранного из уже сохраненных чанков.
+        Пересчет sha256 здесь означал бы чтение и распаковку всего файла
+        в потоке запроса, поэтому хеш считает потом сборщик мусора
+        (GarbageCollector.verify_hashes), а до этого ETag и кеш тел файла
+        строятся по его GUID (см. content_key). Хеш от клиента сохраняется
+        только для сверки.
+        """
+        return {
+            "chunks": chunk_refs,
+            "size": size,
+            "sha256": None,
+            "claimed_sha256": claimed_sha256,
+            "sha256_verified": False
+        }
+
+    def get_upload_session(self, session_id, owner_login):
+        # Истекшие сессии удаляет сборщик мусора, освобождая их место
+        return self.db.upload_sessions.find_one({
+            "_id": session_id,
+            "owner_login": owner_login,
+            "expires_at": {"$gt": datetime.datetime.utcnow()}
+        })
+
+    @is_authorized(["POST"])
+    def _upload_sessions_handler(self, ctx):
+        """
+        Создает сессию загрузки по частям {"filename": ..., "size": ..., "part_size": ...}.
+        Размер части округляется до кратного размеру чанка, чтобы файл,
+        собранный из частей, резался на чанки так же, как при обычной загрузке.
+        """
+        try:
+            request_json = flask.request.json
+            filename = str(request_json["filename"])
+            size = int(request_json["size"])
+            requested_part_size = int(request_json.get("part_size", 0))
+
+            if not filename or size < 0:
+                raise ValueError()
+        except Exception:
+            return self.error_response(http_exceptions.BadRequest)
+
+        chunk_size = self.blob_storage.chunk_size
+        max_part_size = self.config.get("UPLOAD_MAX_PART_SIZE", 64 * 1024 * 1024)
+        part_size = max(min(requested_part_size, max_part_size) // chunk_size, 1) * chunk_size
+        now = datetime.datetime.utcnow()
+        session_id = uuid.uuid4().hex
+
+        self.db.upload_sessions.insert_one({
+            "_id": session_id,
+            "owner_login": ctx.login,
+            "filename": filename,
+            "size": size,
+            "part_size": part_size,
+            "parts": {},
+            "reserved_bytes": 0,
+            "created_at": now,
+            "expires_at": now + datetime.timedelta(
+                seconds=self.config.get("UPLOAD_SESSION_TTL", 24 * 60 * 60)
+            )
+        })
+
+        return flask.jsonify({
+            "session_id": session_id,
+            "part_size": part_size,
+            "parts_count": -(-size // part_size)
+        })
+
+    @is_authorized(["GET", "DELETE"])
+    def _upload_session_handler(self, ctx, session_id):
+        session_doc = self.get_upload_session(session_id, ctx.login)
+
+        if session_doc is None:
+            return self.error_response(http_exceptions.NotFound)
+
+        if flask.request.method == "DELETE":
+            session_doc = self.db.upload_sessions.find_one_and_delete({"_id": session_id})
+
+            if session_doc is not None:
+                release_bytes(self.db, ctx.login, session_doc.get("reserved_bytes", 0))
+
+            return "Success"
 
         return flask.jsonify({
-            "files": files
+            "session_id": session_id,
+            "filename": session_doc["filename"],
+            "size": session_doc["size"],
+            "part_size": session_doc["part_size"],
+            "parts_count": -(-session_doc["size"] // session_doc["part_size"]),
+            "received": sorted(int(index) for index in session_doc["parts"])
         })
 
+    @is_authorized(["PUT"])
+    def _upload_session_part_handler(self, ctx, session_id, index):
+        session_doc = self.get_upload_session(session_id, ctx.login)
+
+        if session_doc is None:
+            return self.error_response(http_exceptions.NotFound)
+
+        part_size = session_doc["part_size"]
+        expected_size = min(part_size, session_doc["size"] - index * part_size)
+
+        if expected_size <= 0 or flask.request.content_length != expected_size:
+            return self.error_response(http_exceptions.BadRequest)
+
+        # Часть учитывается в квоте сразу, до сборки файла
+        reserve_bytes(self.db, ctx.login, expected_size, self.user_quota)
+
+        try:
+            content = self.blob_storage.write(flask.request.stream)
+        except Exception:
+            release_bytes(self.db, ctx.login, expected_size)
+            raise
+
+        if content["size"] != expected_size:
+            release_bytes(self.db, ctx.login, expected_size)
+            return self.error_response(http_exceptions.BadRequest)
+
+        result = self.db.upload_sessions.update_one(
+            {"_id": session_id, f"parts.{index}": {"$exists": False}},
+            {"$set": {f"parts.{index}": content}, "$inc": {"reserved_bytes": expected_size}}
+        )
+
+        # Повтор уже принятой части: ее место учтено при первой загрузке
+        if not result.modified_count:
+            release_bytes(self.db, ctx.login, expected_size)
+            self.db.upload_sessions.update_one(
+                {"_id": session_id},
+                {"$set": {f"parts.{index}": content}}
+            )
+
+        return flask.jsonify({"index": index, "sha256": content["sha256"]})
+
+    @is_authorized(["POST"])
+    def _upload_session_complete_handler(self, ctx, session_id):
+        session_doc = self.get_upload_session(session_id, ctx.login)
+
+        if session_doc is None:
+            return self.error_response(http_exceptions.NotFound)
+
+        parts = session_doc["parts"]
+        parts_count = -(-session_doc["size"] // session_doc["part_size"])
+
+        try:
+            claimed_sha256 = parse_sha256((flask.request.get_json(silent=True) or {}).get("sha256"))
+        except (AttributeError, ValueError):
+            return self.error_response(http_exceptions.BadRequest)
+
+        if any(str(index) not in parts for index in range(parts_count)):
+            return self.error_response(http_exceptions.BadRequest)
+
+        chunk_refs = [
+            chunk_ref
+            for index in range(parts_count)
+            for chunk_ref in parts[str(index)]["chunks"]
+        ]
+        content = self.assembled_content(chunk_refs, session_doc["size"], claimed_sha256)
+        # Сессия удаляется до создания файла: место ее частей переходит к файлу,
+        # и параллельный complete или DELETE той же сессии его уже не получит
+        session_doc = self.db.upload_sessions.find_one_and_delete({"_id": session_id})
+
+        if session_doc is None:
+            return self.error_response(http_exceptions.NotFound)
+
+        try:
+            file_guid = self.create_file(
+                ctx.login, session_doc["filename"], content, session_doc.get("reserved_bytes", 0)
+            )
+        except MissingChunks as e:
+            return self.restore_upload_session(session_doc, e.chunk_hashes)
+
+        return flask.jsonify({"file_guid": file_guid})
+
+    def restore_upload_session(self, session_doc, missing):
+        """
+        Возвращает сессию, файл которой не собрался из-за чанков, удаленных
+        сборщиком мусора: части с этими чанками убираются из сессии, и
+        клиент загружает их заново (ответ 409 с missing и parts).
+        create_file уже освободил место всех частей, поэтому место
+        оставшихся учитывается снова.
+        """
+        missing_parts = sorted(
+            int(index)
+            for index, part in session_doc["parts"].items()
+            if any(chunk_ref["hash"] in missing for chunk_ref in part["chunks"])
+        )
+        parts = {
+            index: part
+            for index, part in session_doc["parts"].items()
+            if int(index) not in missing_parts
+        }
+        reserved = sum(part["size"] for part in parts.values())
+
+        reserve_bytes(self.db, session_doc["owner_login"], reserved)
+        self.db.upload_sessions.insert_one({**session_doc, "parts": parts, "reserved_bytes": reserved})
+
+        return self.error_response(http_exceptions.Conflict, missing=missing, parts=missing_parts)
+
     @is_authorized(["GET"])
     def _register_check_handler(self, ctx):
-        return "Success"
+        response = flask.make_response("Success")
+        response.headers["X-Auth-Token"] = self.auth_tokens.dumps(
+            ctx.login,
+            ctx.password_hash or self.get_password_hash(ctx.login)
+        )
+        return response
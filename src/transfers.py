@@ -0,0 +1,120 @@
+import time
+import threading
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+from .utils import constants
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class TaskSignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(object)
+    data = pyqtSignal(object)
+    progress = pyqtSignal(int, int, float)
+
+
+class Task(QRunnable):
+    """
+    Фоновая задача для QThreadPool. Функция задачи вызывается как
+    fn(task, *args, **kwargs) в потоке пула и может сообщать прогресс через
+    task.progress(done, total), отдавать промежуточные данные через
+    task.emit(data) и проверять отмену через task.check_cancelled().
+    Сигналы приходят в главный поток Qt, поэтому их обработчики могут
+    спокойно менять интерфейс.
+    """
+
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = TaskSignals()
+        self.cancelled = threading.Event()
+        self.started_at = None
+        self.last_progress_at = 0
+        self.setAutoDelete(False)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def check_cancelled(self):
+        if self.cancelled.is_set():
+            raise TaskCancelled()
+
+    def emit(self, data):
+        self.check_cancelled()
+        self.signals.data.emit(data)
+
+    def progress(self, done, total):
+        """
+        Сообщает прогресс и скорость передачи в байтах в секунду.
+        Сигнал отправляется не чаще раза в PROGRESS_INTERVAL секунд.
+        Вызывается из кода передачи, поэтому заодно прерывает
+        передачу при отмене задачи.
+        """
+        self.check_cancelled()
+        now = time.monotonic()
+
+        finished = total and done >= total
+
+        if not finished and now - self.last_progress_at < constants.PROGRESS_INTERVAL:
+            return
+
+        self.last_progress_at = now
+        elapsed = max(now - self.started_at, 1e-6)
+        self.signals.progress.emit(done, total, done / elapsed)
+
+    def run(self):
+        self.started_at = time.monotonic()
+
+        try:
+            self.check_cancelled()
+            result = self.fn(self, *self.args, **self.kwargs)
+        except Exception as e:
+            self.signals.failed.emit(e)
+        else:
+            self.signals.finished.emit(result)
+
+
+class TransferManager(QObject):
+    """
+    Очередь фоновых сетевых операций клиента: одновременно выполняется не
+    больше max_concurrent задач, остальные ждут в очереди QThreadPool.
+    """
+
+    def __init__(self, max_concurrent=constants.MAX_CONCURRENT_TRANSFERS, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_concurrent)
+        self.tasks = set()
+
+    def submit(self, fn, *args, on_finished=None, on_failed=None, on_data=None,
+               on_progress=None, **kwargs):
+        task = Task(fn, *args, **kwargs)
+
+        for signal, slot in (
+            (task.signals.finished, on_finished),
+            (task.signals.failed, on_failed),
+            (task.signals.data, on_data),
+            (task.signals.progress, on_progress),
+        ):
+            if slot is not None:
+                signal.connect(slot)
+
+        task.signals.finished.connect(lambda _: self.tasks.discard(task))
+        task.signals.failed.connect(lambda _: self.tasks.discard(task))
+        self.tasks.add(task)
+        self.pool.start(task)
+        return task
+
+    def cancel_all(self):
+        for task in list(self.tasks):
+            task.cancel()
+
+    @property
+    def active_count(self):
+        return len(self.tasks)
@@ -0,0 +1,64 @@
+import time
+import zipfile
+
+from pathlib import PurePosixPath
+
+
+class StreamBuffer:
+    """
+    Файлоподобный объект без seek/tell, в который пишет ZipFile.
+    Накопленные байты забираются через pop, поэтому в памяти лежит
+    только то, что еще не отдано клиенту.
+    """
+
+    def __init__(self):
+        self.pieces = []
+
+    def write(self, data):
+        self.pieces.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self.pieces)
+        self.pieces = []
+        return data
+
+
+def unique_name(name, used_names):
+    path = PurePosixPath(name.replace("\\", "/")).name or "file"
+    candidate = path
+    counter = 1
+
+    while candidate in used_names:
+        stem, dot, suffix = path.rpartition(".")
+        candidate = f"{stem} ({counter}).{suffix}" if dot and stem else f"{path} ({counter})"
+        counter += 1
+
+    used_names.add(candidate)
+    return candidate
+
+
+def iter_zip(entries):
+    """
+    Собирает zip архив на лету из entries - пар (имя файла, итератор байтов)
+    и отдает его кусками по мере записи. Архив пишется в режиме потока
+    (data descriptor, zip64), так что размер файлов заранее не нужен.
+    """
+    buffer = StreamBuffer()
+    used_names = set()
+
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name, pieces in entries:
+            info = zipfile.ZipInfo(unique_name(name, used_names), time.localtime()[:6])
+
+            with archive.open(info, "w", force_zip64=True) as entry:
+                for piece in pieces:
+                    entry.write(piece)
+                    yield buffer.pop()
+
+            yield buffer.pop()
+
+    yield buffer.pop()
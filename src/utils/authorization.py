@@ -1,16 +1,171 @@
+import os
+import hmac
+import base64
+import string
 import hashlib
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+from .cache import TTLCache
+
+ALLOWED_LOGIN_CHARS = string.ascii_lowercase + string.digits + '_'
+
+
+def parse_registration(json):
+    """
+    Достает логин и пароль из JSON запроса регистрации,
+    при невалидных данных бросает исключение
+    """
+    creds = json["credentials"]
+    login = str(creds["login"])
+    password = str(creds["password"])
+
+    if any(s not in ALLOWED_LOGIN_CHARS for s in login):
+        raise ValueError()
+
+    if any(s.isspace() for s in password):
+        raise ValueError()
+
+    return login, password
+
+
+def parse_authorization_header(credentials):
+    login, password, *_ = str(credentials).lower().split()
+
+    if not login or not password:
+        raise ValueError
+
+    return login, password
+
+
+def b64encode(data):
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def b64decode(data):
+    return base64.b64decode(data + "=" * (-len(data) % 4))
 
 
 class CredentialsResolver:
+    """
+    Хеширование паролей солевым KDF. Хеш хранится с префиксом схемы:
+        pbkdf2_sha256$<iterations>$<salt>$<hash>
+        scrypt$<n>$<r>$<p>$<salt>$<hash>
+    Хеши без префикса - старый формат (sha256 без соли), они принимаются
+    и заменяются новыми при следующем входе (needs_rehash).
+    """
+
+    def __init__(self, scheme="pbkdf2_sha256", iterations=260000, scrypt_n=2 ** 14,
+                 scrypt_r=8, scrypt_p=1):
+        if scheme not in ("pbkdf2_sha256", "scrypt"):
+            raise ValueError(f"Unknown password hash scheme: {scheme}")
+
+        self.scheme = scheme
+        self.iterations = iterations
+        self.scrypt_params = (scrypt_n, scrypt_r, scrypt_p)
+
+    def _derive(self, scheme, params, salt, password):
+        if scheme == "pbkdf2_sha256":
+            return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, params[0])
 
-    def __init__(self, algo=hashlib.sha256):
-        self.algo = algo
+        n, r, p = params
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 2 ** 20)
+
+    def _params(self, scheme):
+        return (self.iterations,) if scheme == "pbkdf2_sha256" else self.scrypt_params
 
     def encode(self, password):
-        return self.algo(password.encode()).hexdigest()
+        salt = os.urandom(16)
+        params = self._params(self.scheme)
+        derived = self._derive(self.scheme, params, salt, password)
+        return "$".join([self.scheme, *map(str, params), b64encode(salt), b64encode(derived)])
 
     def match(self, pwd_hash, pwd):
-        return self.encode(pwd) == pwd_hash
+        if "$" not in pwd_hash:
+            legacy_hash = hashlib.sha256(pwd.encode()).hexdigest()
+            return hmac.compare_digest(legacy_hash, pwd_hash)
+
+        scheme, *params, salt, derived = pwd_hash.split("$")
+        expected = self._derive(scheme, tuple(map(int, params)), b64decode(salt), pwd)
+        return hmac.compare_digest(expected, b64decode(derived))
+
+    def needs_rehash(self, pwd_hash):
+        scheme, *params = pwd_hash.split("$")[:-2] or [None]
+        return scheme != self.scheme or tuple(map(int, params)) != self._params(scheme)
+
+
+class PasswordVerifier:
+    """
+    Проверка паролей, при которой дорогой KDF считается один раз на сессию.
+    Успешные проверки кешируются по HMAC(секрет процесса, логин, хеш, пароль),
+    так что в кеше нет ни паролей, ни значений, по которым их можно подобрать,
+    а смена пароля (другой хеш) сама делает записи недействительными.
+    KDF считается в пуле из workers потоков: это ограничивает загрузку CPU
+    проверками, а одновременные проверки одних и тех же данных ждут одного
+    вычисления.
+    """
+
+    def __init__(self, resolver, cache_size=1024, ttl=300, workers=4):
+        self.resolver = resolver
+        self.verified = TTLCache(cache_size, ttl)
+        self.executor = ThreadPoolExecutor(workers)
+        self._secret = os.urandom(32)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _cache_key(self, login, password_hash, password):
+        message = "\0".join((login, password_hash, password)).encode()
+        return hmac.new(self._secret, message, hashlib.sha256).digest()
+
+    def _finish(self, key, future):
+        with self._lock:
+            self._pending.pop(key, None)
+
+        if not future.cancelled() and future.exception() is None and future.result():
+            self.verified.set(key, True)
+
+    def verify_future(self, login, password_hash, password):
+        """
+        Возвращает concurrent.futures.Future с результатом проверки,
+        для асинхронного сервера (asyncio.wrap_future)
+        """
+        key = self._cache_key(login, password_hash, password)
+        submitted = False
+
+        with self._lock:
+            future = self._pending.get(key)
+
+            if future is None:
+                if self.verified.get(key):
+                    future = Future()
+                    future.set_result(True)
+                else:
+                    future = self.executor.submit(self.resolver.match, password_hash, password)
+                    self._pending[key] = future
+                    submitted = True
+
+        # Уже завершенный future вызывает коллбек сразу, а _finish берет
+        # ту же блокировку, поэтому коллбек добавляется после нее
+        if submitted:
+            future.add_done_callback(lambda done: self._finish(key, done))
+
+        return future
+
+    def verify(self, login, password_hash, password):
+        key = self._cache_key(login, password_hash, password)
+
+        if self.verified.get(key):
+            return True
+
+        return self.verify_future(login, password_hash, password).result()
+
+    def encode(self, password):
+        return self.executor.submit(self.resolver.encode, password).result()
+
+    def needs_rehash(self, password_hash):
+        return self.resolver.needs_rehash(password_hash)
 
 
 class AuthorizationContext:
@@ -19,3 +174,77 @@ class AuthorizationContext:
         self.request = request
         self.login = login
         self.password_hash = password_hash
+
+
+def password_hash_fingerprint(password_hash):
+    return hashlib.sha256(password_hash.encode()).hexdigest()[:16]
+
+
+class CredentialsCache:
+    """
+    Кеш хешей паролей пользователей (login -> password hash), чтобы не ходить
+    в MongoDB на каждый авторизованный запрос.
+    Записи живут ttl секунд в LRU кеше процесса и, если передан shared_store,
+    дублируются в общем для воркеров хранилище. Кешируются только найденные
+    пользователи, поэтому регистрация нового логина кеш не портит, а при
+    изменении пользователя запись нужно сбросить через invalidate.
+    """
+
+    def __init__(self, max_size=1024, ttl=300, shared_store=None):
+        self.ttl = ttl
+        self.local = TTLCache(max_size, ttl)
+        self.shared_store = shared_store
+
+    def _shared_key(self, login):
+        return "credentials:" + login
+
+    def get(self, login):
+        password_hash = self.local.get(login)
+
+        if password_hash is None and self.shared_store is not None:
+            password_hash = self.shared_store.get(self._shared_key(login))
+
+            if password_hash is not None:
+                self.local.set(login, password_hash)
+
+        return password_hash
+
+    def set(self, login, password_hash):
+        self.local.set(login, password_hash)
+
+        if self.shared_store is not None:
+            self.shared_store.set(self._shared_key(login), password_hash, self.ttl)
+
+    def invalidate(self, login):
+        self.local.pop(login)
+
+        if self.shared_store is not None:
+            self.shared_store.delete(self._shared_key(login))
+
+
+class AuthTokenSigner:
+    """
+    Подписанные токены сессии. Токен выдается после успешного register/check
+    и содержит логин и отпечаток хеша пароля. Отпечаток сверяется с хешем
+    из кеша учетных данных (при промахе - из БД), поэтому после смены
+    пароля старые токены перестают приниматься.
+    """
+
+    salt = "lolder-auth-token"
+
+    def __init__(self, secret_key, max_age=3600):
+        self.serializer = URLSafeTimedSerializer(secret_key, salt=self.salt)
+        self.max_age = max_age
+
+    def dumps(self, login, password_hash):
+        return self.serializer.dumps({
+            "login": login,
+            "fingerprint": password_hash_fingerprint(password_hash)
+        })
+
+    def loads(self, token):
+        try:
+            data = self.serializer.loads(token, max_age=self.max_age)
+            return str(data["login"]), str(data["fingerprint"])
+        except (BadSignature, KeyError, TypeError):
+            return None
@@ -0,0 +1,462 @@
+import os
+import mmap
+import hashlib
+import tempfile
+import datetime
+
+from bson.binary import Binary
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from .compression import get_codec, choose_codec, default_codec_name, MIN_RATIO, CODECS
+
+CHUNK_SIZE = 4 * 1024 * 1024
+READ_SIZE = 64 * 1024
+
+
+def chunk_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def parse_sha256(value):
+    # Хеш содержимого, присланный клиентом: None или 64 hex символа
+    if value is None:
+        return None
+
+    value = str(value).lower()
+
+    if len(value) != 64 or value.strip("0123456789abcdef"):
+        raise ValueError("Invalid sha256")
+
+    return value
+
+
+class BlobStorage:
+    """
+    Контентно-адресуемое хранилище блобов.
+    Файл разбивается на чанки фиксированного размера, каждый чанк хранится
+    один раз под своим sha256 хешем, а документ файла хранит только
+    упорядоченный список ссылок на чанки вида
+    {"hash": ..., "size": ..., "codec": ..., "stored_size": ...}.
+    Хеш и size относятся к исходным данным, а хранятся они сжатыми кодеком
+    codec (stored_size - размер после сжатия). Метаданные чанков лежат в
+    коллекции chunks, сами данные - в реализации конкретного бекенда.
+    Дедупликация по хешам ограничена владельцем: в chunk_grants записано,
+    какие чанки пользователь уже загружал сам или хранит в своих файлах,
+    и сослаться без загрузки можно только на них. Иначе по одному хешу
+    можно было бы получить чужие данные или узнать, что они хранятся.
+    """
+
+    def __init__(self, db, chunk_size=CHUNK_SIZE, compression="none", min_ratio=MIN_RATIO):
+        self.chunks = db.chunks
+        self.grants = db.chunk_grants
+        self.chunk_size = chunk_size
+        self.compression = default_codec_name() if compression == "auto" else compression
+        self.min_ratio = min_ratio
+        get_codec(self.compression)
+
+    def _insert(self, chunk_hash, data, meta):
+        raise NotImplementedError
+
+    def _load(self, chunk_hash):
+        raise NotImplementedError
+
+    def reclaim_chunk(self, chunk_hash, condition):
+        """
+        Удаляет чанк, если его метаданные все еще подходят под condition
+        (нет ссылок). Возвращает True, если чанк удален.
+        """
+        return self.chunks.delete_one({"_id": chunk_hash, **condition}).deleted_count > 0
+
+    def touch_released(self, chunk_hashes):
+        # На чанки без ссылок сейчас сошлется новый файл: откладываем их удаление
+        self.chunks.update_many(
+            {"_id": {"$in": list(chunk_hashes)}, "refs": {"$lte": 0}},
+            {"$set": {"released_at": datetime.datetime.utcnow()}}
+        )
+
+    def has_chunk(self, chunk_hash):
+        return self.chunks.find_one({"_id": chunk_hash}, {"_id": 1}) is not None
+
+    def chunk_ref(self, chunk_doc):
+        return {
+            "hash": chunk_doc["_id"],
+            "size": chunk_doc["size"],
+            "codec": chunk_doc.get("codec", "none"),
+            "stored_size": chunk_doc.get("stored_size", chunk_doc["size"])
+        }
+
+    def grant_chunks(self, owner_login, chunk_hashes):
+        """Отмечает, что данные чанков у владельца есть (он их загрузил)"""
+        if not chunk_hashes:
+            return
+
+        now = datetime.datetime.utcnow()
+
+        try:
+            self.grants.bulk_write([
+                UpdateOne(
+                    {"owner_login": owner_login, "hash": chunk_hash},
+                    {"$setOnInsert": {"granted_at": now}},
+                    upsert=True
+                )
+                for chunk_hash in set(chunk_hashes)
+            ], ordered=False)
+        except BulkWriteError as e:
+            # Параллельный upsert того же чанка уже записал отметку
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+
+    def reserve_chunk(self, owner_login, chunk_hash, size):
+        """
+        Отмечает чанк, загруженный владельцем, вместе с size байт, которые
+        учтены в его used_bytes до сборки файла (reserved). Возвращает
+        False, если загрузка этого чанка у владельца уже учтена.
+        """
+        now = datetime.datetime.utcnow()
+
+        try:
+            self.grants.update_one(
+                {"owner_login": owner_login, "hash": chunk_hash, "reserved": {"$exists": False}},
+                {"$set": {"reserved": size, "reserved_at": now}, "$setOnInsert": {"granted_at": now}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+
+        return True
+
+    def take_reserved(self, owner_login, chunk_hashes):
+        """
+        Снимает отметки reserved с чанков собираемого файла и возвращает
+        сумму: эти байты уже учтены и становятся частью размера файла
+        """
+        reserved = 0
+
+        for chunk_hash in set(chunk_hashes):
+            grant_doc = self.grants.find_one_and_update(
+                {"owner_login": owner_login, "hash": chunk_hash, "reserved": {"$exists": True}},
+                {"$unset": {"reserved": "", "reserved_at": ""}},
+                {"reserved": 1}
+            )
+
+            if grant_doc is not None:
+                reserved += grant_doc["reserved"]
+
+        return reserved
+
+    def granted_chunks(self, owner_login, chunk_hashes):
+        return {
+            grant_doc["hash"]
+            for grant_doc in self.grants.find(
+                {"owner_login": owner_login, "hash": {"$in": list(chunk_hashes)}},
+                {"hash": 1}
+            )
+        }
+
+    def missing_chunks(self, chunk_hashes, owner_login):
+        """
+        Хеши чанков, которые владелец должен загрузить: чанк, которого у
+        владельца нет, считается недостающим, даже если он уже хранится
+        """
+        granted = self.granted_chunks(owner_login, chunk_hashes)
+        existing = {
+            chunk_doc["_id"]
+            for chunk_doc in self.chunks.find({"_id": {"$in": list(granted)}}, {"_id": 1})
+        } if granted else set()
+
+        if existing:
+            self.touch_released(existing)
+
+        return [chunk_hash for chunk_hash in chunk_hashes if chunk_hash not in existing]
+
+    def resolve_chunks(self, chunk_hashes, owner_login):
+        """
+        Собирает список ссылок на чанки по их хешам, беря размеры и кодеки
+        из метаданных хранилища. Бросает KeyError, если какого-то чанка нет
+        или владелец его не загружал.
+        """
+        granted = self.granted_chunks(owner_login, chunk_hashes)
+        chunk_refs = {
+            chunk_doc["_id"]: self.chunk_ref(chunk_doc)
+            for chunk_doc in self.chunks.find(
+                {"_id": {"$in": list(granted)}},
+                {"size": 1, "codec": 1, "stored_size": 1}
+            )
+        }
+
+        return [chunk_refs[chunk_hash] for chunk_hash in chunk_hashes]
+
+    def content_hash(self, chunk_refs):
+        content_hash = hashlib.sha256()
+
+        for data in self.iter_chunks(chunk_refs):
+            content_hash.update(data)
+
+        return content_hash.hexdigest()
+
+    def put_chunk(self, data, codec=None):
+        """
+        Сохраняет чанк, если его еще нет, и возвращает ссылку на него.
+        codec=None - кодек выбирается по содержимому самого чанка.
+        Уже сохраненный чанк не пересжимается, в ссылку попадает его кодек.
+        """
+        data_hash = chunk_hash(data)
+        chunk_doc = self.chunks.find_one(
+            {"_id": data_hash},
+            {"size": 1, "codec": 1, "stored_size": 1, "refs": 1}
+        )
+
+        if chunk_doc is not None:
+            if chunk_doc.get("refs", 1) <= 0:
+                self.touch_released([data_hash])
+
+            return self.chunk_ref(chunk_doc)
+
+        if codec is None:
+            codec = choose_codec(data, self.compression, self.min_ratio)
+
+        stored = get_codec(codec).compress(data)
+
+        # Если чанк целиком сжался хуже, чем выборка, храним его как есть
+        if codec != "none" and len(stored) >= len(data):
+            codec, stored = "none", data
+
+        now = datetime.datetime.utcnow()
+        # Пока файл на чанк не сослался, у него нет ссылок, и сборщик мусора
+        # удалит его, если файл так и не будет создан
+        meta = {
+            "size": len(data),
+            "codec": codec,
+            "stored_size": len(stored),
+            "refs": 0,
+            "released_at": now,
+            "created_at": now
+        }
+        self._insert(data_hash, stored, meta)
+        return self.chunk_ref({"_id": data_hash, **meta})
+
+    def read_chunk_from(self, stream, content_hash):
+        """
+        Набирает из потока один чанк, читая его кусками по READ_SIZE.
+        Потоки запросов могут отдавать данные короче запрошенного, поэтому
+        чтение продолжается до заполнения чанка или конца потока.
+        """
+        data = bytearray()
+
+        while len(data) < self.chunk_size:
+            piece = stream.read(min(READ_SIZE, self.chunk_size - len(data)))
+
+            if not piece:
+                break
+
+            content_hash.update(piece)
+            data += piece
+
+        return bytes(data)
+
+    def choose_file_codec(self, first_chunk):
+        # Кодек файла выбирается один раз, по его первому чанку
+        return choose_codec(first_chunk, self.compression, self.min_ratio)
+
+    def write(self, stream):
+        """
+        Читает поток и сохраняет его по чанкам, не держа в памяти
+        больше одного чанка. Кодек выбирается один раз на файл
+        по началу первого чанка.
+        Возвращает поля для документа файла: chunks, size, sha256.
+        """
+        content_hash = hashlib.sha256()
+        chunk_refs = []
+        size = 0
+        codec = None
+
+        while True:
+            data = self.read_chunk_from(stream, content_hash)
+
+            if not data:
+                break
+
+            if codec is None:
+                codec = self.choose_file_codec(data)
+
+            chunk_refs.append(self.put_chunk(data, codec))
+            size += len(data)
+
+        return {
+            "chunks": chunk_refs,
+            "size": size,
+            "sha256": content_hash.hexdigest()
+        }
+
+    def read_chunk(self, chunk_hash, start=0, end=None, codec="none"):
+        return get_codec(codec).decompress(self._load(chunk_hash))[start:end]
+
+    def iter_range(self, chunk_refs, start=0, end=None):
+        """
+        Отдает байты файла с start по end (не включительно) по одному
+        куску на чанк, пропуская чанки вне диапазона.
+        """
+        offset = 0
+
+        for chunk_ref in chunk_refs:
+            chunk_start = offset
+            offset += chunk_ref["size"]
+
+            if offset <= start:
+                continue
+
+            if end is not None and chunk_start >= end:
+                break
+
+            yield self.read_chunk(
+                chunk_ref["hash"],
+                max(start - chunk_start, 0),
+                None if end is None else min(end - chunk_start, chunk_ref["size"]),
+                chunk_ref.get("codec", "none")
+            )
+
+    def iter_chunks(self, chunk_refs):
+        return self.iter_range(chunk_refs)
+
+    def iter_stored(self, chunk_refs):
+        # Данные чанков в том виде, в котором они хранятся (без распаковки)
+        for chunk_ref in chunk_refs:
+            yield self._load(chunk_ref["hash"])
+
+
+class MongoBlobStorage(BlobStorage):
+    """
+    Хранит данные чанков прямо в документах коллекции chunks
+    (аналог GridFS, но чанки адресуются хешем и не дублируются).
+    """
+
+    def _insert(self, chunk_hash, data, meta):
+        self.chunks.update_one(
+            {"_id": chunk_hash},
+            {"$setOnInsert": {**meta, "data": Binary(data)}},
+            upsert=True
+        )
+
+    def _load(self, chunk_hash):
+        chunk_doc = self.chunks.find_one({"_id": chunk_hash}, {"data": 1})
+
+        if chunk_doc is None:
+            raise KeyError(chunk_hash)
+
+        return bytes(chunk_doc["data"])
+
+
+class LocalBlobStorage(BlobStorage):
+    """
+    Хранит данные чанков в локальной директории вида root/ab/cd/<hash>,
+    метаданные чанков остаются в MongoDB.
+    """
+
+    def __init__(self, db, root, chunk_size=CHUNK_SIZE, compression="none", min_ratio=MIN_RATIO):
+        super().__init__(db, chunk_size, compression, min_ratio)
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def chunk_path(self, chunk_hash):
+        return os.path.join(self.root, chunk_hash[:2], chunk_hash[2:4], chunk_hash)
+
+    def _insert(self, chunk_hash, data, meta):
+        path = self.chunk_path(chunk_hash)
+
+        if not os.path.exists(path):
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory)
+
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+        self.chunks.update_one(
+            {"_id": chunk_hash},
+            {"$setOnInsert": meta},
+            upsert=True
+        )
+
+    def _load(self, chunk_hash):
+        with open(self.chunk_path(chunk_hash), "rb") as f:
+            return f.read()
+
+    def reclaim_chunk(self, chunk_hash, condition):
+        # Файл сначала убирается в сторону: иначе новый put_chunk того же
+        # содержимого между удалением метаданных и файла увидел бы старый
+        # файл, не стал бы его перезаписывать и остался бы без данных
+        path = self.chunk_path(chunk_hash)
+        reclaimed_path = path + ".gc"
+
+        try:
+            os.replace(path, reclaimed_path)
+        except FileNotFoundError:
+            return super().reclaim_chunk(chunk_hash, condition)
+
+        if super().reclaim_chunk(chunk_hash, condition):
+            os.unlink(reclaimed_path)
+            return True
+
+        os.replace(reclaimed_path, path)
+        return False
+
+    def read_chunk(self, chunk_hash, start=0, end=None, codec="none"):
+        if codec != "none":
+            return super().read_chunk(chunk_hash, start, end, codec)
+
+        # Несжатый чанк отображается в память, и копируется только нужный срез
+        with open(self.chunk_path(chunk_hash), "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return mm[start:end]
+
+
+def file_codec(chunk_refs):
+    # Кодек файла для документа: общий кодек чанков или "mixed"
+    codecs = {chunk_ref.get("codec", "none") for chunk_ref in chunk_refs}
+
+    if not codecs:
+        return "none"
+
+    return codecs.pop() if len(codecs) == 1 else "mixed"
+
+
+def stored_content_encoding(chunk_refs):
+    """
+    Возвращает Content-Encoding, с которым хранимые данные файла можно
+    отдать без распаковки, если все чанки сжаты одним таким кодеком.
+    """
+    codec = CODECS.get(file_codec(chunk_refs))
+    return codec.content_encoding if codec is not None else None
+
+
+def create_blob_storage(config, db):
+    """
+    Создает хранилище по конфигу Flask приложения:
+        BLOB_STORAGE - "mongo" (по умолчанию) или "local"
+        BLOB_STORAGE_PATH - директория для "local"
+        BLOB_CHUNK_SIZE - размер чанка в байтах
+        BLOB_COMPRESSION - кодек сжатия новых чанков: "none" (по умолчанию),
+            "auto" (zstd, если установлен, иначе gzip), "gzip", "zstd", "lz4"
+        BLOB_COMPRESSION_MIN_RATIO - данные сжимаются, только если выборка
+            сжимается хотя бы до этой доли исходного размера
+    """
+    backend = config.get("BLOB_STORAGE", "mongo")
+    options = {
+        "chunk_size": int(config.get("BLOB_CHUNK_SIZE", CHUNK_SIZE)),
+        "compression": config.get("BLOB_COMPRESSION", "none"),
+        "min_ratio": float(config.get("BLOB_COMPRESSION_MIN_RATIO", MIN_RATIO))
+    }
+
+    if backend == "mongo":
+        return MongoBlobStorage(db, **options)
+    elif backend == "local":
+        return LocalBlobStorage(db, config.get("BLOB_STORAGE_PATH", "blobs"), **options)
+
+    raise ValueError(f"Unknown blob storage backend: {backend}")
@@ -0,0 +1,137 @@
+import time
+import threading
+
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Потокобезопасный LRU кеш с ограничением по количеству записей
+    и временем жизни записи в секундах.
+    Если задан max_bytes, суммарный размер значений (по функции sizeof)
+    тоже ограничен, а значения больше max_bytes не кешируются.
+    Считает попадания, промахи и вытеснения для stats().
+    """
+
+    def __init__(self, max_size=1024, ttl=300, max_bytes=None, sizeof=len):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remove(self, key):
+        value, expires_at, size = self._items.pop(key)
+        self.size_bytes -= size
+        return value
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+
+            if item is None:
+                self.misses += 1
+                return default
+
+            value, expires_at, size = item
+
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+
+            self._items[key] = (value, time.monotonic() + self.ttl, size)
+            self.size_bytes += size
+
+            while len(self._items) > self.max_size or (
+                self.max_bytes is not None and self.size_bytes > self.max_bytes
+            ):
+                self._remove(next(iter(self._items)))
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+
+            return self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size_bytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._items),
+            "bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SingleFlight:
+    """
+    Склеивает одновременные вызовы с одним ключом: функция выполняется
+    один раз, а остальные потоки ждут и получают тот же результат (или
+    то же исключение). Так всплеск запросов к одному файлу дает одно
+    чтение из базы, а не по чтению на запрос.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = self._calls[key] = {"done": threading.Event()}
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call["done"].wait()
+
+            if "error" in call:
+                raise call["error"]
+
+            return call["result"]
+
+        try:
+            call["result"] = fn(*args)
+            return call["result"]
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+            call["done"].set()
@@ -0,0 +1,171 @@
+import datetime
+import threading
+
+from pymongo import ASCENDING, ReturnDocument
+
+from .listing import datetime_to_ms
+
+RETENTION = 30 * 24 * 60 * 60
+GAP_TIMEOUT = 30
+PAGE_SIZE = 1000
+MAX_WAIT = 25
+POLL_INTERVAL = 1
+CHANGE_PROJECTION = {"_id": 0, "seq": 1, "type": 1, "file_guid": 1, "filename": 1, "size": 1, "recorded_at": 1}
+CHANGES_SORT = [("seq", ASCENDING)]
+
+
+class CursorExpired(Exception):
+    pass
+
+
+def record_changes(db, owner_login, change_type, file_docs):
+    """
+    Записывает в коллекцию changes по изменению на каждый документ файла
+    (change_type - "created" или "deleted"). Номера изменений выделяются
+    одним $inc счетчика users.change_seq владельца, поэтому идут подряд и
+    не повторяются. Возвращает номер последнего изменения.
+    """
+    if not file_docs:
+        return None
+
+    user_doc = db.users.find_one_and_update(
+        {"login": owner_login},
+        {"$inc": {"change_seq": len(file_docs)}},
+        {"change_seq": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    last_seq = user_doc["change_seq"]
+    first_seq = last_seq - len(file_docs) + 1
+    recorded_at = datetime.datetime.utcnow()
+
+    db.changes.insert_many([{
+        "owner_login": owner_login,
+        "seq": seq,
+        "type": change_type,
+        "file_guid": file_doc["_id"],
+        "filename": file_doc.get("filename"),
+        "size": file_doc.get("size"),
+        "recorded_at": recorded_at
+    } for seq, file_doc in enumerate(file_docs, first_seq)])
+
+    return last_seq
+
+
+def current_seq(db, owner_login):
+    user_doc = db.users.find_one({"login": owner_login}, {"change_seq": 1})
+    return (user_doc or {}).get("change_seq", 0)
+
+
+def check_cursor(user_doc, since):
+    """
+    Бросает CursorExpired, если изменения после since уже удалены
+    (trim_changes) или since из будущего, и клиенту нужно заново
+    получить весь список файлов
+    """
+    if since < user_doc.get("trimmed_seq", 0) or since > user_doc.get("change_seq", 0):
+        raise CursorExpired(since)
+
+
+def contiguous_changes(change_docs, since, gap_timeout=GAP_TIMEOUT):
+    """
+    Оставляет изменения, идущие подряд после since. Номер выделяется до
+    вставки изменения, поэтому параллельная запись может появиться позже
+    следующей за ней, и клиент, перескочив пропуск, потерял бы ее.
+    Пропуск, за которым лежат изменения старше gap_timeout секунд,
+    считается брошенным (запрос упал между $inc и вставкой).
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=gap_timeout)
+    expected = since + 1
+    changes = []
+
+    for change_doc in change_docs:
+        if change_doc["seq"] != expected and change_doc["recorded_at"] > cutoff:
+            break
+
+        changes.append(change_doc)
+        expected = change_doc["seq"] + 1
+
+    return changes
+
+
+def changes_filter(owner_login, since):
+    return {"owner_login": owner_login, "seq": {"$gt": since}}
+
+
+def read_changes(db, owner_login, since, limit=PAGE_SIZE):
+    user_doc = db.users.find_one({"login": owner_login}, {"change_seq": 1, "trimmed_seq": 1}) or {}
+    check_cursor(user_doc, since)
+
+    if since == user_doc.get("change_seq", 0):
+        return []
+
+    return contiguous_changes(db.changes.find(
+        changes_filter(owner_login, since), CHANGE_PROJECTION, sort=CHANGES_SORT, limit=limit
+    ), since)
+
+
+def trim_changes(db, retention=RETENTION, batch_size=PAGE_SIZE):
+    """
+    Удаляет пачку изменений старше retention секунд. Сначала у владельцев
+    запоминается номер последнего удаляемого изменения (users.trimmed_seq),
+    чтобы клиенты с более старым курсором получали CursorExpired, а не
+    список с дырой. Возвращает число удаленных изменений.
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=retention)
+    change_docs = list(db.changes.find(
+        {"recorded_at": {"$lt": cutoff}}, {"owner_login": 1, "seq": 1}, limit=batch_size
+    ))
+    trimmed = {}
+
+    for change_doc in change_docs:
+        owner_login = change_doc["owner_login"]
+        trimmed[owner_login] = max(trimmed.get(owner_login, 0), change_doc["seq"])
+
+    for owner_login, seq in trimmed.items():
+        db.users.update_one({"login": owner_login}, {"$max": {"trimmed_seq": seq}})
+
+    if not change_docs:
+        return 0
+
+    return db.changes.delete_many({"_id": {"$in": [change_doc["_id"] for change_doc in change_docs]}}).deleted_count
+
+
+def change_doc_to_json(doc):
+    return {
+        "seq": doc["seq"],
+        "type": doc["type"],
+        "file_guid": doc["file_guid"],
+        "filename": doc.get("filename"),
+        "size": doc.get("size"),
+        "recorded_at": datetime_to_ms(doc["recorded_at"])
+    }
+
+
+class ChangeNotifier:
+    """
+    Будит ждущие long-poll запросы этого процесса, как только владелец
+    записал изменения. Изменения из других процессов ждущий запрос
+    замечает при очередной проверке базы раз в POLL_INTERVAL секунд.
+    """
+
+    def __init__(self):
+        self.versions = {}
+        self._condition = threading.Condition()
+
+    def version(self, owner_login):
+        with self._condition:
+            return self.versions.get(owner_login, 0)
+
+    def notify(self, owner_login):
+        with self._condition:
+            self.versions[owner_login] = self.versions.get(owner_login, 0) + 1
+            self._condition.notify_all()
+
+    def wait(self, owner_login, version, timeout):
+        with self._condition:
+            self._condition.wait_for(lambda: self.versions.get(owner_login, 0) != version, timeout)
+
+            # Ждущие не учитываются, поэтому старые версии просто сбрасываются:
+            # разбуженные раньше времени запросы лишь еще раз проверят базу
+            if len(self.versions) > 10000:
+                self.versions.clear()
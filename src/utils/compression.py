@@ -0,0 +1,128 @@
+import zlib
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+SAMPLE_SIZE = 64 * 1024
+MIN_RATIO = 0.9
+
+
+class Codec:
+    """
+    Кодек сжатия чанков. content_encoding - значение заголовка
+    Content-Encoding, с которым сжатые данные можно отдать клиенту как есть
+    (None, если в HTTP такого кодирования нет).
+    """
+
+    name = "none"
+    content_encoding = None
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        return data
+
+
+class GzipCodec(Codec):
+    # Каждый чанк - отдельный gzip member, а их склейка - валидный gzip поток
+    name = "gzip"
+    content_encoding = "gzip"
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+class ZstdCodec(Codec):
+    # Склейка zstd фреймов - тоже валидный zstd поток
+    name = "zstd"
+    content_encoding = "zstd"
+
+    def __init__(self, level=3):
+        self.level = level
+        # Компрессоры zstandard нельзя использовать из нескольких потоков
+        # одновременно, поэтому у каждого потока запросов они свои
+        self._local = threading.local()
+
+    @property
+    def compressor(self):
+        compressor = getattr(self._local, "compressor", None)
+
+        if compressor is None:
+            compressor = self._local.compressor = zstandard.ZstdCompressor(level=self.level)
+
+        return compressor
+
+    @property
+    def decompressor(self):
+        decompressor = getattr(self._local, "decompressor", None)
+
+        if decompressor is None:
+            decompressor = self._local.decompressor = zstandard.ZstdDecompressor()
+
+        return decompressor
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def decompress(self, data):
+        return self.decompressor.decompressobj().decompress(data)
+
+
+class Lz4Codec(Codec):
+    name = "lz4"
+
+    def compress(self, data):
+        return lz4.frame.compress(data)
+
+    def decompress(self, data):
+        return lz4.frame.decompress(data)
+
+
+CODECS = {"none": Codec(), "gzip": GzipCodec()}
+
+if zstandard is not None:
+    CODECS["zstd"] = ZstdCodec()
+
+if lz4 is not None:
+    CODECS["lz4"] = Lz4Codec()
+
+
+def get_codec(name):
+    return CODECS[name or "none"]
+
+
+def default_codec_name():
+    return "zstd" if "zstd" in CODECS else "gzip"
+
+
+def choose_codec(data, preferred, min_ratio=MIN_RATIO):
+    """
+    Сжимает начало данных предпочтительным кодеком и выбирает его,
+    только если выборка сжалась хотя бы до min_ratio от исходного размера.
+    Уже сжатые данные (архивы, медиа) так сохраняются без сжатия.
+    """
+    if preferred == "none" or not data:
+        return "none"
+
+    sample = data[:SAMPLE_SIZE]
+
+    if len(CODECS[preferred].compress(sample)) <= len(sample) * min_ratio:
+        return preferred
+
+    return "none"
@@ -16,14 +16,41 @@ ALL_FILES: str = "Все файлы"
 DOWNLOAD_ERROR: str = "Ошибка при скачивании файла"
 DOWNLOAD_SUCCESS: str = "{} сохранен в {}"
 SELECT_FILE: str = "Кликните на файл в таблице"
+ARCHIVE_NAME: str = "files_{}.zip"
 LINK_SAVED: str = "Ссылка скопирована в буфер обмена"
 UPLOAD_ERROR: str = "Ошибка при отправлении файла"
 UPLOAD_SUCCESS: str = "Файл {} успешно загружен на сервер"
 DELETE_ERROR: str = "Ошибка при удалении файла с сервера"
 DELETE_SUCCESS: str = "Файл {} успешно удален с сервера"
+UPLOAD_MANY_SUCCESS: str = "Загружено файлов на сервер: {}"
+DELETE_MANY_SUCCESS: str = "Удалено файлов с сервера: {}"
+TRANSFER_PROGRESS: str = "{}: {}% ({:.1f} МБ/с), активных операций: {}"
+TRANSFER_PROGRESS_BYTES: str = "{}: {:.1f} МБ ({:.1f} МБ/с), активных операций: {}"
+TRANSFER_CANCELLED: str = "Передача отменена"
+FILTER_PLACEHOLDER: str = "Поиск по имени файла"
 
 LOGIN_WINDOW_WIDTH: int = 300
 LOGIN_WINDOW_HEIGHT: int = LOGIN_WINDOW_WIDTH // 2
 LOGIN_WIDGET_X_OFFSET: int = 10
 LOGIN_WIDGET_Y_OFFSET: int = 10
 LOGIN_EDITS_HEIGHT: int = 20
+
+UPLOAD_CHUNK_SIZE: int = 4 * 1024 * 1024
+UPLOAD_PART_SIZE: int = 16 * 1024 * 1024
+UPLOAD_MULTIPART_THRESHOLD: int = 64 * 1024 * 1024
+UPLOAD_WORKERS: int = 4
+UPLOAD_PART_RETRIES: int = 5
+DOWNLOAD_READ_SIZE: int = 1024 * 1024
+DOWNLOAD_PART_SIZE: int = 8 * 1024 * 1024
+DOWNLOAD_PARALLEL_THRESHOLD: int = 16 * 1024 * 1024
+DOWNLOAD_WORKERS: int = 4
+MAX_CONCURRENT_TRANSFERS: int = 4
+PROGRESS_INTERVAL: float = 0.2
+HTTP_POOL_SIZE: int = 16
+HTTP_RETRIES: int = 3
+HTTP_BACKOFF: float = 0.5
+HTTP_TIMEOUT: tuple = (5, 60)
+BATCH_UPLOAD_MAX_FILES: int = 500
+BATCH_UPLOAD_MAX_BYTES: int = 16 * 1024 * 1024
+FILES_PAGE_SIZE: int = 1000
+CLIENT_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024
@@ -0,0 +1,48 @@
+import uuid
+import datetime
+
+from .http import guess_mimetype
+from .blob_storage import file_codec
+
+
+def new_file_document(owner_login, filename, content):
+    """
+    Документ коллекции files для сохраненного в BlobStorage содержимого,
+    content - результат BlobStorage.write (chunks, size, sha256).
+    У файла, собранного из чанков без пересчета хеша, sha256 нет
+    (sha256_verified: False), его считает сборщик мусора, а хеш,
+    присланный клиентом, сохраняется отдельно в claimed_sha256.
+    """
+    file_doc = {
+        "_id": str(uuid.uuid1()),
+        "owner_login": owner_login,
+        "filename": filename,
+        "chunks": content["chunks"],
+        "size": content["size"],
+        "sha256": content["sha256"],
+        "codec": file_codec(content["chunks"]),
+        "mimetype": guess_mimetype(filename),
+        "created_at": datetime.datetime.utcnow(),
+        "public": True
+    }
+
+    if content.get("sha256_verified") is False:
+        file_doc["sha256_verified"] = False
+
+        if content.get("claimed_sha256") is not None:
+            file_doc["claimed_sha256"] = content["claimed_sha256"]
+
+    return file_doc
+
+
+def content_key(file_doc):
+    """
+    Ключ содержимого файла для ETag и кеша тел: sha256, посчитанный
+    сервером, а до его появления - GUID файла (содержимое документа файла
+    не меняется). Хешу от клиента доверять нельзя: под чужим хешем можно
+    было бы подменить закешированное тело чужого файла.
+    """
+    if file_doc.get("sha256_verified") is False:
+        return file_doc["_id"].replace("-", "")
+
+    return file_doc["sha256"]
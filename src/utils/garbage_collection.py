@@ -0,0 +1,304 @@
+import time
+import logging
+import datetime
+
+from collections import Counter
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from .limits import release_bytes
+from .changes import RETENTION, record_changes, trim_changes
+
+GRACE_PERIOD = 2 * 24 * 60 * 60
+TOMBSTONE_DELAY = 60
+BATCH_SIZE = 100
+DUTY_CYCLE = 0.1
+IDLE_INTERVAL = 30
+
+
+class MissingChunks(KeyError):
+    """Чанки, которые удалил сборщик мусора, пока на них не было ссылок"""
+
+    def __init__(self, chunk_hashes):
+        super().__init__(chunk_hashes[0])
+        self.chunk_hashes = chunk_hashes
+
+
+def chunk_ref_counts(file_docs):
+    # Сколько ссылок на каждый чанк добавляют (или убирают) документы файлов
+    return Counter(
+        chunk_ref["hash"]
+        for file_doc in file_docs
+        for chunk_ref in file_doc.get("chunks", [])
+    )
+
+
+def add_chunk_refs(db, file_docs):
+    """
+    Увеличивает счетчики ссылок чанков новых файлов. Вызывается до вставки
+    документов файлов, поэтому при сбое счетчик может остаться завышенным
+    (чанк просто не будет удален), но не заниженным.
+    Если какие-то чанки уже удалены сборщиком, изменения откатываются
+    и бросается MissingChunks - клиент должен загрузить их заново.
+    """
+    counts = chunk_ref_counts(file_docs)
+
+    if not counts:
+        return
+
+    result = db.chunks.bulk_write([
+        UpdateOne({"_id": chunk_hash}, {"$inc": {"refs": count}})
+        for chunk_hash, count in counts.items()
+    ], ordered=False)
+
+    if result.matched_count != len(counts):
+        existing = {
+            chunk_doc["_id"]
+            for chunk_doc in db.chunks.find({"_id": {"$in": list(counts)}}, {"_id": 1})
+        }
+        db.chunks.bulk_write([
+            UpdateOne({"_id": chunk_hash}, {"$inc": {"refs": -count}})
+            for chunk_hash, count in counts.items()
+            if chunk_hash in existing
+        ], ordered=False)
+        raise MissingChunks([chunk_hash for chunk_hash in counts if chunk_hash not in existing])
+
+
+def tombstone_documents(file_docs, deleted_at=None):
+    """
+    Надгробия удаленных файлов для коллекции deleted_files: по ним сборщик
+    потом уменьшает счетчики ссылок чанков.
+    """
+    deleted_at = deleted_at or datetime.datetime.utcnow()
+
+    return [{
+        "_id": file_doc["_id"],
+        "owner_login": file_doc["owner_login"],
+        "chunks": [{"hash": chunk_ref["hash"]} for chunk_ref in file_doc.get("chunks", [])],
+        "size": file_doc.get("size"),
+        "deleted_at": deleted_at,
+        "state": "pending"
+    } for file_doc in file_docs]
+
+
+def soft_delete_files(db, owner_login, file_guids):
+    """
+    Мягкое удаление: документы файлов заменяются надгробиями, а чанки
+    освобождает фоновый GarbageCollector. Занятое место пользователя
+    уменьшается на размер файлов, надгробия которых записал этот вызов и
+    документы которых действительно удалены (если удаление не прошло,
+    сборщик просто снимет надгробие), и для них же в ленту изменений
+    пишутся изменения "deleted". Возвращает число удаленных файлов.
+    """
+    file_docs = list(db.files.find(
+        {"owner_login": owner_login, "_id": {"$in": file_guids}},
+        {"owner_login": 1, "filename": 1, "chunks.hash": 1, "size": 1}
+    ))
+
+    if not file_docs:
+        return 0
+
+    tombstones = tombstone_documents(file_docs)
+    duplicates = set()
+
+    try:
+        db.deleted_files.insert_many(tombstones, ordered=False)
+    except BulkWriteError as e:
+        # Тот же файл параллельно удаляется другим запросом
+        duplicates = {error["index"] for error in e.details["writeErrors"]}
+
+    file_guids = [file_doc["_id"] for file_doc in file_docs]
+    deleted_count = db.files.delete_many({
+        "owner_login": owner_login,
+        "_id": {"$in": file_guids}
+    }).deleted_count
+    remaining = {
+        file_doc["_id"]
+        for file_doc in db.files.find({"_id": {"$in": file_guids}}, {"_id": 1})
+    } if deleted_count < len(file_guids) else set()
+    deleted = [
+        file_doc for index, file_doc in enumerate(file_docs)
+        if index not in duplicates and file_doc["_id"] not in remaining
+    ]
+
+    release_bytes(db, owner_login, sum(file_doc.get("size") or 0 for file_doc in deleted))
+    record_changes(db, owner_login, "deleted", deleted)
+
+    return deleted_count
+
+
+class GarbageCollector:
+    """
+    Фоновая сборка мусора хранилища:
+        1. обрабатывает надгробия удаленных файлов (старше TOMBSTONE_DELAY),
+           уменьшая счетчики ссылок их чанков
+        2. удаляет чанки без ссылок, освобожденные больше grace_period
+           секунд назад (за это время успевают завершиться загрузки,
+           которые ссылаются на уже сохраненные чанки), вместе с их
+           отметками владельцев в chunk_grants
+        3. удаляет из ленты изменения старше changes_retention секунд
+        4. считает sha256 файлов, собранных из чанков без пересчета хеша
+           (sha256_verified: False), и сверяет их с хешами от клиентов
+        5. освобождает место в квоте, учтенное за загруженные чанки, из
+           которых за grace_period так и не собрали файл, и за части
+           истекших сессий загрузки (сессии при этом удаляются)
+    Работа идет пачками по batch_size документов, а после каждой пачки
+    сборщик спит так, чтобы занимать не больше duty_cycle времени
+    и не мешать обработке запросов.
+    """
+
+    def __init__(self, db, blob_storage, grace_period=GRACE_PERIOD, batch_size=BATCH_SIZE,
+                 duty_cycle=DUTY_CYCLE, idle_interval=IDLE_INTERVAL, changes_retention=RETENTION):
+        self.db = db
+        self.blob_storage = blob_storage
+        self.grace_period = grace_period
+        self.changes_retention = changes_retention
+        self.batch_size = batch_size
+        self.duty_cycle = duty_cycle
+        self.idle_interval = idle_interval
+        self.stats = Counter()
+
+    def release_tombstones(self):
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=TOMBSTONE_DELAY)
+        released = 0
+
+        for _ in range(self.batch_size):
+            # Надгробие захватывается атомарно: при сбое посреди обработки
+            # счетчики останутся завышенными, но не будут уменьшены дважды
+            tombstone = self.db.deleted_files.find_one_and_update(
+                {"state": "pending", "deleted_at": {"$lt": cutoff}},
+                {"$set": {"state": "releasing"}}
+            )
+
+            if tombstone is None:
+                break
+
+            counts = chunk_ref_counts([tombstone])
+
+            # Файл остался, если запрос удаления упал после записи надгробия
+            if self.db.files.find_one({"_id": tombstone["_id"]}, {"_id": 1}) is not None:
+                counts = {}
+
+            if counts:
+                self.db.chunks.bulk_write([
+                    UpdateOne(
+                        {"_id": chunk_hash, "refs": {"$exists": True}},
+                        {"$inc": {"refs": -count}}
+                    )
+                    for chunk_hash, count in counts.items()
+                ], ordered=False)
+                self.db.chunks.update_many(
+                    {"_id": {"$in": list(counts)}, "refs": {"$lte": 0}},
+                    {"$set": {"released_at": datetime.datetime.utcnow()}}
+                )
+
+            self.db.deleted_files.delete_one({"_id": tombstone["_id"]})
+            released += 1
+
+        self.stats["files"] += released
+        return released
+
+    def reclaim_chunks(self):
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.grace_period)
+        condition = {"refs": {"$lte": 0}, "released_at": {"$lt": cutoff}}
+        reclaimed = 0
+
+        for chunk_doc in self.db.chunks.find(
+            condition, {"size": 1, "stored_size": 1}, limit=self.batch_size
+        ):
+            # Удаление условное: если на чанк успели сослаться,
+            # счетчик уже больше нуля, и чанк остается
+            if not self.blob_storage.reclaim_chunk(chunk_doc["_id"], condition):
+                continue
+
+            self.db.chunk_grants.delete_many({"hash": chunk_doc["_id"]})
+            self.stats["chunks"] += 1
+            self.stats["bytes"] += chunk_doc.get("stored_size", chunk_doc["size"])
+            reclaimed += 1
+
+        return reclaimed
+
+    def trim_changes(self):
+        trimmed = trim_changes(self.db, self.changes_retention, self.batch_size)
+        self.stats["changes"] += trimmed
+        return trimmed
+
+    def verify_hashes(self):
+        # По одному файлу за проход: файл может весить гигабайты
+        file_doc = self.db.files.find_one({"sha256_verified": False}, {"chunks": 1, "claimed_sha256": 1})
+
+        if file_doc is None:
+            return 0
+
+        content_hash = self.blob_storage.content_hash(file_doc["chunks"])
+
+        if file_doc.get("claimed_sha256") not in (None, content_hash):
+            logging.warning(f"GC: file {file_doc['_id']} was committed with a wrong sha256")
+            self.stats["wrong_hashes"] += 1
+
+        self.db.files.update_one(
+            {"_id": file_doc["_id"], "sha256_verified": False},
+            {"$set": {"sha256": content_hash}, "$unset": {"sha256_verified": "", "claimed_sha256": ""}}
+        )
+        self.stats["hashes"] += 1
+        return 1
+
+    def release_reservations(self):
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.grace_period)
+        released = 0
+
+        for _ in range(self.batch_size):
+            # Отметка снимается атомарно, поэтому место не освободится дважды
+            grant_doc = self.db.chunk_grants.find_one_and_update(
+                {"reserved_at": {"$lt": cutoff}},
+                {"$unset": {"reserved": "", "reserved_at": ""}}
+            )
+
+            if grant_doc is None:
+                break
+
+            release_bytes(self.db, grant_doc["owner_login"], grant_doc["reserved"])
+            released += 1
+
+        for _ in range(self.batch_size - released):
+            session_doc = self.db.upload_sessions.find_one_and_delete(
+                {"expires_at": {"$lt": datetime.datetime.utcnow()}},
+                projection={"owner_login": 1, "reserved_bytes": 1}
+            )
+
+            if session_doc is None:
+                break
+
+            release_bytes(self.db, session_doc["owner_login"], session_doc.get("reserved_bytes", 0))
+            released += 1
+
+        self.stats["reservations"] += released
+        return released
+
+    def run_once(self):
+        """Одна пачка работы, возвращает число обработанных документов"""
+        return (
+            self.release_tombstones() + self.reclaim_chunks() + self.trim_changes()
+            + self.verify_hashes() + self.release_reservations()
+        )
+
+    def run(self, stop_event=None):
+        while stop_event is None or not stop_event.is_set():
+            started = time.monotonic()
+            processed = self.run_once()
+            elapsed = time.monotonic() - started
+
+            if processed:
+                logging.info(
+                    f"GC: {self.stats['files']} files released, "
+                    f"{self.stats['chunks']} chunks and {self.stats['bytes']} bytes reclaimed"
+                )
+                delay = elapsed * (1 - self.duty_cycle) / self.duty_cycle
+            else:
+                delay = self.idle_interval
+
+            if stop_event is not None:
+                stop_event.wait(delay)
+            else:
+                time.sleep(delay)
@@ -0,0 +1,28 @@
+import mimetypes
+import unicodedata
+
+from werkzeug.http import dump_options_header
+from werkzeug.urls import url_quote
+
+
+def content_disposition(filename):
+    """
+    Значение заголовка Content-Disposition для скачивания файла,
+    как это делает flask.send_file (с filename* для не latin-1 имен)
+    """
+    try:
+        filename.encode("latin-1")
+        options = {"filename": filename}
+    except UnicodeEncodeError:
+        options = {
+            "filename": unicodedata.normalize("NFKD", filename).encode(
+                "latin-1", "ignore"
+            ).decode("latin-1"),
+            "filename*": "UTF-8''" + url_quote(filename, safe=b"")
+        }
+
+    return dump_options_header("attachment", options)
+
+
+def guess_mimetype(filename):
+    return mimetypes.guess_type(filename)[0] or "application/octet-stream"
@@ -0,0 +1,166 @@
+import datetime
+import itertools
+
+from pymongo import ASCENDING, IndexModel
+
+from .listing import ListingQuery, SORT_FIELDS, LISTING_PROJECTION, METADATA_PROJECTION, SERVE_PROJECTION
+from .changes import CHANGE_PROJECTION, CHANGES_SORT, PAGE_SIZE as CHANGES_PAGE_SIZE, changes_filter
+
+# Индексы, которые нужны запросам сервера, по коллекциям
+INDEXES = {
+    "users": [
+        IndexModel([("login", ASCENDING)], name="login_unique", unique=True),
+    ],
+    "files": [
+        IndexModel([("owner_login", ASCENDING), ("_id", ASCENDING)], name="owner_login_id"),
+        IndexModel(
+            [("owner_login", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+            name="owner_login_created_at_id"
+        ),
+        IndexModel(
+            [("owner_login", ASCENDING), ("filename", ASCENDING), ("_id", ASCENDING)],
+            name="owner_login_filename_id"
+        ),
+        # Поле есть только у файлов с непроверенным sha256
+        IndexModel([("sha256_verified", ASCENDING)], name="sha256_verified", sparse=True),
+    ],
+    "chunks": [
+        IndexModel([("refs", ASCENDING), ("released_at", ASCENDING)], name="refs_released_at"),
+    ],
+    "chunk_grants": [
+        IndexModel([("owner_login", ASCENDING), ("hash", ASCENDING)], name="owner_login_hash_unique", unique=True),
+        IndexModel([("hash", ASCENDING)], name="hash"),
+        # Поле есть только у загруженных, но еще не собранных в файл чанков
+        IndexModel([("reserved_at", ASCENDING)], name="reserved_at", sparse=True),
+    ],
+    "deleted_files": [
+        IndexModel([("state", ASCENDING), ("deleted_at", ASCENDING)], name="state_deleted_at"),
+    ],
+    "changes": [
+        IndexModel([("owner_login", ASCENDING), ("seq", ASCENDING)], name="owner_login_seq_unique", unique=True),
+        IndexModel([("recorded_at", ASCENDING)], name="recorded_at"),
+    ],
+    "upload_sessions": [
+        # Не TTL: истекшие сессии удаляет сборщик мусора, освобождая их место в квоте
+        IndexModel([("expires_at", ASCENDING)], name="expires_at"),
+    ],
+}
+
+# Индексы, которые больше не нужны и удаляются при старте
+OBSOLETE_INDEXES = {
+    "upload_sessions": ["expires_at_ttl"],
+}
+
+AUDIT_VALUE = "audit"
+AUDIT_DATE = datetime.datetime(1970, 1, 1)
+
+
+def listing_query_shapes():
+    """
+    Формы запросов списка файлов, собранные из ListingQuery для всех
+    сортировок, направлений, фильтров и с курсором следующей страницы -
+    так аудит проверяет те же фильтры, сортировку и limit, что и сервер.
+    """
+    shapes = []
+
+    for sort, order in itertools.product(SORT_FIELDS, ("asc", "desc")):
+        first_page = ListingQuery(AUDIT_VALUE, {"sort": sort, "order": order})
+        cursor = first_page.next_cursor({
+            "_id": AUDIT_VALUE, "filename": AUDIT_VALUE, "created_at": AUDIT_DATE
+        })
+
+        for args in (
+            {},
+            {"prefix": AUDIT_VALUE},
+            {"since": "0", "until": "1"},
+            {"cursor": cursor},
+            {"cursor": cursor, "prefix": AUDIT_VALUE},
+        ):
+            query = ListingQuery(AUDIT_VALUE, {"sort": sort, "order": order, **args})
+            shapes.append(("files", query.filter(), LISTING_PROJECTION, query.sort_spec(), query.limit + 1))
+
+    return shapes
+
+
+# Формы всех запросов, которые делает сервер:
+# (коллекция, фильтр, проекция, сортировка, limit).
+# Значения в фильтрах - примеры, для плана запроса важна только форма.
+QUERY_SHAPES = [
+    ("users", {"login": AUDIT_VALUE}, {"password": 1}, None, None),
+    ("files", {"_id": AUDIT_VALUE}, SERVE_PROJECTION, None, None),
+    ("files", {"_id": AUDIT_VALUE}, None, None, None),
+    ("files", {"_id": AUDIT_VALUE, "owner_login": AUDIT_VALUE}, {"_id": 1}, None, None),
+    *listing_query_shapes(),
+    ("files", {"owner_login": AUDIT_VALUE, "_id": {"$in": [AUDIT_VALUE]}}, None, None, None),
+    ("files", {"owner_login": AUDIT_VALUE, "_id": {"$in": [AUDIT_VALUE]}}, METADATA_PROJECTION, None, None),
+    ("files", {"_id": {"$in": [AUDIT_VALUE]}, "public": True}, SERVE_PROJECTION, None, None),
+    (
+        "files", {"owner_login": AUDIT_VALUE, "_id": {"$in": [AUDIT_VALUE]}},
+        {"owner_login": 1, "filename": 1, "chunks.hash": 1, "size": 1}, None, None
+    ),
+    ("files", {"_id": AUDIT_VALUE}, {"_id": 1}, None, None),
+    ("files", {"_id": {"$in": [AUDIT_VALUE]}}, {"_id": 1}, None, None),
+    ("files", {"sha256_verified": False}, {"chunks": 1, "claimed_sha256": 1}, None, 1),
+    ("chunks", {"_id": AUDIT_VALUE}, {"size": 1, "codec": 1, "stored_size": 1, "refs": 1}, None, None),
+    ("chunks", {"_id": {"$in": [AUDIT_VALUE]}}, {"size": 1, "codec": 1, "stored_size": 1}, None, None),
+    (
+        "chunks", {"refs": {"$lte": 0}, "released_at": {"$lt": AUDIT_DATE}},
+        {"size": 1, "stored_size": 1}, None, None
+    ),
+    ("chunk_grants", {"owner_login": AUDIT_VALUE, "hash": {"$in": [AUDIT_VALUE]}}, {"hash": 1}, None, None),
+    ("chunk_grants", {"hash": AUDIT_VALUE}, None, None, None),
+    ("deleted_files", {"state": "pending", "deleted_at": {"$lt": AUDIT_DATE}}, None, None, None),
+    ("changes", changes_filter(AUDIT_VALUE, 0), CHANGE_PROJECTION, CHANGES_SORT, CHANGES_PAGE_SIZE),
+    ("changes", {"recorded_at": {"$lt": AUDIT_DATE}}, {"owner_login": 1, "seq": 1}, None, CHANGES_PAGE_SIZE),
+    ("chunk_grants", {"reserved_at": {"$lt": AUDIT_DATE}}, None, None, None),
+    (
+        "upload_sessions",
+        {"_id": AUDIT_VALUE, "owner_login": AUDIT_VALUE, "expires_at": {"$gt": AUDIT_DATE}}, None, None, None
+    ),
+    ("upload_sessions", {"expires_at": {"$lt": AUDIT_DATE}}, {"owner_login": 1, "reserved_bytes": 1}, None, None),
+]
+
+
+def ensure_indexes(db):
+    for collection_name, index_names in OBSOLETE_INDEXES.items():
+        existing = db[collection_name].index_information()
+
+        for index_name in index_names:
+            if index_name in existing:
+                db[collection_name].drop_index(index_name)
+
+    for collection_name, indexes in INDEXES.items():
+        db[collection_name].create_indexes(indexes)
+
+
+def iter_plan_stages(plan):
+    yield plan["stage"]
+
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from iter_plan_stages(plan[key])
+
+    for input_plan in plan.get("inputStages", []):
+        yield from iter_plan_stages(input_plan)
+
+
+def audit_query_plans(db):
+    """
+    Выполняет explain() для каждой формы запроса из QUERY_SHAPES с ее
+    сортировкой и limit и возвращает список (стадия, форма) для форм,
+    план которых содержит COLLSCAN или сортировку в памяти (SORT).
+    """
+    problems = []
+
+    for shape in QUERY_SHAPES:
+        collection_name, query_filter, projection, sort, limit = shape
+        explanation = db[collection_name].find(
+            query_filter, projection, sort=sort, limit=limit or 0
+        ).explain()
+        stages = set(iter_plan_stages(explanation["queryPlanner"]["winningPlan"]))
+
+        for stage in ("COLLSCAN", "SORT"):
+            if stage in stages:
+                problems.append((stage, shape))
+
+    return problems
@@ -0,0 +1,131 @@
+import time
+import uuid
+import threading
+
+from .cache import TTLCache
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class LocalCounterStore:
+    """
+    Хранилище счетчиков в памяти процесса с тем же интерфейсом update,
+    что и у SharedStore. Давно не менявшиеся записи вытесняются,
+    что для лимитов означает просто сброс счетчика.
+    """
+
+    def __init__(self, max_size=100000):
+        self.items = TTLCache(max_size, 24 * 3600)
+        self._lock = threading.Lock()
+
+    def update(self, key, fn, ttl):
+        with self._lock:
+            value, result = fn(self.items.get(key))
+            self.items.set(key, value)
+
+        return result
+
+
+class RateLimiter:
+    """
+    Token bucket на пользователя и обработчик. rules - словарь
+    {endpoint: (запросов в секунду, емкость)}, правило "*" действует
+    для обработчиков без своего правила.
+    acquire возвращает 0, если запрос можно выполнить, иначе
+    через сколько секунд появится токен (для Retry-After).
+    """
+
+    def __init__(self, rules, store):
+        self.rules = rules
+        self.store = store
+
+    def acquire(self, login, endpoint, cost=1):
+        rule = self.rules.get(endpoint) or self.rules.get("*")
+
+        if rule is None:
+            return 0
+
+        rate, burst = rule
+
+        def take(state):
+            now = time.time()
+            tokens, updated_at = state or (burst, now)
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+
+            if tokens >= cost:
+                return [tokens - cost, now], 0
+
+            return [tokens, now], (cost - tokens) / rate
+
+        return self.store.update(f"rate:{login}:{endpoint}", take, max(burst / rate, 1))
+
+
+class TransferSlots:
+    """
+    Ограничение числа одновременных передач пользователя.
+    Занятый слот живет не дольше slot_ttl секунд, поэтому слоты упавшего
+    воркера со временем освобождаются сами.
+    """
+
+    def __init__(self, max_per_user, store, slot_ttl=3600):
+        self.max_per_user = max_per_user
+        self.store = store
+        self.slot_ttl = slot_ttl
+
+    def acquire(self, login):
+        """Возвращает id слота или None, если все слоты заняты"""
+        slot_id = uuid.uuid4().hex
+
+        def take(slots):
+            now = time.time()
+            slots = {key: expires_at for key, expires_at in (slots or {}).items() if expires_at > now}
+
+            if len(slots) >= self.max_per_user:
+                return slots, None
+
+            slots[slot_id] = now + self.slot_ttl
+            return slots, slot_id
+
+        return self.store.update("transfers:" + login, take, self.slot_ttl)
+
+    def release(self, login, slot_id):
+        def free(slots):
+            slots = dict(slots or {})
+            slots.pop(slot_id, None)
+            return slots, None
+
+        self.store.update("transfers:" + login, free, self.slot_ttl)
+
+
+def reserve_bytes(db, owner_login, size, quota=None):
+    """
+    Учитывает size байт новых файлов в users.used_bytes одним $inc.
+    Если задана quota, увеличение условное, и при нехватке места
+    бросается QuotaExceeded.
+    """
+    if not size:
+        return
+
+    query = {"login": owner_login}
+
+    if quota is not None:
+        query["used_bytes"] = {"$lte": quota - size}
+
+    if not db.users.update_one(query, {"$inc": {"used_bytes": size}}).modified_count and quota is not None:
+        raise QuotaExceeded(owner_login)
+
+
+def release_bytes(db, owner_login, size):
+    if size:
+        db.users.update_one({"login": owner_login}, {"$inc": {"used_bytes": -size}})
+
+
+def has_quota(db, owner_login, size, quota):
+    # Ранняя проверка по Content-Length, до чтения тела запроса
+    if quota is None or not size:
+        return True
+
+    user_doc = db.users.find_one({"login": owner_login}, {"used_bytes": 1})
+    return user_doc is None or user_doc.get("used_bytes", 0) + size <= quota
@@ -0,0 +1,62 @@
+import hmac
+import time
+import uuid
+import base64
+import struct
+import hashlib
+
+SIGNATURE_SIZE = 12
+DEFAULT_TTL = 24 * 60 * 60
+MAX_TTL = 30 * 24 * 60 * 60
+
+
+class LinkSigner:
+    """
+    Короткие подписанные ссылки на файлы с ограниченным временем жизни.
+    Токен - base64url от 16 байт GUID файла, 4 байт времени истечения и
+    усеченной HMAC-SHA256 подписи (43 символа), поэтому ссылка
+    проверяется без обращения к базе и без хранения на сервере.
+    """
+
+    salt = b"lolder-file-link"
+
+    def __init__(self, secret_key):
+        if isinstance(secret_key, str):
+            secret_key = secret_key.encode()
+
+        self.key = hmac.new(secret_key, self.salt, hashlib.sha256).digest()
+
+    def signature(self, payload):
+        return hmac.new(self.key, payload, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+
+    def sign(self, file_guid, ttl=DEFAULT_TTL):
+        """
+        Возвращает (токен, время истечения). GUID должен быть UUID,
+        иначе бросается ValueError.
+        """
+        expires_at = int(time.time() + ttl)
+        payload = uuid.UUID(file_guid).bytes + struct.pack(">I", expires_at)
+        token = base64.urlsafe_b64encode(payload + self.signature(payload)).rstrip(b"=").decode()
+        return token, expires_at
+
+    def verify(self, token):
+        """Возвращает (GUID файла, время истечения) или None"""
+        try:
+            data = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        except (ValueError, TypeError):
+            return None
+
+        if len(data) != 20 + SIGNATURE_SIZE:
+            return None
+
+        payload, signature = data[:20], data[20:]
+
+        if not hmac.compare_digest(signature, self.signature(payload)):
+            return None
+
+        expires_at, = struct.unpack(">I", payload[16:])
+
+        if expires_at <= time.time():
+            return None
+
+        return str(uuid.UUID(bytes=payload[:16])), expires_at
@@ -0,0 +1,147 @@
+import re
+import json
+import base64
+import datetime
+
+from pymongo import ASCENDING, DESCENDING
+
+PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+SORT_FIELDS = {
+    "date": "created_at",
+    "name": "filename"
+}
+LISTING_PROJECTION = {"_id": 1, "filename": 1, "size": 1, "created_at": 1}
+METADATA_PROJECTION = {"chunks": 0, "file_bytes": 0}
+# Поля, нужные для отдачи содержимого файла
+SERVE_PROJECTION = {
+    "owner_login": 1, "filename": 1, "chunks": 1, "size": 1,
+    "sha256": 1, "sha256_verified": 1, "mimetype": 1, "public": 1
+}
+
+
+def encode_cursor(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def datetime_to_ms(value):
+    return int(value.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+
+def ms_to_datetime(value):
+    return datetime.datetime.utcfromtimestamp(int(value) / 1000)
+
+
+def parse_datetime(value):
+    # Unix timestamp в секундах или дата в ISO формате (UTC)
+    try:
+        return datetime.datetime.utcfromtimestamp(float(value))
+    except ValueError:
+        return datetime.datetime.fromisoformat(value)
+
+
+class ListingQuery:
+    """
+    Запрос страницы списка файлов пользователя с keyset пагинацией.
+    Параметры запроса:
+        limit - размер страницы
+        cursor - непрозрачный токен следующей страницы из next_cursor
+        sort - date (по умолчанию) или name
+        order - asc (по умолчанию) или desc
+        prefix - префикс имени файла
+        since, until - границы даты загрузки
+    Курсор хранит значение поля сортировки и _id последнего файла страницы,
+    поэтому следующая страница выбирается по индексу без skip.
+    """
+
+    def __init__(self, owner_login, args, default_page_size=PAGE_SIZE, max_page_size=MAX_PAGE_SIZE):
+        self.owner_login = owner_login
+        self.limit = min(int(args.get("limit", default_page_size)), max_page_size)
+
+        if self.limit <= 0:
+            raise ValueError("Invalid limit")
+
+        cursor = args.get("cursor")
+        self.cursor = decode_cursor(cursor) if cursor else None
+
+        if self.cursor is not None:
+            self.sort, self.order = self.cursor["sort"], self.cursor["order"]
+        else:
+            self.sort, self.order = args.get("sort", "date"), args.get("order", "asc")
+
+        if self.sort not in SORT_FIELDS or self.order not in ("asc", "desc"):
+            raise ValueError("Invalid sort")
+
+        self.field = SORT_FIELDS[self.sort]
+        self.direction = ASCENDING if self.order == "asc" else DESCENDING
+        self.prefix = args.get("prefix")
+        self.since = parse_datetime(args["since"]) if args.get("since") else None
+        self.until = parse_datetime(args["until"]) if args.get("until") else None
+
+    def _cursor_value(self, value):
+        return ms_to_datetime(value) if self.field == "created_at" else value
+
+    def filter(self):
+        conditions = [{"owner_login": self.owner_login}]
+
+        if self.prefix:
+            conditions.append({"filename": {"$regex": "^" + re.escape(self.prefix)}})
+
+        if self.since is not None:
+            conditions.append({"created_at": {"$gte": self.since}})
+
+        if self.until is not None:
+            conditions.append({"created_at": {"$lt": self.until}})
+
+        if self.cursor is not None:
+            op = "$gt" if self.direction == ASCENDING else "$lt"
+            value = self._cursor_value(self.cursor["value"])
+            conditions.append({"$or": [
+                {self.field: {op: value}},
+                {self.field: value, "_id": {op: self.cursor["id"]}}
+            ]})
+
+        return {"$and": conditions} if len(conditions) > 1 else conditions[0]
+
+    def sort_spec(self):
+        return [(self.field, self.direction), ("_id", self.direction)]
+
+    def next_cursor(self, last_doc):
+        value = last_doc[self.field]
+
+        if self.field == "created_at":
+            value = datetime_to_ms(value)
+
+        return encode_cursor({
+            "sort": self.sort,
+            "order": self.order,
+            "value": value,
+            "id": last_doc["_id"]
+        })
+
+
+def file_doc_to_json(doc):
+    created_at = doc.get("created_at")
+
+    return {
+        "filename": doc["filename"],
+        "file_guid": doc["_id"],
+        "size": doc.get("size"),
+        "created_at": datetime_to_ms(created_at) if created_at else None
+    }
+
+
+def file_doc_to_metadata(doc):
+    return {
+        **file_doc_to_json(doc),
+        "sha256": doc.get("sha256"),
+        "mimetype": doc.get("mimetype"),
+        "public": doc.get("public")
+    }
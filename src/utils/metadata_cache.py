@@ -0,0 +1,141 @@
+import uuid
+import hashlib
+
+from .cache import TTLCache
+from .files import content_key
+
+VERSION_TTL = 24 * 3600
+
+
+def approximate_size(value):
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+
+    return len(repr(value))
+
+
+class MetadataCache:
+    """
+    Кеш списков файлов пользователей, метаданных файлов и тел небольших файлов.
+    ETag страницы списка строится из номера последнего изменения файлов
+    владельца в базе (users.change_seq), поэтому загрузка или удаление
+    через любой воркер сразу меняет ETag во всех, и закешированная
+    страница старой версии просто перестает находиться.
+    Метаданные файлов привязаны к версии файлов владельца, которая меняется
+    при любой загрузке или удалении (bump). Версии лежат в shared_store,
+    если он передан, иначе у каждого воркера свои и живут ttl секунд,
+    так что чужие изменения воркер видит не позже чем через ttl секунд.
+    Тела файлов кешируются по ключу содержимого (content_key) и не устаревают.
+    Тела до body_max_file_size кешируются сразу, а до hot_body_max_file_size -
+    только "горячие", запрошенные hot_body_min_hits раз за ttl секунд.
+    """
+
+    def __init__(self, max_size=10000, ttl=60, max_bytes=64 * 1024 * 1024,
+                 body_max_bytes=64 * 1024 * 1024, body_max_file_size=256 * 1024,
+                 shared_store=None, hot_body_max_file_size=8 * 1024 * 1024, hot_body_min_hits=3):
+        self.entries = TTLCache(max_size, ttl, max_bytes, approximate_size)
+        self.bodies = TTLCache(max_size, ttl, body_max_bytes)
+        self.body_requests = TTLCache(max_size, ttl)
+        self.body_max_file_size = body_max_file_size
+        self.hot_body_max_file_size = max(hot_body_max_file_size, body_max_file_size)
+        self.hot_body_min_hits = hot_body_min_hits
+        self.shared_store = shared_store
+        # Версия дольше ttl сделала бы метаданные дольше ttl устаревшими
+        self.versions = TTLCache(max_size, ttl)
+
+    def _version_key(self, owner_login):
+        return "files_version:" + owner_login
+
+    def version(self, owner_login):
+        key = self._version_key(owner_login)
+
+        if self.shared_store is not None:
+            version = self.shared_store.get(key)
+        else:
+            version = self.versions.get(key)
+
+        if version is None:
+            version = self.bump(owner_login)
+
+        return version
+
+    def bump(self, owner_login):
+        key = self._version_key(owner_login)
+        version = uuid.uuid4().hex
+
+        if self.shared_store is not None:
+            self.shared_store.set(key, version, VERSION_TTL)
+        else:
+            self.versions.set(key, version)
+
+        return version
+
+    def listing_etag(self, owner_login, args, change_seq):
+        query = "&".join(f"{key}={value}" for key, value in sorted(args.items(multi=True)))
+        return hashlib.sha1(f"{owner_login}:{change_seq}?{query}".encode()).hexdigest()
+
+    def get_listing(self, etag):
+        return self.entries.get("listing:" + etag)
+
+    def set_listing(self, etag, body):
+        self.entries.set("listing:" + etag, body)
+
+    def get_file(self, file_guid):
+        item = self.entries.get("file:" + file_guid)
+
+        if item is None:
+            return None
+
+        version, file_doc = item
+
+        if version != self.version(file_doc["owner_login"]):
+            self.entries.pop("file:" + file_guid)
+            return None
+
+        return file_doc
+
+    def set_file(self, file_doc):
+        # Старые документы с file_bytes держат файл целиком, их не кешируем
+        if "file_bytes" in file_doc:
+            return
+
+        self.entries.set(
+            "file:" + file_doc["_id"],
+            (self.version(file_doc["owner_login"]), file_doc)
+        )
+
+    def get_body(self, file_doc):
+        size = file_doc.get("size")
+
+        if size is None or size > self.hot_body_max_file_size:
+            return None
+
+        key = content_key(file_doc)
+        body = self.bodies.get(key)
+
+        # Промахи по крупным телам считаются, чтобы узнать горячие
+        if body is None and size > self.body_max_file_size:
+            self.body_requests.set(key, self.body_requests.get(key, 0) + 1)
+
+        return body
+
+    def should_cache_body(self, file_doc):
+        size = file_doc.get("size")
+
+        if size is None or size > self.hot_body_max_file_size:
+            return False
+
+        if size <= self.body_max_file_size:
+            return True
+
+        return self.body_requests.get(content_key(file_doc), 0) >= self.hot_body_min_hits
+
+    def set_body(self, file_doc, body):
+        if len(body) <= self.hot_body_max_file_size:
+            self.bodies.set(content_key(file_doc), body)
+
+    def stats(self):
+        return {
+            "metadata": self.entries.stats(),
+            "bodies": self.bodies.stats()
+        }
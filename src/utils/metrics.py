@@ -0,0 +1,248 @@
+import os
+import time
+import pstats
+import random
+import bisect
+import cProfile
+import threading
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+
+    pairs = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+class Metric:
+    """
+    Метрика с метками. Значения хранятся по кортежу пар (метка, значение),
+    рендер - в текстовом формате Prometheus.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(sorted(labels.items()))
+
+    def header(self):
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}"
+        ]
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+
+        return self.header() + [
+            f"{self.name}{format_labels(labels)} {value}"
+            for labels, value in values
+        ]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self):
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+
+        lines = self.header()
+
+        for labels, counts, total in values:
+            cumulative = 0
+
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+
+            lines.append(f"{self.name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {cumulative}")
+
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Набор метрик процесса. collectors - функции, которые обновляют
+    метрики-снимки (размеры кешей и т.п.) непосредственно перед рендером.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation):
+        return self.register(Counter(name, documentation))
+
+    def gauge(self, name, documentation):
+        return self.register(Gauge(name, documentation))
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, buckets))
+
+    def render(self):
+        for collect in self.collectors:
+            collect()
+
+        lines = []
+
+        for metric in self.metrics:
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+
+class RequestStats(threading.local):
+    # Счетчики запросов в MongoDB текущего HTTP запроса (в потоке обработки)
+    active = False
+    queries = 0
+    duration = 0.0
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    Слушатель команд pymongo: длительность команд по типу и
+    число и суммарное время запросов в рамках текущего HTTP запроса.
+    """
+
+    def __init__(self, registry):
+        self.request_stats = RequestStats()
+        self.commands = registry.histogram(
+            "mongodb_command_duration_seconds", "MongoDB command duration"
+        )
+        self.failures = registry.counter(
+            "mongodb_command_failures_total", "Failed MongoDB commands"
+        )
+
+    def reset(self):
+        self.request_stats.active = True
+        self.request_stats.queries = 0
+        self.request_stats.duration = 0.0
+
+    def finish(self):
+        self.request_stats.active = False
+        return self.request_stats.queries, self.request_stats.duration
+
+    def _record(self, event):
+        duration = event.duration_micros / 1e6
+        self.commands.observe(duration, command=event.command_name)
+
+        if self.request_stats.active:
+            self.request_stats.queries += 1
+            self.request_stats.duration += duration
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+        self.failures.inc(command=event.command_name)
+
+
+class SlowRequestProfiler:
+    """
+    Профилирование медленных запросов: каждый запрос с вероятностью
+    sample_rate выполняется под cProfile, и если он длился дольше
+    threshold секунд, профиль сохраняется в directory. Одновременно
+    профилируется только один запрос.
+    """
+
+    def __init__(self, threshold, directory, sample_rate=1.0):
+        self.threshold = threshold
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        if random.random() >= self.sample_rate or not self._lock.acquire(blocking=False):
+            return None
+
+        profile = cProfile.Profile()
+
+        try:
+            profile.enable()
+        except ValueError:
+            self._lock.release()
+            return None
+
+        return profile
+
+    def stop(self, profile, duration, name):
+        try:
+            profile.disable()
+        finally:
+            self._lock.release()
+
+        if duration < self.threshold:
+            return None
+
+        path = os.path.join(
+            self.directory,
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{name.replace('/', '_')}-{int(duration * 1000)}ms.prof"
+        )
+        pstats.Stats(profile).dump_stats(path)
+        return path
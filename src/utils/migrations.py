@@ -0,0 +1,128 @@
+import uuid
+import datetime
+
+from collections import Counter
+
+from pymongo import UpdateOne
+
+UUID_EPOCH = datetime.datetime(1582, 10, 15)
+
+
+def uuid1_datetime(value):
+    return UUID_EPOCH + datetime.timedelta(microseconds=uuid.UUID(value).time // 10)
+
+
+def mark_applied(db, name):
+    # upsert, а не insert: воркеры, стартовавшие одновременно, могут
+    # закончить одну и ту же миграцию
+    db.migrations.update_one(
+        {"_id": name},
+        {"$setOnInsert": {"applied_at": datetime.datetime.utcnow()}},
+        upsert=True
+    )
+
+
+def backfill_created_at(db):
+    """
+    Проставляет created_at файлам, сохраненным до его появления.
+    Время берется из GUID файла (uuid1 содержит время создания).
+    Выполняется один раз (отметка в коллекции migrations): новые файлы
+    сохраняются уже с created_at, и полный проход по files при каждом
+    старте не нужен.
+    """
+    if db.migrations.find_one({"_id": "created_at"}) is not None:
+        return
+
+    for file_doc in db.files.find({"created_at": {"$exists": False}}, {"_id": 1}):
+        try:
+            created_at = uuid1_datetime(file_doc["_id"])
+        except ValueError:
+            created_at = UUID_EPOCH
+
+        db.files.update_one({"_id": file_doc["_id"]}, {"$set": {"created_at": created_at}})
+
+    mark_applied(db, "created_at")
+
+
+def backfill_used_bytes(db):
+    """
+    Считает занятое место пользователей, созданных до появления квот.
+    Дальше used_bytes меняется только через $inc при загрузке и удалении.
+    Выполняется один раз (отметка в коллекции migrations) до того, как
+    сервер начнет принимать запросы: пересчет во время загрузок затер бы
+    их $inc. Новые пользователи создаются сразу с used_bytes.
+    """
+    if db.migrations.find_one({"_id": "used_bytes"}) is not None:
+        return
+
+    for user_doc in db.users.find({"used_bytes": {"$exists": False}}, {"login": 1}):
+        used_bytes = sum(
+            file_doc.get("size") or 0
+            for file_doc in db.files.find({"owner_login": user_doc["login"]}, {"size": 1})
+        )
+        db.users.update_one(
+            {"_id": user_doc["_id"], "used_bytes": {"$exists": False}},
+            {"$set": {"used_bytes": used_bytes}}
+        )
+
+    mark_applied(db, "used_bytes")
+
+
+def backfill_chunk_refs(db):
+    """
+    Считает ссылки на чанки, сохраненные до появления счетчиков.
+    Выполняется один раз (отметка в коллекции migrations) и должен
+    отработать до того, как сервер начнет принимать запросы.
+    """
+    if db.migrations.find_one({"_id": "chunk_refs"}) is not None:
+        return
+
+    counts = Counter()
+
+    for file_doc in db.files.find({"chunks": {"$exists": True}}, {"chunks.hash": 1}):
+        counts.update(chunk_ref["hash"] for chunk_ref in file_doc["chunks"])
+
+    now = datetime.datetime.utcnow()
+
+    for chunk_doc in db.chunks.find({"refs": {"$exists": False}}, {"_id": 1}):
+        refs = counts.get(chunk_doc["_id"], 0)
+        # Счетчик, который уже завел другой воркер, мог получить $inc от
+        # новых загрузок, и перезапись его бы занизила
+        db.chunks.update_one(
+            {"_id": chunk_doc["_id"], "refs": {"$exists": False}},
+            {"$set": {"refs": refs, "released_at": now}}
+        )
+
+    mark_applied(db, "chunk_refs")
+
+
+def backfill_chunk_grants(db):
+    """
+    Отмечает чанки существующих файлов как принадлежащие их владельцам,
+    чтобы дедупликация по хешам работала для файлов, загруженных до
+    появления chunk_grants. Выполняется один раз.
+    """
+    if db.migrations.find_one({"_id": "chunk_grants"}) is not None:
+        return
+
+    now = datetime.datetime.utcnow()
+    requests = []
+
+    for file_doc in db.files.find({"chunks": {"$exists": True}}, {"owner_login": 1, "chunks.hash": 1}):
+        requests.extend(
+            UpdateOne(
+                {"owner_login": file_doc["owner_login"], "hash": chunk_hash},
+                {"$setOnInsert": {"granted_at": now}},
+                upsert=True
+            )
+            for chunk_hash in {chunk_ref["hash"] for chunk_ref in file_doc["chunks"]}
+        )
+
+        if len(requests) >= 1000:
+            db.chunk_grants.bulk_write(requests, ordered=False)
+            requests = []
+
+    if requests:
+        db.chunk_grants.bulk_write(requests, ordered=False)
+
+    mark_applied(db, "chunk_grants")
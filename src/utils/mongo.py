@@ -0,0 +1,19 @@
+# Ключ конфига -> параметр MongoClient. Незаданные ключи не передаются,
+# и для них остаются значения драйвера по умолчанию.
+MONGO_CLIENT_OPTIONS = {
+    "MONGODB_MAX_POOL_SIZE": "maxPoolSize",
+    "MONGODB_MIN_POOL_SIZE": "minPoolSize",
+    "MONGODB_MAX_IDLE_TIME_MS": "maxIdleTimeMS",
+    "MONGODB_CONNECT_TIMEOUT_MS": "connectTimeoutMS",
+    "MONGODB_SOCKET_TIMEOUT_MS": "socketTimeoutMS",
+    "MONGODB_SERVER_SELECTION_TIMEOUT_MS": "serverSelectionTimeoutMS",
+    "MONGODB_WAIT_QUEUE_TIMEOUT_MS": "waitQueueTimeoutMS",
+}
+
+
+def mongo_client_options(config):
+    return {
+        option: config[key]
+        for key, option in MONGO_CLIENT_OPTIONS.items()
+        if config.get(key) is not None
+    }
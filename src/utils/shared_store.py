@@ -0,0 +1,81 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+
+class SharedStore:
+    """
+    Key-value хранилище с временем жизни записей поверх локального файла SQLite.
+    Нужно, чтобы несколько воркеров сервера на одной машине могли делить
+    между собой кеши и счетчики. Соединение создается отдельно для
+    каждого потока и процесса, поэтому объект безопасно переживает fork.
+    """
+
+    def __init__(self, path, timeout=5):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        pid = os.getpid()
+
+        if getattr(self._local, "pid", None) != pid:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS kv "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._local.connection = connection
+            self._local.pid = pid
+
+        return self._local.connection
+
+    def get(self, key, default=None):
+        row = self.connection.execute(
+            "SELECT value FROM kv WHERE key = ? AND expires_at > ?",
+            (key, time.time())
+        ).fetchone()
+
+        return default if row is None else json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ttl)
+        )
+
+    def update(self, key, fn, ttl):
+        """
+        Атомарно (между процессами) читает значение, вызывает fn(value)
+        -> (новое значение, результат), сохраняет новое значение и
+        возвращает результат. Если записи нет, fn получает None.
+        """
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+
+        try:
+            row = connection.execute(
+                "SELECT value FROM kv WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+            value, result = fn(None if row is None else json.loads(row[0]))
+            connection.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + ttl)
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+        return result
+
+    def delete(self, key):
+        self.connection.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def purge_expired(self):
+        self.connection.execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),))
@@ -6,11 +6,28 @@ from src.utils.paths import get_dir
 
 logging.basicConfig(
     filename=str(get_dir(__file__) / "logs.log"),
-    level=logging.ERROR
+    level=os.environ.get("app_log_level", "ERROR").upper()
 )
 
-app = App(__name__)
-app.run(
-    os.environ.get("app_host", "127.0.0.1"),
-    int(os.environ.get("app_port", 8000))
-)
+host = os.environ.get("app_host", "127.0.0.1")
+port = int(os.environ.get("app_port", 8000))
+
+engine = os.environ.get("app_engine", "flask")
+# Общий ключ подписи токенов и ссылок для всех воркеров и перезапусков
+config = {}
+
+if os.environ.get("app_secret_key"):
+    config["SECRET_KEY"] = os.environ["app_secret_key"].encode()
+
+if engine == "asgi":
+    import uvicorn
+    from src.async_server import AsyncApp
+
+    uvicorn.run(AsyncApp(config), host=host, port=port, log_level="error")
+elif engine == "prefork":
+    from src.prefork import run_from_env
+
+    run_from_env(lambda: App(__name__, config=config), host, port)
+else:
+    app = App(__name__, config=config)
+    app.run(host, port)
@@ -0,0 +1,61 @@
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from src import server
+
+
+@pytest.fixture
+def app_config():
+    return {
+        "MONGODB_NAME": "tests",
+        "PASSWORD_HASH_ITERATIONS": 1000,
+        "SECRET_KEY": b"tests",
+    }
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(server, "MongoClient", lambda *args, **kwargs: client)
+    return client
+
+
+@pytest.fixture
+def app(mongo, app_config):
+    return server.App(__name__, config=app_config)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers(client):
+    credentials = {"login": "tester", "password": "secret"}
+    assert client.post("/register/", json={"credentials": credentials}).status_code == 200
+    return {"authorization": "tester secret"}
+
+
+@pytest.fixture
+def live_server(app):
+    import threading
+
+    from werkzeug.serving import make_server
+
+    server_ = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server_.serve_forever, daemon=True)
+    thread.start()
+    yield f"127.0.0.1:{server_.server_port}"
+    server_.shutdown()
+
+
+@pytest.fixture
+def api_client(live_server, auth_headers, monkeypatch):
+    monkeypatch.setenv("server_address", live_server)
+    from src.api_client import ApiClient
+
+    api_client = ApiClient("tester", "secret", retries=0)
+    yield api_client
+    api_client.close()
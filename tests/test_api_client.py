@@ -0,0 +1,102 @@
+import hashlib
+
+import pytest
+
+pytest.importorskip("requests")
+
+
+class Cancelled(Exception):
+    pass
+
+
+@pytest.fixture
+def app_config(app_config):
+    return {**app_config, "BLOB_CHUNK_SIZE": 1024, "UPLOAD_MAX_PART_SIZE": 1024}
+
+
+def test_cancelled_multipart_upload_stops_and_aborts(app, api_client, tmp_path):
+    file_path = tmp_path / "big.bin"
+    file_path.write_bytes(b"x" * 1024 * 20)
+    sent = []
+    checks = []
+    upload_part = api_client.upload_part
+
+    def counting_upload_part(session_id, index, data):
+        sent.append(index)
+        upload_part(session_id, index, data)
+
+    def check_cancelled():
+        checks.append(None)
+
+        if len(checks) > 3:
+            raise Cancelled()
+
+    api_client.upload_part = counting_upload_part
+
+    with pytest.raises(Cancelled):
+        api_client.upload_multipart(file_path, workers=2, check_cancelled=check_cancelled)
+
+    assert len(sent) <= 4
+    assert app.db.upload_sessions.count_documents({}) == 0
+
+
+def test_multipart_upload_sends_every_part(app, api_client, tmp_path):
+    file_path = tmp_path / "big.bin"
+    file_path.write_bytes(bytes(range(256)) * 20)
+
+    file_guid = api_client.upload_multipart(file_path, workers=2)
+
+    file_doc = app.db.files.find_one({"_id": file_guid})
+    assert file_doc["size"] == 256 * 20
+    assert file_doc["sha256_verified"] is False
+    assert api_client.file_sha256(file_path) == file_doc["claimed_sha256"]
+
+
+def test_download_of_unhashed_file_skips_checksum(app, client, auth_headers, api_client, tmp_path):
+    chunk_hash = hashlib.sha256(b"committed").hexdigest()
+    client.put(f"/file_storage/chunks/?hash={chunk_hash}", data=b"committed", headers=auth_headers)
+    file_guid = client.post(
+        "/file_storage/commit/", json={"filename": "c", "chunks": [chunk_hash]}, headers=auth_headers
+    ).json["file_guid"]
+    file_path = tmp_path / "c"
+
+    api_client.download_file(file_guid, file_path)
+
+    assert file_path.read_bytes() == b"committed"
+
+
+def test_download_file_probes_with_head(app, client, auth_headers, api_client, tmp_path):
+    content = bytes(range(256)) * 40
+    file_guid = client.post(
+        "/file_storage/?filename=data.bin", data=content, headers=auth_headers
+    ).json["file_guid"]
+    file_path = tmp_path / "data.bin"
+
+    api_client.download_file(file_guid, file_path)
+
+    assert file_path.read_bytes() == content
+
+
+def test_multipart_upload_resends_parts_with_reclaimed_chunks(app, api_client, tmp_path):
+    file_path = tmp_path / "big.bin"
+    content = bytes(i % 251 for i in range(1024 * 4))
+    file_path.write_bytes(content)
+    sent = []
+    upload_part = api_client.upload_part
+
+    def upload_part_then_reclaim(session_id, index, data):
+        upload_part(session_id, index, data)
+
+        # Сборщик мусора удаляет чанк первой части до сборки файла
+        if not sent:
+            app.db.chunks.delete_one({"_id": hashlib.sha256(data).hexdigest()})
+
+        sent.append(index)
+
+    api_client.upload_part = upload_part_then_reclaim
+    file_guid = api_client.upload_multipart(file_path, workers=1)
+
+    assert sent == [0, 1, 2, 3, 0]
+    file_doc = app.db.files.find_one({"_id": file_guid})
+    assert b"".join(app.blob_storage.iter_chunks(file_doc["chunks"])) == content
+    assert app.db.users.find_one({"login": "tester"})["used_bytes"] == len(content)
@@ -0,0 +1,250 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import random
+
+import pytest
+
+pytest.importorskip("motor")
+
+from src import async_server
+
+IGNORED_METHODS = {"HEAD", "OPTIONS"}
+
+
+@pytest.fixture
+def async_app(mongo, monkeypatch, app_config):
+    monkeypatch.setattr(async_server, "MongoClient", lambda *args, **kwargs: mongo)
+    return async_server.AsyncApp(app_config)
+
+
+class AsyncCursor:
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    async def to_list(self, length):
+        return list(self.cursor)
+
+    async def __aiter__(self):
+        for doc in self.cursor:
+            yield doc
+
+
+class AsyncCollection:
+    """Обертка коллекции mongomock с интерфейсом Motor для нативных маршрутов"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self.collection.find(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call_method(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call_method
+
+
+class AsyncDatabase:
+
+    def __init__(self, db):
+        self.db = db
+
+    def __getattr__(self, name):
+        return AsyncCollection(self.db[name])
+
+
+@pytest.fixture
+def native_app(async_app, mongo, app_config):
+    async_app._db = AsyncDatabase(mongo[app_config["MONGODB_NAME"]])
+    credentials = {"login": "tester", "password": "secret"}
+    async_app.wsgi_app.test_client().post("/register/", json={"credentials": credentials})
+    return async_app
+
+
+def call(async_app, method, path, body=b"", headers=(), query_string=b""):
+    # Тело списком кусков приходит несколькими сообщениями http.request
+    pieces = body if isinstance(body, list) else [body]
+    messages = [
+        {"type": "http.request", "body": piece, "more_body": i < len(pieces) - 1}
+        for i, piece in enumerate(pieces)
+    ]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query_string,
+        "headers": [(key.encode(), value.encode()) for key, value in headers],
+    }
+    asyncio.run(async_app(scope, receive, send))
+    return sent[0]["status"], b"".join(message.get("body", b"") for message in sent[1:])
+
+
+def call_with_headers(async_app, *args, **kwargs):
+    sent = []
+    original_call = async_app.__call__
+
+    async def app(scope, receive, send):
+        async def record(message):
+            sent.append(message)
+            await send(message)
+
+        await original_call(scope, receive, record)
+
+    status, body = call(app, *args, **kwargs)
+    return status, {key.decode(): value.decode() for key, value in sent[0]["headers"]}, body
+
+
+def upload(async_app, content, filename="file.txt"):
+    status, body = call(
+        async_app, "POST", "/file_storage/", content,
+        [("authorization", "tester secret")], f"filename={filename}".encode()
+    )
+    assert status == 200, body
+    return json.loads(body)["file_guid"]
+
+
+def test_native_routes_match_flask_methods(async_app):
+    flask_rules = {rule.rule: rule for rule in async_app.wsgi_app.url_map.iter_rules()}
+
+    for path, (_, methods) in async_app.routes.items():
+        assert path in flask_rules, path
+        assert set(methods) == flask_rules[path].methods - IGNORED_METHODS, path
+
+
+def test_every_flask_route_is_served(async_app):
+    for rule in async_app.wsgi_app.url_map.iter_rules():
+        if rule.endpoint == "static":
+            continue
+
+        path = rule.rule.replace("<int:index>", "0").replace("<session_id>", "x").replace("<token>", "x")
+        method = sorted(rule.methods - IGNORED_METHODS)[0]
+        status, _ = call(async_app, method, path)
+        assert status not in (404, 405) or rule.arguments, (method, path, status)
+
+
+def test_bridged_route_reads_request_body(async_app):
+    # /register/ у AsyncApp нативный (Motor), поэтому пользователь создается через App
+    credentials = {"login": "tester", "password": "secret"}
+    async_app.wsgi_app.test_client().post("/register/", json={"credentials": credentials})
+    status, body = call(
+        async_app, "POST", "/file_storage/negotiate/", b'{"chunks": []}',
+        [("content-type", "application/json"), ("authorization", "tester secret")]
+    )
+
+    assert status == 200, body
+
+
+def test_bridged_route_streams_request_body(async_app):
+    credentials = {"login": "tester", "password": "secret"}
+    async_app.wsgi_app.test_client().post("/register/", json={"credentials": credentials})
+    pieces = [b"a" * 70000, b"b" * 1000, b"c"]
+    chunk_hash = hashlib.sha256(b"".join(pieces)).hexdigest()
+
+    status, body = call(
+        async_app, "PUT", "/file_storage/chunks/", pieces,
+        [("authorization", "tester secret")], f"hash={chunk_hash}".encode()
+    )
+
+    assert status == 200, body
+    assert async_app.blob_storage.missing_chunks([chunk_hash], "tester") == []
+
+
+def test_native_listing_has_etag_and_answers_304(native_app):
+    upload(native_app, b"content")
+    auth = [("authorization", "tester secret")]
+
+    status, headers, body = call_with_headers(native_app, "GET", "/file_storage/all/", headers=auth)
+    assert status == 200 and len(json.loads(body)["files"]) == 1
+    etag = headers["etag"]
+
+    status, _, body = call_with_headers(
+        native_app, "GET", "/file_storage/all/", headers=auth + [("if-none-match", etag)]
+    )
+    assert status == 304 and body == b""
+
+    # Загрузка меняет номер изменения владельца, а с ним и ETag
+    upload(native_app, b"other")
+    status, headers, body = call_with_headers(
+        native_app, "GET", "/file_storage/all/", headers=auth + [("if-none-match", etag)]
+    )
+    assert status == 200 and headers["etag"] != etag and len(json.loads(body)["files"]) == 2
+
+
+def test_native_upload_chooses_codec_once_per_file(native_app):
+    native_app.blob_storage.chunk_size = 1024
+    native_app.blob_storage.compression = "gzip"
+    # Первый чанк сжимается хорошо, а второй хуже BLOB_COMPRESSION_MIN_RATIO,
+    # и сам по себе сохранился бы без сжатия
+    content = b"a" * 1024 + random.Random(0).randbytes(900) + bytes(124)
+
+    file_guid = upload(native_app, [content[:700], content[700:]])
+
+    file_doc = native_app.sync_db.files.find_one({"_id": file_guid})
+    assert [chunk_ref["codec"] for chunk_ref in file_doc["chunks"]] == ["gzip", "gzip"]
+    assert call(native_app, "GET", "/file_storage/", query_string=f"file_guid={file_guid}".encode()) == (
+        200, content
+    )
+
+
+def test_native_download_passes_stored_encoding_through(native_app):
+    native_app.blob_storage.compression = "gzip"
+    content = b"compressible " * 1000
+    file_guid = upload(native_app, content)
+    query_string = f"file_guid={file_guid}".encode()
+
+    status, headers, body = call_with_headers(
+        native_app, "GET", "/file_storage/", headers=[("accept-encoding", "gzip")], query_string=query_string
+    )
+    assert status == 200 and headers["content-encoding"] == "gzip"
+    assert headers["vary"] == "Accept-Encoding" and headers["etag"].endswith('-gzip"')
+    assert gzip.decompress(body) == content
+
+    status, headers, body = call_with_headers(native_app, "GET", "/file_storage/", query_string=query_string)
+    assert status == 200 and "content-encoding" not in headers and body == content
+    assert native_app.wsgi_app.test_client().get(f"/file_storage/?file_guid={file_guid}").headers["etag"] == (
+        headers["etag"]
+    )
+
+
+def test_native_download_uses_metadata_and_body_cache(native_app):
+    file_guid = upload(native_app, b"cached")
+    query_string = f"file_guid={file_guid}".encode()
+    assert call(native_app, "GET", "/file_storage/", query_string=query_string) == (200, b"cached")
+
+    native_app.sync_db.files.delete_many({})
+    native_app.sync_db.chunks.delete_many({})
+
+    assert call(native_app, "GET", "/file_storage/", query_string=query_string) == (200, b"cached")
+
+
+def test_lifespan_reports_startup_failure(async_app, monkeypatch):
+    async def fail():
+        raise RuntimeError("indexes failed")
+
+    monkeypatch.setattr(async_app, "startup", fail)
+    messages = [{"type": "lifespan.startup"}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(async_app({"type": "lifespan"}, receive, send))
+
+    assert sent == [{"type": "lifespan.startup.failed", "message": "indexes failed"}]
@@ -0,0 +1,98 @@
+import hashlib
+
+import pytest
+
+from src import server
+from src.utils.authorization import CredentialsResolver, PasswordVerifier
+
+
+def stored_hash(app, login="tester"):
+    return app.db.users.find_one({"login": login})["password"]
+
+
+def test_pbkdf2_hash_keeps_its_parameters():
+    resolver = CredentialsResolver("pbkdf2_sha256", 1000)
+    password_hash = resolver.encode("secret")
+
+    scheme, iterations, salt, derived = password_hash.split("$")
+    assert (scheme, iterations) == ("pbkdf2_sha256", "1000")
+    assert resolver.match(password_hash, "secret") and not resolver.match(password_hash, "wrong")
+    # Соль у каждого хеша своя
+    assert resolver.encode("secret") != password_hash
+    assert not resolver.needs_rehash(password_hash)
+
+
+def test_scrypt_hash_keeps_its_parameters():
+    resolver = CredentialsResolver("scrypt", scrypt_n=2 ** 10, scrypt_r=4, scrypt_p=2)
+    password_hash = resolver.encode("secret")
+
+    assert password_hash.split("$")[:4] == ["scrypt", "1024", "4", "2"]
+    assert resolver.match(password_hash, "secret") and not resolver.match(password_hash, "wrong")
+    assert not resolver.needs_rehash(password_hash)
+
+
+def test_hashes_with_other_parameters_need_rehash():
+    old_hash = CredentialsResolver("pbkdf2_sha256", 1000).encode("secret")
+    resolver = CredentialsResolver("pbkdf2_sha256", 2000)
+
+    # Старые хеши по-прежнему проверяются по своим параметрам
+    assert resolver.match(old_hash, "secret")
+    assert resolver.needs_rehash(old_hash)
+    assert CredentialsResolver("scrypt", scrypt_n=2 ** 10).needs_rehash(old_hash)
+
+
+def test_legacy_sha256_hash_is_accepted_and_needs_rehash():
+    resolver = CredentialsResolver("pbkdf2_sha256", 1000)
+    legacy_hash = hashlib.sha256(b"secret").hexdigest()
+
+    assert resolver.match(legacy_hash, "secret") and not resolver.match(legacy_hash, "wrong")
+    assert resolver.needs_rehash(legacy_hash)
+
+
+def test_unknown_scheme_is_rejected():
+    with pytest.raises(ValueError):
+        CredentialsResolver("md5")
+
+
+def test_verifier_runs_kdf_once_per_password(monkeypatch):
+    resolver = CredentialsResolver("pbkdf2_sha256", 1000)
+    verifier = PasswordVerifier(resolver)
+    password_hash = resolver.encode("secret")
+    calls = []
+    match = resolver.match
+    monkeypatch.setattr(resolver, "match", lambda *args: calls.append(args) or match(*args))
+
+    assert verifier.verify("tester", password_hash, "secret")
+    assert verifier.verify("tester", password_hash, "secret")
+    assert not verifier.verify("tester", password_hash, "wrong")
+    assert not verifier.verify("tester", password_hash, "wrong")
+
+    # Неудачные проверки не кешируются
+    assert len(calls) == 3
+
+
+def test_login_rehashes_legacy_password(app, client):
+    app.db.users.insert_one({
+        "login": "legacy", "password": hashlib.sha256(b"secret").hexdigest(), "used_bytes": 0
+    })
+
+    assert client.get("/register/check/", headers={"authorization": "legacy wrong"}).status_code == 401
+    assert "$" not in stored_hash(app, "legacy")
+
+    assert client.get("/register/check/", headers={"authorization": "legacy secret"}).status_code == 200
+    assert stored_hash(app, "legacy").startswith("pbkdf2_sha256$1000$")
+    assert client.get("/register/check/", headers={"authorization": "legacy secret"}).status_code == 200
+
+
+def test_login_rehashes_after_parameters_change(mongo, app_config, client, auth_headers, app):
+    old_hash = stored_hash(app)
+    assert old_hash.startswith("pbkdf2_sha256$1000$")
+
+    upgraded = server.App(__name__, config={**app_config, "PASSWORD_HASH_ITERATIONS": 2000}).test_client()
+    response = upgraded.get("/register/check/", headers=auth_headers)
+
+    assert response.status_code == 200
+    assert stored_hash(app).startswith("pbkdf2_sha256$2000$")
+
+    # Старый воркер проверяет новый хеш по параметрам из самого хеша
+    assert client.get("/register/check/", headers=auth_headers).status_code == 200
@@ -0,0 +1,65 @@
+import io
+import uuid
+import zipfile
+
+
+def upload_batch(client, auth_headers, files):
+    return client.post("/file_storage/batch/", data={
+        "file": [(io.BytesIO(content), filename) for filename, content in files]
+    }, headers=auth_headers, content_type="multipart/form-data")
+
+
+def download_archive(client, file_guids):
+    response = client.post("/file_storage/archive/", json={"files": file_guids})
+    assert response.status_code == 200
+    return zipfile.ZipFile(io.BytesIO(response.data))
+
+
+def test_batch_upload_creates_every_file(app, client, auth_headers):
+    response = upload_batch(client, auth_headers, [("a.txt", b"first"), ("b.txt", b"second")])
+
+    assert response.status_code == 200
+    files = response.json["files"]
+    assert [file["filename"] for file in files] == ["a.txt", "b.txt"]
+
+    for file, content in zip(files, [b"first", b"second"]):
+        assert client.get(f"/file_storage/?file_guid={file['file_guid']}").data == content
+
+    assert app.db.users.find_one({"login": "tester"})["used_bytes"] == len(b"firstsecond")
+
+
+def test_batch_upload_rejects_unnamed_files(app, client, auth_headers):
+    response = upload_batch(client, auth_headers, [("a.txt", b"first"), ("", b"second")])
+
+    assert response.status_code == 400
+    assert app.db.files.count_documents({}) == 0
+
+
+def test_archive_streams_public_files_in_request_order(app, client, auth_headers):
+    files = upload_batch(client, auth_headers, [("a.txt", b"first"), ("a.txt", b"second")]).json["files"]
+    private_guid = files[1]["file_guid"]
+    app.db.files.update_one({"_id": private_guid}, {"$set": {"public": False}})
+    legacy_guid = str(uuid.uuid1())
+    app.db.files.insert_one({
+        "_id": legacy_guid, "owner_login": "tester", "filename": "legacy.txt",
+        "file_bytes": b"legacy", "public": True
+    })
+
+    archive = download_archive(client, [legacy_guid, private_guid, files[0]["file_guid"], "unknown"])
+
+    assert archive.namelist() == ["legacy.txt", "a.txt"]
+    assert archive.read("legacy.txt") == b"legacy"
+    assert archive.read("a.txt") == b"first"
+
+
+def test_archive_keeps_duplicate_names_apart(client, auth_headers):
+    files = upload_batch(client, auth_headers, [("a.txt", b"first"), ("a.txt", b"second")]).json["files"]
+
+    archive = download_archive(client, [file["file_guid"] for file in files])
+
+    assert len(archive.namelist()) == 2
+    assert sorted(archive.read(name) for name in archive.namelist()) == [b"first", b"second"]
+
+
+def test_archive_of_unknown_files_is_rejected(client):
+    assert client.post("/file_storage/archive/", json={"files": ["unknown"]}).status_code == 400
@@ -0,0 +1,108 @@
+import time
+import datetime
+import threading
+
+from src.utils.changes import contiguous_changes, trim_changes
+
+
+def changes(client, auth_headers, **params):
+    return client.get("/file_storage/changes/", query_string=params, headers=auth_headers)
+
+
+def upload(client, auth_headers, filename="file"):
+    return client.post(f"/file_storage/?filename={filename}", data=b"content", headers=auth_headers).json["file_guid"]
+
+
+def test_feed_lists_created_and_deleted_files_in_order(client, auth_headers):
+    cursor = changes(client, auth_headers).json["cursor"]
+    first = upload(client, auth_headers, "first")
+    second = upload(client, auth_headers, "second")
+    client.delete("/file_storage/", json={"files": [first]}, headers=auth_headers)
+
+    response = changes(client, auth_headers, since=cursor).json
+
+    assert [(change["type"], change["file_guid"]) for change in response["changes"]] == [
+        ("created", first), ("created", second), ("deleted", first)
+    ]
+    assert [change["seq"] for change in response["changes"]] == [cursor + 1, cursor + 2, cursor + 3]
+    assert response["cursor"] == cursor + 3 and not response["has_more"]
+    assert changes(client, auth_headers).json["cursor"] == cursor + 3
+
+
+def test_feed_pages_by_limit(client, auth_headers):
+    for i in range(3):
+        upload(client, auth_headers, f"file{i}")
+
+    first_page = changes(client, auth_headers, since=0, limit=2).json
+    assert len(first_page["changes"]) == 2 and first_page["has_more"]
+
+    second_page = changes(client, auth_headers, since=first_page["cursor"], limit=2).json
+    assert [change["filename"] for change in second_page["changes"]] == ["file2"]
+    assert second_page["cursor"] == 3 and not second_page["has_more"]
+
+
+def test_invalid_cursors(client, auth_headers):
+    upload(client, auth_headers)
+
+    assert changes(client, auth_headers, since=-1).status_code == 400
+    assert changes(client, auth_headers, since="latest").status_code == 400
+    assert changes(client, auth_headers, since=0, limit=0).status_code == 400
+    # Курсор из будущего
+    assert changes(client, auth_headers, since=2).status_code == 410
+
+
+def test_trimmed_cursor_is_gone(app, client, auth_headers):
+    upload(client, auth_headers)
+    upload(client, auth_headers)
+
+    assert trim_changes(app.db, retention=-1) == 2
+
+    assert changes(client, auth_headers, since=1).status_code == 410
+    response = changes(client, auth_headers, since=2)
+    assert response.status_code == 200 and response.json["changes"] == []
+
+
+def test_feed_stops_at_recent_gap_and_skips_abandoned_one():
+    now = datetime.datetime.utcnow()
+    old = now - datetime.timedelta(hours=1)
+
+    # Изменение 2 еще вставляется параллельным запросом
+    recent = [{"seq": 1, "recorded_at": now}, {"seq": 3, "recorded_at": now}]
+    assert [doc["seq"] for doc in contiguous_changes(recent, 0)] == [1]
+
+    # Запрос, выделивший номер 2, упал давно
+    abandoned = [{"seq": 1, "recorded_at": old}, {"seq": 3, "recorded_at": old}]
+    assert [doc["seq"] for doc in contiguous_changes(abandoned, 0)] == [1, 3]
+
+
+def test_long_poll_times_out_without_changes(client, auth_headers):
+    started = time.monotonic()
+    response = changes(client, auth_headers, since=0, wait=0.2).json
+
+    assert time.monotonic() - started >= 0.2
+    assert response == {"changes": [], "cursor": 0, "has_more": False}
+
+
+def test_long_poll_wakes_on_upload(app, client, auth_headers):
+    app.config["CHANGES_POLL_INTERVAL"] = 30
+    responses = []
+    waiter = threading.Thread(target=lambda: responses.append(
+        changes(app.test_client(), auth_headers, since=0, wait=10).json
+    ))
+    started = time.monotonic()
+    waiter.start()
+    time.sleep(0.2)
+
+    file_guid = upload(client, auth_headers)
+    waiter.join(5)
+
+    assert not waiter.is_alive() and time.monotonic() - started < 5
+    assert [change["file_guid"] for change in responses[0]["changes"]] == [file_guid]
+
+
+def test_long_poll_wait_is_capped(app, client, auth_headers):
+    app.config["CHANGES_MAX_WAIT"] = 0.1
+    started = time.monotonic()
+
+    assert changes(client, auth_headers, since=0, wait=60).json["changes"] == []
+    assert time.monotonic() - started < 5
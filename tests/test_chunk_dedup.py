@@ -0,0 +1,124 @@
+import hashlib
+
+
+def register(client, login):
+    credentials = {"login": login, "password": "secret"}
+    client.post("/register/", json={"credentials": credentials})
+    return {"authorization": f"{login} secret"}
+
+
+def put_chunk(client, headers, data):
+    chunk_hash = hashlib.sha256(data).hexdigest()
+    response = client.put(f"/file_storage/chunks/?hash={chunk_hash}", data=data, headers=headers)
+    assert response.status_code == 200
+    return chunk_hash
+
+
+def test_chunks_of_other_owners_are_not_shared(client):
+    owner = register(client, "owner")
+    other = register(client, "other")
+    chunk_hash = put_chunk(client, owner, b"private data")
+
+    response = client.post("/file_storage/negotiate/", json={"chunks": [chunk_hash]}, headers=other)
+    assert response.json["missing"] == [chunk_hash]
+
+    response = client.post(
+        "/file_storage/commit/", json={"filename": "stolen", "chunks": [chunk_hash]}, headers=other
+    )
+    assert response.status_code == 400
+
+
+def test_owner_can_commit_uploaded_and_proven_chunks(client):
+    owner = register(client, "owner")
+    other = register(client, "other")
+    chunk_hash = put_chunk(client, owner, b"shared data")
+
+    response = client.post("/file_storage/negotiate/", json={"chunks": [chunk_hash]}, headers=owner)
+    assert response.json["missing"] == []
+
+    # Загрузив те же данные, второй пользователь доказывает, что они у него есть
+    put_chunk(client, other, b"shared data")
+    response = client.post(
+        "/file_storage/commit/", json={"filename": "copy", "chunks": [chunk_hash]}, headers=other
+    )
+    assert response.status_code == 200
+
+    response = client.get(f"/file_storage/?file_guid={response.json['file_guid']}", headers=other)
+    assert response.data == b"shared data"
+
+
+def test_claimed_sha256_does_not_replace_other_files_content(client):
+    alice = register(client, "alice")
+    mallory = register(client, "mallory")
+    alice_guid = client.post("/file_storage/?filename=a", data=b"alice data", headers=alice).json["file_guid"]
+    alice_response = client.get(f"/file_storage/?file_guid={alice_guid}")
+    chunk_hash = put_chunk(client, mallory, b"EVIL PAYLOAD")
+
+    response = client.post("/file_storage/commit/", json={
+        "filename": "evil", "chunks": [chunk_hash],
+        "sha256": hashlib.sha256(b"alice data").hexdigest()
+    }, headers=mallory)
+    mallory_response = client.get(f"/file_storage/?file_guid={response.json['file_guid']}")
+
+    assert mallory_response.data == b"EVIL PAYLOAD"
+    assert mallory_response.headers["ETag"] != alice_response.headers["ETag"]
+    assert client.get(f"/file_storage/?file_guid={alice_guid}").data == b"alice data"
+
+
+def test_gc_computes_sha256_of_committed_files(app, client):
+    from src.utils.garbage_collection import GarbageCollector
+
+    owner = register(client, "owner")
+    chunk_hash = put_chunk(client, owner, b"content")
+
+    response = client.post(
+        "/file_storage/commit/",
+        json={"filename": "file", "chunks": [chunk_hash], "sha256": "0" * 64}, headers=owner
+    )
+    file_doc = app.db.files.find_one({"_id": response.json["file_guid"]})
+    assert file_doc["sha256"] is None and file_doc["sha256_verified"] is False
+
+    collector = GarbageCollector(app.db, app.blob_storage)
+    assert collector.verify_hashes() == 1
+    file_doc = app.db.files.find_one({"_id": file_doc["_id"]})
+    assert file_doc["sha256"] == hashlib.sha256(b"content").hexdigest()
+    assert "sha256_verified" not in file_doc and "claimed_sha256" not in file_doc
+    assert collector.stats["wrong_hashes"] == 1
+    assert collector.verify_hashes() == 0
+
+    response = client.get(f"/file_storage/?file_guid={file_doc['_id']}")
+    assert response.headers["ETag"].strip('"') == file_doc["sha256"]
+
+
+def test_commit_rejects_malformed_sha256(client):
+    owner = register(client, "owner")
+    chunk_hash = put_chunk(client, owner, b"content")
+
+    response = client.post(
+        "/file_storage/commit/",
+        json={"filename": "file", "chunks": [chunk_hash], "sha256": "xyz"}, headers=owner
+    )
+    assert response.status_code == 400
+
+
+def test_commit_of_reclaimed_chunks_lists_them(app, client, monkeypatch):
+    owner = register(client, "owner")
+    kept_hash = put_chunk(client, owner, b"kept")
+    reclaimed_hash = put_chunk(client, owner, b"reclaimed")
+    resolve_chunks = app.blob_storage.resolve_chunks
+
+    def resolve_then_reclaim(chunk_hashes, owner_login):
+        # Сборщик мусора удаляет чанк между проверкой и созданием файла
+        chunk_refs = resolve_chunks(chunk_hashes, owner_login)
+        app.db.chunks.delete_one({"_id": reclaimed_hash})
+        return chunk_refs
+
+    monkeypatch.setattr(app.blob_storage, "resolve_chunks", resolve_then_reclaim)
+    response = client.post(
+        "/file_storage/commit/", json={"filename": "file", "chunks": [kept_hash, reclaimed_hash]}, headers=owner
+    )
+
+    assert response.status_code == 409
+    assert response.json["missing"] == [reclaimed_hash]
+    assert app.db.files.count_documents({}) == 0
+    assert app.db.chunks.find_one({"_id": kept_hash})["refs"] == 0
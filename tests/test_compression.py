@@ -0,0 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.utils.compression import CODECS, choose_codec
+
+
+@pytest.mark.parametrize("name", sorted(CODECS))
+def test_codecs_round_trip_from_many_threads(name):
+    codec = CODECS[name]
+    payloads = [bytes([i]) * 100000 + bytes(range(256)) * 50 for i in range(32)]
+
+    def round_trip(data):
+        return codec.decompress(codec.compress(data)) == data
+
+    with ThreadPoolExecutor(8) as executor:
+        assert all(executor.map(round_trip, payloads * 4))
+
+
+def test_incompressible_data_is_stored_as_is():
+    assert choose_codec(bytes(range(256)) * 4, "gzip", min_ratio=0.1) == "none"
+    assert choose_codec(b"a" * 4096, "gzip") == "gzip"
@@ -0,0 +1,44 @@
+import hashlib
+
+CONTENT = bytes(range(256)) * 64
+
+
+def upload(client, auth_headers, content=CONTENT):
+    response = client.post("/file_storage/?filename=data.bin", data=content, headers=auth_headers)
+    assert response.status_code == 200
+    return response.json["file_guid"]
+
+
+def test_head_then_ranged_get(client, auth_headers):
+    file_guid = upload(client, auth_headers)
+
+    response = client.head(f"/file_storage/?file_guid={file_guid}")
+    assert response.status_code == 200
+    assert response.data == b""
+    assert response.headers["Content-Length"] == str(len(CONTENT))
+    assert response.headers["Accept-Ranges"] == "bytes"
+    etag = response.headers["ETag"]
+    assert etag.strip('"') == hashlib.sha256(CONTENT).hexdigest()
+
+    response = client.get(
+        f"/file_storage/?file_guid={file_guid}",
+        headers={"Range": "bytes=100-1099", "If-Range": etag}
+    )
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 100-1099/{len(CONTENT)}"
+    assert response.data == CONTENT[100:1100]
+
+
+def test_ranged_get_with_stale_etag_returns_whole_file(client, auth_headers):
+    file_guid = upload(client, auth_headers)
+
+    response = client.get(
+        f"/file_storage/?file_guid={file_guid}",
+        headers={"Range": "bytes=0-9", "If-Range": '"stale"'}
+    )
+    assert response.status_code == 200
+    assert response.data == CONTENT
+
+
+def test_head_of_unknown_file(client):
+    assert client.head("/file_storage/?file_guid=missing").status_code == 400
@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+QtWidgets = pytest.importorskip("PyQt5.QtWidgets")
+QtCore = pytest.importorskip("PyQt5.QtCore")
+
+from src.file_table import FileTableModel
+
+
+@pytest.fixture(scope="module")
+def qt_app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+def page(start, stop):
+    return [{"filename": f"file{i}", "file_guid": f"guid{i}"} for i in range(start, stop)]
+
+
+def test_uploaded_file_is_not_duplicated_by_later_page(qt_app):
+    model = FileTableModel(lambda cursor, generation: None)
+    model.reload()
+    model.add_page(page(0, 2), "cursor", model.generation)
+    assert model.canFetchMore()
+
+    # Файл загружен, пока последняя страница еще не пришла
+    model.add_files(page(2, 3))
+    model.fetchMore()
+    model.add_page(page(2, 4), None, model.generation)
+
+    assert model.rowCount() == 4
+    assert sorted(model.file_at(row)[1] for row in range(4)) == ["guid0", "guid1", "guid2", "guid3"]
+
+
+def test_removed_file_can_be_added_again(qt_app):
+    model = FileTableModel(lambda cursor, generation: None)
+    model.reload()
+    model.add_page(page(0, 3), None, model.generation)
+
+    model.remove_files(["guid1"])
+    assert model.rowCount() == 2 and model.find_file_row("guid1") is None
+
+    model.add_files(page(1, 2))
+    assert model.rowCount() == 3 and model.find_file_row("guid1") == 2
+
+
+def test_removed_files_are_compacted_in_ranges(qt_app):
+    model = FileTableModel(lambda cursor, generation: None)
+    model.reload()
+    model.add_page(page(0, 6), None, model.generation)
+    removals = []
+    model.rowsRemoved.connect(lambda parent, first, last: removals.append((first, last)))
+
+    model.remove_files(["guid1", "guid2", "guid4", "unknown"])
+
+    assert removals == [(4, 4), (1, 2)]
+    assert len(model.filenames) == len(model.file_guids) == 3
+    assert [model.file_at(row) for row in range(3)] == [("file0", "guid0"), ("file3", "guid3"), ("file5", "guid5")]
+    assert model.find_file_row("guid5") == 2
+
+    model.add_files(page(6, 7))
+    assert model.find_file_row("guid6") == 3
+
+
+def test_page_requested_before_reload_is_dropped(qt_app):
+    requested = []
+    model = FileTableModel(lambda cursor, generation: requested.append((cursor, generation)))
+    model.reload()
+    model.add_page(page(0, 2), "old", model.generation)
+    model.fetchMore()
+    stale_generation = requested[-1][1]
+
+    model.reload()
+    model.add_page(page(10, 12), "stale", stale_generation)
+    model.page_failed(stale_generation)
+
+    assert model.rowCount() == 0 and model.loading
+    model.add_page(page(0, 1), "new", model.generation)
+    assert model.next_cursor == "new" and model.rowCount() == 1
+
+
+def test_sort_and_filter_do_not_load_every_page(qt_app):
+    requested = []
+    model = FileTableModel(lambda cursor, generation: requested.append(cursor))
+    model.reload()
+    model.add_page(page(0, 3), "cursor", model.generation)
+
+    model.sort(0, QtCore.Qt.DescendingOrder)
+    model.set_filter("FILE")
+
+    assert requested == [None]
+    assert [model.file_at(row)[0] for row in range(3)] == ["file2", "file1", "file0"]
+
+    # Следующая страница фильтруется и встает на место по сортировке
+    model.set_filter("file1")
+    model.fetchMore()
+    model.add_page([{"filename": "file10", "file_guid": "guid10"}, *page(3, 5)], None, model.generation)
+
+    assert requested == [None, "cursor"]
+    assert [model.file_at(row)[0] for row in range(model.rowCount())] == ["file10", "file1"]
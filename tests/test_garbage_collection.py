@@ -0,0 +1,104 @@
+import hashlib
+
+import pytest
+
+from src.utils import garbage_collection
+from src.utils.garbage_collection import GarbageCollector, soft_delete_files
+
+CONTENT = b"g" * 100
+
+
+@pytest.fixture
+def collector(app, monkeypatch):
+    # Надгробия и освобожденные чанки обрабатываются сразу, без задержек
+    monkeypatch.setattr(garbage_collection, "TOMBSTONE_DELAY", -1)
+    return GarbageCollector(app.db, app.blob_storage, grace_period=-1)
+
+
+def upload(client, auth_headers, filename="file"):
+    response = client.post(f"/file_storage/?filename={filename}", data=CONTENT, headers=auth_headers)
+    return response.json["file_guid"]
+
+
+def delete(client, auth_headers, *file_guids):
+    return client.delete("/file_storage/", json={"files": list(file_guids)}, headers=auth_headers)
+
+
+def used_bytes(app):
+    return app.db.users.find_one({"login": "tester"})["used_bytes"]
+
+
+def chunk_refs(app):
+    return app.db.chunks.find_one({"_id": hashlib.sha256(CONTENT).hexdigest()})["refs"]
+
+
+def test_delete_leaves_tombstone_and_releases_quota(app, client, auth_headers):
+    file_guid = upload(client, auth_headers)
+    assert used_bytes(app) == len(CONTENT)
+
+    assert delete(client, auth_headers, file_guid).status_code == 200
+
+    assert app.db.files.count_documents({}) == 0
+    tombstone = app.db.deleted_files.find_one({"_id": file_guid})
+    assert tombstone["state"] == "pending" and tombstone["owner_login"] == "tester"
+    assert used_bytes(app) == 0
+    # Ссылки чанков снимает сборщик, а не запрос удаления
+    assert chunk_refs(app) == 1
+
+
+def test_failed_delete_keeps_quota(app, client, auth_headers, collector):
+    file_guid = upload(client, auth_headers)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("delete failed")
+
+    app.db.files.delete_many = fail
+
+    try:
+        with pytest.raises(RuntimeError):
+            soft_delete_files(app.db, "tester", [file_guid])
+    finally:
+        del app.db.files.delete_many
+
+    assert used_bytes(app) == len(CONTENT)
+
+    # Надгробие уцелевшего файла снимается без изменения ссылок
+    assert collector.release_tombstones() == 1
+    assert app.db.deleted_files.count_documents({}) == 0
+    assert chunk_refs(app) == 1
+    assert client.get(f"/file_storage/?file_guid={file_guid}").data == CONTENT
+
+
+def test_shared_chunk_is_reclaimed_after_last_reference(app, client, auth_headers, collector):
+    first = upload(client, auth_headers, "first")
+    second = upload(client, auth_headers, "second")
+    assert chunk_refs(app) == 2
+
+    delete(client, auth_headers, first)
+    assert collector.release_tombstones() == 1
+    assert chunk_refs(app) == 1
+    assert collector.reclaim_chunks() == 0
+    assert client.get(f"/file_storage/?file_guid={second}").data == CONTENT
+
+    delete(client, auth_headers, second)
+    assert collector.release_tombstones() == 1
+    assert chunk_refs(app) == 0
+    assert collector.reclaim_chunks() == 1
+
+    assert app.db.chunks.count_documents({}) == 0
+    assert app.db.chunk_grants.count_documents({}) == 0
+    assert collector.stats["files"] == 2 and collector.stats["chunks"] == 1
+    assert collector.stats["bytes"] == len(CONTENT)
+
+
+def test_chunk_referenced_again_is_not_reclaimed(app, client, auth_headers, collector):
+    delete(client, auth_headers, upload(client, auth_headers))
+    collector.release_tombstones()
+    assert chunk_refs(app) == 0
+
+    # Новый файл с тем же содержимым успел сослаться на чанк
+    file_guid = upload(client, auth_headers)
+
+    assert collector.reclaim_chunks() == 0
+    assert chunk_refs(app) == 1
+    assert client.get(f"/file_storage/?file_guid={file_guid}").data == CONTENT
@@ -0,0 +1,176 @@
+import time
+import threading
+
+import pytest
+
+from src import server
+from src.utils.cache import SingleFlight
+from src.utils.links import LinkSigner
+
+
+def upload(client, auth_headers, content=b"content"):
+    return client.post("/file_storage/?filename=file.txt", data=content, headers=auth_headers).json["file_guid"]
+
+
+def create_link(client, auth_headers, file_guid, **params):
+    return client.post("/file_storage/links/", json={"file_guid": file_guid, **params}, headers=auth_headers)
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_link_serves_private_file_until_it_expires(app, client, auth_headers, monkeypatch):
+    file_guid = upload(client, auth_headers)
+    app.db.files.update_one({"_id": file_guid}, {"$set": {"public": False}})
+
+    response = create_link(client, auth_headers, file_guid, ttl=60)
+    assert response.status_code == 200
+    link = response.json["link"]
+    assert len(link) == len("l//") + 43
+
+    response = client.get("/" + link)
+    assert response.status_code == 200 and response.data == b"content"
+    max_age = int(response.headers["Cache-Control"].split("max-age=")[1])
+    assert 58 <= max_age <= 60
+
+    # Ссылка проверяется без базы, поэтому работает и в другом воркере с тем же ключом
+    other_worker = server.App(__name__, config=app.config).test_client()
+    assert other_worker.get("/" + link).data == b"content"
+
+    real_time = time.time
+    monkeypatch.setattr(time, "time", lambda: real_time() + 61)
+    assert client.get("/" + link).status_code == 404
+
+
+@pytest.mark.parametrize("params", [{"ttl": 0}, {"ttl": 31 * 24 * 60 * 60}, {"ttl": "day"}])
+def test_invalid_ttl(client, auth_headers, params):
+    file_guid = upload(client, auth_headers)
+
+    assert create_link(client, auth_headers, file_guid, **params).status_code == 400
+
+
+def test_links_only_to_own_files(app, client, auth_headers):
+    file_guid = upload(client, auth_headers)
+    client.post("/register/", json={"credentials": {"login": "other", "password": "secret"}})
+
+    assert create_link(client, {"authorization": "other secret"}, file_guid).status_code == 400
+    assert create_link(client, auth_headers, "not-a-guid").status_code == 400
+    assert client.post("/file_storage/links/", json={"file_guid": file_guid}).status_code == 401
+
+
+def test_forged_links_are_not_found(client, auth_headers):
+    file_guid = upload(client, auth_headers)
+    token = create_link(client, auth_headers, file_guid).json["link"].split("/")[1]
+    forged_token, _ = LinkSigner(b"another key").sign(file_guid)
+    tampered_token = token[:-1] + ("A" if token[-1] != "A" else "B")
+
+    for bad_token in (forged_token, tampered_token, token[:-2], "!!!"):
+        assert client.get(f"/l/{bad_token}/").status_code == 404, bad_token
+
+
+def test_link_to_deleted_file_is_not_found(client, auth_headers):
+    file_guid = upload(client, auth_headers)
+    link = create_link(client, auth_headers, file_guid).json["link"]
+    client.delete("/file_storage/", json={"files": [file_guid]}, headers=auth_headers)
+
+    assert client.get("/" + link).status_code == 404
+
+
+def test_single_flight_runs_concurrent_calls_once():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def load(value):
+        calls.append(value)
+        release.wait(5)
+        return value * 2
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(single_flight.do("key", load, 21)))
+        for _ in range(4)
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    wait_until(lambda: single_flight.coalesced == 3)
+
+    release.set()
+
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == [21] and results == [42] * 4
+    # После завершения ключ освобождается, и следующий вызов выполняется заново
+    assert single_flight.do("key", load, 1) == 2 and calls == [21, 1]
+
+
+def test_single_flight_shares_errors():
+    single_flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    errors = []
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise KeyError("missing")
+
+    def call():
+        try:
+            single_flight.do("key", fail)
+        except KeyError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+
+    wait_until(lambda: single_flight.coalesced == 1)
+
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert len(errors) == 2 and errors[0] is errors[1]
+
+
+def test_concurrent_downloads_read_file_document_once(app, client, auth_headers, monkeypatch):
+    file_guid = upload(client, auth_headers)
+    # Без кеша метаданных каждый запрос идет за документом в базу
+    app.metadata_cache = type(app.metadata_cache)(ttl=0)
+    release = threading.Event()
+    loads = []
+    load_file_document = app.load_file_document
+
+    def slow_load(guid):
+        loads.append(guid)
+        release.wait(5)
+        return load_file_document(guid)
+
+    monkeypatch.setattr(app, "load_file_document", slow_load)
+    bodies = []
+    threads = [
+        threading.Thread(target=lambda: bodies.append(app.test_client().get(f"/file_storage/?file_guid={file_guid}").data))
+        for _ in range(3)
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    wait_until(lambda: app.single_flight.coalesced == 2)
+
+    release.set()
+
+    for thread in threads:
+        thread.join(5)
+
+    assert loads == [file_guid] and bodies == [b"content"] * 3
@@ -0,0 +1,109 @@
+import json
+import datetime
+
+import pytest
+
+CREATED_AT = datetime.datetime(2021, 1, 1)
+
+
+@pytest.fixture
+def files(app, auth_headers):
+    # Пять файлов с одинаковой датой загрузки: порядок внутри нее задает _id
+    docs = [
+        {
+            "_id": f"guid{i}", "owner_login": "tester", "filename": name,
+            "size": i, "created_at": CREATED_AT + datetime.timedelta(days=i // 3)
+        }
+        for i, name in enumerate(["b.txt", "a.txt", "c[1].txt", "c.txt", "a.txt"])
+    ]
+    app.db.files.insert_many(docs)
+    app.db.files.insert_one({
+        "_id": "foreign", "owner_login": "other", "filename": "a.txt", "created_at": CREATED_AT
+    })
+    return docs
+
+
+def list_pages(client, auth_headers, **params):
+    pages = []
+    cursor = None
+
+    while True:
+        query = {**params, "cursor": cursor} if cursor else params
+        response = client.get("/file_storage/all/", query_string=query, headers=auth_headers)
+        assert response.status_code == 200, response.json
+        pages.append([file["file_guid"] for file in response.json["files"]])
+        cursor = response.json["next_cursor"]
+
+        if cursor is None:
+            return pages
+
+
+def test_pages_cover_equal_dates_without_gaps_or_duplicates(client, auth_headers, files):
+    pages = list_pages(client, auth_headers, limit=2)
+
+    assert pages == [["guid0", "guid1"], ["guid2", "guid3"], ["guid4"]]
+
+
+def test_pages_by_name_descending(client, auth_headers, files):
+    pages = list_pages(client, auth_headers, limit=2, sort="name", order="desc")
+
+    assert pages == [["guid2", "guid3"], ["guid0", "guid4"], ["guid1"]]
+
+
+def test_cursor_keeps_sort_of_its_listing(client, auth_headers, files):
+    first = client.get(
+        "/file_storage/all/", query_string={"limit": 2, "sort": "name"}, headers=auth_headers
+    ).json
+    response = client.get("/file_storage/all/", query_string={
+        "limit": 10, "sort": "date", "order": "desc", "cursor": first["next_cursor"]
+    }, headers=auth_headers)
+
+    assert [file["filename"] for file in response.json["files"]] == ["b.txt", "c.txt", "c[1].txt"]
+
+
+def test_last_full_page_has_no_next_cursor(client, auth_headers, files):
+    assert list_pages(client, auth_headers, limit=5) == [[f"guid{i}" for i in range(5)]]
+
+
+@pytest.mark.parametrize("params", [
+    {"cursor": "not a cursor"},
+    {"limit": 0},
+    {"limit": "many"},
+    {"sort": "size"},
+    {"order": "up"},
+])
+def test_invalid_listing_params(client, auth_headers, files, params):
+    assert client.get("/file_storage/all/", query_string=params, headers=auth_headers).status_code == 400
+
+
+def test_limit_is_clamped_to_max_page_size(app, client, auth_headers, files):
+    app.config["FILES_MAX_PAGE_SIZE"] = 3
+
+    assert list_pages(client, auth_headers, limit=100) == [["guid0", "guid1", "guid2"], ["guid3", "guid4"]]
+
+
+def test_prefix_is_not_a_regex(client, auth_headers, files):
+    response = client.get("/file_storage/all/", query_string={"prefix": "c["}, headers=auth_headers)
+
+    assert [file["file_guid"] for file in response.json["files"]] == ["guid2"]
+
+
+def test_date_range(client, auth_headers, files):
+    since = (CREATED_AT + datetime.timedelta(days=1)).isoformat()
+    # since в ISO формате, until - unix timestamp
+    until = (CREATED_AT + datetime.timedelta(days=2)).replace(tzinfo=datetime.timezone.utc).timestamp()
+
+    response = client.get(
+        "/file_storage/all/", query_string={"since": since, "until": until}, headers=auth_headers
+    )
+
+    assert [file["file_guid"] for file in response.json["files"]] == ["guid3", "guid4"]
+
+
+def test_ndjson_streams_every_page(client, auth_headers, files):
+    response = client.get(
+        "/file_storage/all/", query_string={"format": "ndjson", "limit": 2, "prefix": "a"}, headers=auth_headers
+    )
+    lines = [json.loads(line) for line in response.data.splitlines()]
+
+    assert [line["file_guid"] for line in lines] == ["guid1", "guid4"]
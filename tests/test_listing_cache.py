@@ -0,0 +1,18 @@
+from src import server
+
+
+def test_listing_etag_changes_after_upload_through_another_worker(mongo, app_config, client, auth_headers):
+    other_worker = server.App(__name__, config=app_config).test_client()
+
+    response = client.get("/file_storage/all/", headers=auth_headers)
+    etag = response.headers["ETag"]
+    assert response.json["files"] == []
+
+    response = client.get("/file_storage/all/", headers={**auth_headers, "If-None-Match": etag})
+    assert response.status_code == 304
+
+    other_worker.post("/file_storage/?filename=new.txt", data=b"new", headers=auth_headers)
+
+    response = client.get("/file_storage/all/", headers={**auth_headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert [file["filename"] for file in response.json["files"]] == ["new.txt"]
@@ -0,0 +1,96 @@
+from src import server
+from src.utils.metrics import MetricsRegistry
+
+CONTENT = b"m" * 1000
+
+
+def parse_metrics(text):
+    samples = {}
+
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+
+    return samples
+
+
+def get_metrics(client):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    return response.data.decode()
+
+
+def test_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    counter = registry.counter("requests_total", "Requests")
+    gauge = registry.gauge("in_flight", "In flight")
+    histogram = registry.histogram("duration_seconds", "Duration", (0.1, 1))
+    counter.inc(2, endpoint='say "hi"\\')
+    gauge.inc()
+    gauge.dec()
+    histogram.observe(0.05, endpoint="a")
+    histogram.observe(0.5, endpoint="a")
+    histogram.observe(5, endpoint="a")
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{endpoint="say \\"hi\\"\\\\"} 2',
+        "# HELP in_flight In flight",
+        "# TYPE in_flight gauge",
+        "in_flight 0",
+        "# HELP duration_seconds Duration",
+        "# TYPE duration_seconds histogram",
+        'duration_seconds_bucket{endpoint="a",le="0.1"} 1',
+        'duration_seconds_bucket{endpoint="a",le="1"} 2',
+        'duration_seconds_bucket{endpoint="a",le="+Inf"} 3',
+        'duration_seconds_sum{endpoint="a"} 5.55',
+        'duration_seconds_count{endpoint="a"} 3',
+    ]
+
+
+def test_metrics_count_requests_and_bytes(client, auth_headers):
+    file_guid = client.post("/file_storage/?filename=file", data=CONTENT, headers=auth_headers).json["file_guid"]
+    assert client.get(f"/file_storage/?file_guid={file_guid}").data == CONTENT
+
+    text = get_metrics(client)
+    samples = parse_metrics(text)
+
+    for name in (
+        "http_request_duration_seconds", "http_request_bytes_total", "http_response_bytes_total",
+        "http_requests_in_flight", "uploads_in_flight", "mongodb_queries_per_request",
+        "mongodb_time_per_request_seconds", "cache_hits", "cache_entries"
+    ):
+        assert f"# TYPE {name} " in text, name
+
+    assert samples['http_request_duration_seconds_count{endpoint="file_storage",method="POST",status="200"}'] == 1
+    assert samples['http_request_duration_seconds_count{endpoint="file_storage",method="GET",status="200"}'] == 1
+    assert samples['http_request_bytes_total{endpoint="file_storage"}'] == len(CONTENT)
+    # Тело скачивания отдается потоком и учитывается по мере отправки
+    assert samples['http_response_bytes_total{endpoint="file_storage"}'] >= len(CONTENT)
+    assert samples['mongodb_queries_per_request_count{endpoint="file_storage"}'] == 2
+    # Сам запрос /metrics еще выполняется
+    assert samples["http_requests_in_flight"] == 1
+    assert samples["uploads_in_flight"] == 0
+    assert 'cache_entries{cache="credentials"}' in samples
+
+
+def test_failed_requests_are_counted_by_status(client):
+    client.get("/file_storage/")
+
+    samples = parse_metrics(get_metrics(client))
+
+    assert samples['http_request_duration_seconds_count{endpoint="file_storage",method="GET",status="400"}'] == 1
+
+
+def test_slow_requests_are_profiled(mongo, app_config, tmp_path):
+    app = server.App(__name__, config={
+        **app_config, "PROFILE_SLOW_REQUEST_MS": 0.001, "PROFILE_DIR": str(tmp_path)
+    })
+
+    app.test_client().get("/metrics")
+
+    profiles = list(tmp_path.iterdir())
+    assert len(profiles) == 1 and "-metrics-" in profiles[0].name and profiles[0].suffix == ".prof"
@@ -0,0 +1,48 @@
+import uuid
+
+from src.utils import migrations
+
+
+def test_backfills_run_once(mongo):
+    db = mongo.migrations_test
+    db.users.insert_one({"login": "old"})
+    db.files.insert_one({"_id": str(uuid.uuid1()), "owner_login": "old", "size": 10})
+
+    migrations.backfill_created_at(db)
+    migrations.backfill_used_bytes(db)
+    assert db.users.find_one({"login": "old"})["used_bytes"] == 10
+    assert "created_at" in db.files.find_one()
+
+    # Повторный запуск ничего не пересчитывает и не сканирует
+    db.users.update_one({"login": "old"}, {"$inc": {"used_bytes": 5}})
+    db.files.insert_one({"_id": "later", "owner_login": "old", "size": 1})
+    migrations.backfill_created_at(db)
+    migrations.backfill_used_bytes(db)
+
+    assert db.users.find_one({"login": "old"})["used_bytes"] == 15
+    assert "created_at" not in db.files.find_one({"_id": "later"})
+    assert {doc["_id"] for doc in db.migrations.find()} >= {"created_at", "used_bytes"}
+
+
+
+def test_chunk_refs_backfill_races_with_another_worker(mongo, monkeypatch):
+    db = mongo.migrations_test
+    db.files.insert_one({"_id": "file", "owner_login": "old", "chunks": [{"hash": "a"}, {"hash": "b"}]})
+    db.chunks.insert_many([{"_id": "a", "size": 1}, {"_id": "b", "size": 1}])
+    find = db.chunks.find
+
+    def find_during_other_worker(*args, **kwargs):
+        # Другой воркер уже закончил ту же миграцию, и новый файл
+        # успел добавить ссылку на чанк a
+        chunk_docs = list(find(*args, **kwargs))
+        monkeypatch.setattr(db.chunks, "find", find)
+        migrations.backfill_chunk_refs(db)
+        db.chunks.update_one({"_id": "a"}, {"$inc": {"refs": 1}})
+        return chunk_docs
+
+    monkeypatch.setattr(db.chunks, "find", find_during_other_worker)
+    migrations.backfill_chunk_refs(db)
+
+    assert db.chunks.find_one({"_id": "a"})["refs"] == 2
+    assert db.chunks.find_one({"_id": "b"})["refs"] == 1
+    assert db.migrations.count_documents({"_id": "chunk_refs"}) == 1
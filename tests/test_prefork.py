@@ -0,0 +1,33 @@
+from src import prefork
+
+
+def test_workers_share_one_generated_secret_key(monkeypatch):
+    monkeypatch.setenv(prefork.SECRET_KEY_ENV, "")
+    monkeypatch.delenv(prefork.WORKER_FD_ENV, raising=False)
+    spawned = []
+
+    class Popen:
+        def __init__(self, command, env, pass_fds):
+            spawned.append(env)
+
+    def run(arbiter):
+        arbiter.socket = type("Socket", (), {"fileno": lambda self: 3})()
+        arbiter.spawn_worker()
+        arbiter.spawn_worker()
+
+    monkeypatch.setattr(prefork.subprocess, "Popen", Popen)
+    monkeypatch.setattr(prefork.Arbiter, "run", run)
+    prefork.run_from_env(None, "127.0.0.1", 0, command=["worker"])
+
+    secret_keys = {env[prefork.SECRET_KEY_ENV] for env in spawned}
+    assert len(spawned) == 2 and len(secret_keys) == 1 and len(secret_keys.pop()) == 64
+
+
+def test_explicit_secret_key_is_kept(monkeypatch):
+    monkeypatch.setenv(prefork.SECRET_KEY_ENV, "configured")
+    monkeypatch.delenv(prefork.WORKER_FD_ENV, raising=False)
+    monkeypatch.setattr(prefork.Arbiter, "run", lambda arbiter: None)
+
+    prefork.run_from_env(None, "127.0.0.1", 0, command=["worker"])
+
+    assert prefork.os.environ[prefork.SECRET_KEY_ENV] == "configured"
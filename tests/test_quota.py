@@ -0,0 +1,86 @@
+import datetime
+import hashlib
+
+import pytest
+
+from src.utils.garbage_collection import GarbageCollector
+
+CHUNK = b"q" * 1024
+
+
+@pytest.fixture
+def app_config(app_config):
+    return {
+        **app_config,
+        "BLOB_CHUNK_SIZE": 1024,
+        "UPLOAD_MAX_PART_SIZE": 1024,
+        "USER_QUOTA_BYTES": 3072,
+    }
+
+
+def used_bytes(app):
+    return app.db.users.find_one({"login": "tester"})["used_bytes"]
+
+
+def put_chunk(client, auth_headers, data=CHUNK):
+    chunk_hash = hashlib.sha256(data).hexdigest()
+    response = client.put(f"/file_storage/chunks/?hash={chunk_hash}", data=data, headers=auth_headers)
+    return chunk_hash, response.status_code
+
+
+def test_uploaded_chunks_count_once_against_quota(app, client, auth_headers):
+    chunk_hash, status = put_chunk(client, auth_headers)
+    assert status == 200 and used_bytes(app) == 1024
+
+    # Повтор загрузки того же чанка место не занимает
+    put_chunk(client, auth_headers)
+    assert used_bytes(app) == 1024
+
+    response = client.post(
+        "/file_storage/commit/", json={"filename": "f", "chunks": [chunk_hash]}, headers=auth_headers
+    )
+    assert response.status_code == 200
+    assert used_bytes(app) == 1024
+
+
+def test_chunks_over_quota_are_rejected(app, client, auth_headers):
+    for i in range(3):
+        assert put_chunk(client, auth_headers, bytes([i]) * 1024)[1] == 200
+
+    assert put_chunk(client, auth_headers, b"x" * 1024)[1] == 413
+    assert used_bytes(app) == 3072
+
+
+def test_session_parts_are_reserved_until_complete_or_abort(app, client, auth_headers):
+    session = client.post("/upload_sessions/", json={"filename": "f", "size": 2048}, headers=auth_headers).json
+    url = f"/upload_sessions/{session['session_id']}/"
+
+    client.put(url + "parts/0/", data=CHUNK, headers=auth_headers)
+    client.put(url + "parts/0/", data=CHUNK, headers=auth_headers)
+    assert used_bytes(app) == 1024
+
+    client.put(url + "parts/1/", data=CHUNK, headers=auth_headers)
+    assert client.post(url + "complete/", headers=auth_headers).status_code == 200
+    assert used_bytes(app) == 2048
+
+    session = client.post("/upload_sessions/", json={"filename": "g", "size": 1024}, headers=auth_headers).json
+    url = f"/upload_sessions/{session['session_id']}/"
+    client.put(url + "parts/0/", data=b"z" * 1024, headers=auth_headers)
+    assert used_bytes(app) == 3072
+    client.delete(url, headers=auth_headers)
+    assert used_bytes(app) == 2048
+
+
+def test_gc_releases_abandoned_reservations(app, client, auth_headers):
+    put_chunk(client, auth_headers)
+    session = client.post("/upload_sessions/", json={"filename": "f", "size": 1024}, headers=auth_headers).json
+    client.put(f"/upload_sessions/{session['session_id']}/parts/0/", data=b"p" * 1024, headers=auth_headers)
+    assert used_bytes(app) == 2048
+
+    past = datetime.datetime.utcnow() - datetime.timedelta(days=30)
+    app.db.chunk_grants.update_many({"reserved_at": {"$exists": True}}, {"$set": {"reserved_at": past}})
+    app.db.upload_sessions.update_many({}, {"$set": {"expires_at": past}})
+
+    assert GarbageCollector(app.db, app.blob_storage).release_reservations() == 2
+    assert used_bytes(app) == 0
+    assert app.db.upload_sessions.count_documents({}) == 0